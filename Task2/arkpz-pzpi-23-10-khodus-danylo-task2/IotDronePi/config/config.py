@@ -5,7 +5,15 @@
 # WiFi Configuration
 WIFI_CONFIG = {
     "SSID": "Wokwi-GUEST",
-    "PASSWORD": ""
+    "PASSWORD": "",
+    "STATIC_IP": None,  # (ip, netmask, gateway, dns) tuple to skip DHCP
+    "CACHE_PATH": "/wifi.json",  # BSSID and channel of the last access point (joined without a scan)
+    "CONNECT_TIMEOUT_MS": 10000,  # one attempt with a full scan
+    "FAST_CONNECT_TIMEOUT_MS": 3000,  # one attempt with the cached access point
+    "RETRY_BASE_MS": 500,  # first backoff after a failed attempt, doubled on every failure
+    "RETRY_MAX_MS": 30000,  # backoff cap
+    "POLL_MS": 100,  # state machine step while connecting
+    "BOOT_TIMEOUT_MS": 30000  # connect() at boot gives up after this
 }
 
 # API Configuration
@@ -14,8 +22,21 @@ API_CONFIG = {
     "AUTH_ENDPOINT": "/api/Auth/robot/login",
     "ROBOT_STATUS_ENDPOINT": "/api/Robot/status",
     "ROBOT_ME_ENDPOINT": "/api/Robot/me",
-    "REQUEST_TIMEOUT": 10,
-    "START_NODE": 25
+    "ROBOT_STATUS_BATCH_ENDPOINT": "/api/Robot/status/batch",
+    "ROBOT_STATUS_BINARY_ENDPOINT": "/api/Robot/status/binary",
+    "REQUEST_TIMEOUT": 10,  # seconds; deadline for a whole request (connect to last byte)
+    "START_NODE": 25,
+    "RETRY_ATTEMPTS": 2,  # extra attempts after a network error or 429/5xx
+    "RETRY_BASE_MS": 250,  # first backoff delay, doubled on every retry
+    "RETRY_MAX_MS": 2000,  # backoff cap
+    "NONBLOCKING": True,  # send requests from the main loop on the async client
+    "ORDER_WAIT_S": 0,  # >0: ask the server to hold order polls this long (long poll)
+    "MAX_ROUTE_POINTS": 256,  # route waypoints kept per order (8 bytes each)
+    "TOKEN_CACHE_PATH": "/auth.json",  # token and robot ID kept on flash between boots
+    "TOKEN_REFRESH_MARGIN_S": 600,  # refresh the token this long before it expires
+    "BREAKER_FAILURES": 3,  # failed attempts in a row that open an endpoint's circuit (0: off)
+    "BREAKER_OPEN_MS": 5000,  # calls skipped this long before a probe, doubled while probes fail
+    "BREAKER_MAX_OPEN_MS": 60000  # open period cap
 }
 
 # Robot Credentials (must be configured for each robot)
@@ -47,7 +68,53 @@ GPS_CONFIG = {
 # Telemetry Configuration
 TELEMETRY_CONFIG = {
     "UPDATE_INTERVAL": 5,  # seconds
-    "BATTERY_DRAIN_RATE": 0.1  # percent per second when moving
+    "BATTERY_DRAIN_RATE": 0.1,  # percent per second when moving
+    # Dead-bands: a periodic update is only sent if the state changed
+    # (status or nodes), the position moved or the battery changed by
+    # at least this much, or nothing was sent for HEARTBEAT_INTERVAL
+    "DEADBAND_POSITION_M": 10,
+    "DEADBAND_BATTERY": 1.0,  # percent
+    "HEARTBEAT_INTERVAL": 60,  # seconds
+    # Batched upload: samples are buffered and sent as one array to
+    # ROBOT_STATUS_BATCH_ENDPOINT (the server must provide it)
+    "BATCH_ENABLED": False,
+    "BATCH_SIZE": 10,  # samples per upload
+    "BATCH_SAMPLE_INTERVAL": 2,  # seconds between samples while batching
+    "BATCH_MAX_LATENCY": 20,  # seconds a sample may wait for its upload
+    "BATCH_CODEC": "json",  # "json" or "binary" (telemetry_codec, sent to ROBOT_STATUS_BINARY_ENDPOINT)
+    "BATCH_DEFLATE": False  # compress binary batches (if deflate/zlib is available)
+}
+
+# Store-and-forward outbox on flash (messages kept while offline)
+OUTBOX_CONFIG = {
+    "PATH": "/outbox.bin",
+    "CAPACITY": 512,  # 32-byte records (16 KB file); the oldest is overwritten when full
+    "REPLAY_BATCH": 16,  # records sent per replay pass
+    "COALESCE_STATUS": True  # an unsent live status update is replaced by the next one (track samples are kept)
+}
+
+# Node coordinates and types kept in RAM and on flash
+NODE_CACHE_CONFIG = {
+    "PATH": "/nodes.bin",
+    "RAM_ENTRIES": 32,  # most recently used nodes kept in RAM
+    "FLASH_SLOTS": 256,  # 20-byte records (5 KB file); a full table replaces nodes
+    "TTL_S": 86400,  # a node older than this is fetched again when used
+    "PREFETCH_AT_BOOT": True  # fetch the whole node list when the cache is empty
+}
+
+# Runtime task periods (milliseconds)
+RUNTIME_CONFIG = {
+    "FSM_TICK_MS": 200,           # FSM state processing
+    "WIFI_CHECK_MS": 2000,        # WiFi supervision
+    "BATTERY_UPDATE_MS": 1000,    # Battery simulation and critical check
+    "ORDER_CHECK_MS": 10000,      # Order polling while idle or charging
+    "ORDER_CHECK_MAX_MS": 40000,  # Polling interval cap while no orders come in
+    "ACTUATOR_IDLE_MS": 1000,     # Actuator queue check when no command is pending
+    "DELIVERED_HOLD_MS": 1000,    # Time the "delivered" screen stays up
+    "ERROR_RECOVERY_MS": 5000,    # Time in ERROR before recovering to IDLE
+    "OUTBOX_REPLAY_MS": 5000,     # Outbox check while nothing is waiting
+    "AUTH_CHECK_MS": 60000,       # Proactive token refresh check
+    "WIFI_SCAN_MS": 30000         # Access point lookup after it changed (only while not delivering)
 }
 
 # Debug Configuration
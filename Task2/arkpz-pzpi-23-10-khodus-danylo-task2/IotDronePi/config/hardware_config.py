@@ -12,7 +12,7 @@ GPIO_CONFIG = {
     "COMPARTMENT_PIN": 26,    # GPIO26 - Compartment servo (HIGH=open, LOW=closed)
 
     # Button for package pickup confirmation
-    "BUTTON_PIN": 27,         # GPIO27 - Button input (pullup, active LOW)
+    "BUTTON_PIN": 12,         # GPIO12 - Button input (pullup, active LOW, IRQ on both edges)
 
     # LED indicators
     "LED_STATUS": 32,         # GPIO32 - Status LED (blinking patterns)
@@ -24,8 +24,10 @@ HARDWARE_TIMINGS = {
     "COMPARTMENT_OPEN_TIME": 2,      # Time to fully open compartment
     "COMPARTMENT_CLOSE_TIME": 2,     # Time to fully close compartment
     "LOADING_WAIT_TIME": 5,          # Time to wait for loading at pickup
-    "BUTTON_DEBOUNCE_TIME": 0.5,     # Button debounce time
+    "BUTTON_DEBOUNCE_MS": 30,        # Ignore edges closer than this (contact bounce)
+    "BUTTON_EVENT_BUFFER": 16,       # Raw button edges kept by the IRQ ring buffer
     "LED_BLINK_INTERVAL": 0.5,       # LED blink interval for status
+    "LANDING_SETTLE_TIME": 1,        # Time to settle after landing before opening hatch
 }
 
 # Motor settings
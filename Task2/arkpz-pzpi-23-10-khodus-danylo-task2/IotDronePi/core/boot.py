@@ -0,0 +1,133 @@
+"""
+Boot Pipeline
+Runs the controller's startup steps as a dependency graph on (u)asyncio:
+every step starts as soon as the steps it needs are done, so independent
+steps (display, hardware, WiFi, server requests) overlap instead of
+waiting for each other. Like a runtime job, a step may return an
+awaitable (e.g. a request on the async client), which is awaited on the
+step's own task.
+
+The start and duration of every step are recorded, so the cold-start
+latency can be measured (see BootPipeline.report)
+"""
+
+import sys
+sys.path.append('/utils')
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from helpers import log_message
+from clock import now_ms
+
+
+class BootStep:
+    """
+    One startup step and its timing
+    """
+
+    def __init__(self, name, func, after, critical):
+        self.name = name
+        self.func = func
+        self.after = after
+        self.critical = critical
+        self.ok = None          # None: not run (skipped)
+        self.start_ms = None    # relative to the pipeline start
+        self.duration_ms = None
+
+
+class BootPipeline:
+    """
+    Startup steps with dependencies
+    """
+
+    def __init__(self):
+        self.steps = []
+        # Name of the critical step that failed, if any
+        self.failed = None
+        self.total_ms = None
+        self._started = 0
+
+    def add(self, name, func, after=(), critical=True):
+        """
+        Add a step
+
+        Args:
+            name: Step name (used in after and in the report)
+            func: Callable; may return an awaitable. Returning False or
+                  raising fails the step
+            after: Names of the steps that must be done first
+            critical: A failed critical step stops the boot; the steps
+                      after a failed non-critical one still run
+
+        Returns:
+            BootStep: Added step
+        """
+        step = BootStep(name, func, tuple(after), critical)
+        self.steps.append(step)
+        return step
+
+    async def run_async(self):
+        """
+        Run every step (coroutine)
+
+        Returns:
+            bool: True if no critical step failed
+        """
+        self._started = now_ms()
+        done = {step.name: asyncio.Event() for step in self.steps}
+        for step in self.steps:
+            for name in step.after:
+                if name not in done:
+                    raise ValueError("Boot step {} needs unknown step {}".format(step.name, name))
+        await asyncio.gather(*[self._run_step(step, done) for step in self.steps])
+        self.total_ms = now_ms() - self._started
+        return self.failed is None
+
+    def report(self):
+        """
+        Log the step timings and the total boot time
+        """
+        for step in self.steps:
+            if step.ok is None:
+                log_message("Boot {:<12} skipped".format(step.name))
+            else:
+                log_message("Boot {:<12} at {:>6} ms took {:>6} ms{}".format(
+                    step.name, step.start_ms, step.duration_ms, "" if step.ok else " (failed)"))
+        busy = sum(step.duration_ms or 0 for step in self.steps)
+        log_message("Boot done in {} ms (steps took {} ms together)".format(self.total_ms, busy))
+
+    def timings(self):
+        """
+        Get the step timings
+
+        Returns:
+            dict: Step name -> (start ms, duration ms), for steps that ran
+        """
+        return {step.name: (step.start_ms, step.duration_ms)
+                for step in self.steps if step.ok is not None}
+
+    # Internals
+
+    async def _run_step(self, step, done):
+        try:
+            for name in step.after:
+                await done[name].wait()
+            if self.failed is not None:
+                return
+            step.start_ms = now_ms() - self._started
+            try:
+                result = step.func()
+                if result is not None and hasattr(result, "send"):
+                    result = await result
+                step.ok = result is not False
+            except Exception as e:
+                log_message("Boot step {} failed: {}".format(step.name, e), "ERROR")
+                step.ok = False
+            step.duration_ms = now_ms() - self._started - step.start_ms
+            if not step.ok and step.critical and self.failed is None:
+                self.failed = step.name
+        finally:
+            done[step.name].set()
@@ -0,0 +1,164 @@
+"""
+Cooperative Runtime for the Drone Controller
+Drives the deadline scheduler on uasyncio (device) or asyncio (host)
+"""
+
+import sys
+sys.path.append('/utils')
+from helpers import log_message
+from scheduler import Scheduler
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+
+async def sleep_ms(ms):
+    """Sleep for a number of milliseconds without blocking other tasks"""
+    if hasattr(asyncio, "sleep_ms"):
+        await asyncio.sleep_ms(ms)
+    else:
+        await asyncio.sleep(ms / 1000)
+
+
+class Runtime:
+    """
+    Cooperative runtime built on (u)asyncio
+    Periodic jobs live in a deadline heap; the runtime sleeps until the next
+    one is due, which lets the event loop idle the CPU between deadlines.
+    Jobs that return an awaitable run as separate tasks so a slow job only
+    delays itself instead of the whole control loop
+    """
+
+    def __init__(self, error_handler=None, max_idle_ms=1000):
+        """
+        Args:
+            error_handler: Optional callable(task_name, exception) for task errors
+            max_idle_ms: Upper bound on a single idle sleep
+        """
+        self.scheduler = Scheduler(error_handler)
+        self.scheduler.spawn = self._spawn
+        self.error_handler = error_handler
+        self.max_idle_ms = max_idle_ms
+        self.running = False
+
+        # Jobs to run early, queued by wake() from callbacks outside the loop
+        self._wakeups = []
+        self._wake_flag = asyncio.ThreadSafeFlag() if hasattr(asyncio, "ThreadSafeFlag") else None
+
+        # Tasks awaiting a job's coroutine, by job (the event loop keeps
+        # only weak references to its tasks)
+        self._tasks = {}
+
+    def add_task(self, name, func, period_ms, guard=None, delay_ms=0):
+        """
+        Register a periodic task
+
+        Args:
+            name: Task name
+            func: Callable; may return an int (next delay) or an awaitable
+            period_ms: Period in milliseconds
+            guard: Optional callable returning False to skip a run
+            delay_ms: Delay before the first run
+
+        Returns:
+            Job: Registered scheduler job
+        """
+        return self.scheduler.add(name, func, period_ms, delay_ms, guard)
+
+    def wake(self, job):
+        """
+        Run a job as soon as possible
+        Safe to call from micropython.schedule callbacks: the heap is only
+        touched by the loop itself, and the idle sleep is cut short
+
+        Args:
+            job: Scheduler job to run
+        """
+        self._wakeups.append(job)
+        if self._wake_flag is not None:
+            self._wake_flag.set()
+
+    def stop(self):
+        """
+        Request the runtime to stop after the current job
+        """
+        self.running = False
+
+    def _spawn(self, job, awaitable):
+        self._tasks[job] = asyncio.create_task(self._await_job(job, awaitable))
+
+    async def _await_job(self, job, awaitable):
+        try:
+            await awaitable
+        except Exception as e:
+            if self.error_handler:
+                self.error_handler(job.name, e)
+            else:
+                log_message("Task {} failed: {}".format(job.name, str(e)), "ERROR")
+        finally:
+            job.busy = False
+            self._tasks.pop(job, None)
+
+    async def _run_all(self):
+        """
+        Run due jobs, then sleep until the next deadline
+        """
+        self.running = True
+        log_message("Runtime started")
+
+        while self.running:
+            while self._wakeups:
+                self.scheduler.reschedule(self._wakeups.pop(0))
+
+            delay = self.scheduler.run_due()
+            if self._wakeups:
+                continue
+            if delay is None:
+                delay = self.max_idle_ms
+            await self._idle(min(delay, self.max_idle_ms))
+
+    async def _idle(self, delay):
+        # Sleep until the next deadline or until wake() is called
+        if self._wake_flag is None:
+            await sleep_ms(delay)
+            return
+        try:
+            await asyncio.wait_for_ms(self._wake_flag.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    def run_until(self, should_continue=None, max_idle_ms=None):
+        """
+        Run jobs without an event loop (blocking)
+        Idle time goes through clock.sleep_ms, so with a clock.VirtualClock
+        installed this is a discrete-event simulation: time jumps straight
+        to the next deadline. Jobs must not return awaitables here
+
+        Args:
+            should_continue: Optional callable; stops when it returns False
+            max_idle_ms: Upper bound on a single idle sleep (default: max_idle_ms)
+        """
+        def keep_running():
+            while self._wakeups:
+                self.scheduler.reschedule(self._wakeups.pop(0))
+            return self.running and (should_continue is None or should_continue())
+
+        self.running = True
+        try:
+            self.scheduler.run(keep_running, max_idle_ms or self.max_idle_ms)
+        finally:
+            self.running = False
+
+    def run(self):
+        """
+        Run the runtime until stop() is called (blocking)
+        """
+        try:
+            asyncio.run(self._run_all())
+        finally:
+            self.running = False
+            # Reset uasyncio state so the runtime can be started again
+            if hasattr(asyncio, "new_event_loop"):
+                asyncio.new_event_loop()
@@ -0,0 +1,176 @@
+"""
+Deadline Scheduler
+Min-heap of job deadlines; the controller sleeps until the next job is due
+"""
+
+import sys
+sys.path.append('/utils')
+
+import heapq
+from clock import now_ms, sleep_ms
+from helpers import log_message
+
+
+class Job:
+    """
+    A named callable run by the scheduler every period_ms milliseconds
+    """
+
+    def __init__(self, name, func, period_ms, guard=None):
+        """
+        Args:
+            name: Job name (used in logs)
+            func: Callable to run; may return an int to override the delay
+                  until its next run, or an awaitable for the runtime to spawn
+            period_ms: Default period between runs in milliseconds
+            guard: Optional callable; the run is skipped when it returns False
+        """
+        self.name = name
+        self.func = func
+        self.period_ms = period_ms
+        self.guard = guard
+        self.deadline = 0
+        self.active = True
+        self.busy = False
+        self.runs = 0
+
+
+class Scheduler:
+    """
+    Timer heap keyed by absolute deadlines (clock.now_ms)
+    Jobs are only touched when they are due, so nothing is polled early
+    """
+
+    def __init__(self, error_handler=None):
+        """
+        Args:
+            error_handler: Optional callable(job_name, exception) for job errors
+        """
+        self._heap = []
+        self._seq = 0
+        self.error_handler = error_handler
+        # Called with (job, awaitable) when a job returns an awaitable
+        self.spawn = None
+
+    def _push(self, job, deadline):
+        job.deadline = deadline
+        self._seq += 1
+        heapq.heappush(self._heap, (deadline, self._seq, job))
+
+    def add(self, name, func, period_ms, delay_ms=0, guard=None):
+        """
+        Register a periodic job
+
+        Args:
+            name: Job name
+            func: Callable to run
+            period_ms: Period in milliseconds
+            delay_ms: Delay before the first run
+            guard: Optional callable returning False to skip a run
+
+        Returns:
+            Job: Registered job
+        """
+        job = Job(name, func, period_ms, guard)
+        self._push(job, now_ms() + delay_ms)
+        return job
+
+    def reschedule(self, job, delay_ms=0):
+        """
+        Move a job's next run to delay_ms from now
+
+        Args:
+            job: Job to reschedule
+            delay_ms: Delay in milliseconds
+        """
+        job.active = True
+        self._push(job, now_ms() + delay_ms)
+
+    def cancel(self, job):
+        """
+        Stop running a job (its heap entry is discarded lazily)
+
+        Args:
+            job: Job to cancel
+        """
+        job.active = False
+
+    def _discard_stale(self):
+        # Drop entries left behind by reschedule() or cancel()
+        heap = self._heap
+        while heap:
+            deadline, _, job = heap[0]
+            if job.active and job.deadline == deadline:
+                return
+            heapq.heappop(heap)
+
+    def next_delay_ms(self):
+        """
+        Get milliseconds until the next job is due
+
+        Returns:
+            int: Delay in milliseconds, or None if no jobs are scheduled
+        """
+        self._discard_stale()
+        if not self._heap:
+            return None
+        return max(0, self._heap[0][0] - now_ms())
+
+    def run_due(self):
+        """
+        Run every job whose deadline has passed
+
+        Returns:
+            int: Milliseconds until the next job is due, or None if no jobs remain
+        """
+        now = now_ms()
+        heap = self._heap
+
+        while True:
+            self._discard_stale()
+            if not heap or heap[0][0] > now:
+                break
+
+            deadline, _, job = heapq.heappop(heap)
+            delay = job.period_ms
+
+            if not job.busy and (job.guard is None or job.guard()):
+                try:
+                    result = job.func()
+                    job.runs += 1
+                    if type(result) is int:
+                        delay = result
+                    elif result is not None and hasattr(result, "send") and self.spawn:
+                        job.busy = True
+                        self.spawn(job, result)
+                except Exception as e:
+                    if self.error_handler:
+                        self.error_handler(job.name, e)
+                    else:
+                        log_message("Job {} failed: {}".format(job.name, str(e)), "ERROR")
+
+            # A job may have rescheduled or cancelled itself while running
+            if job.active and job.deadline == deadline:
+                # Keep the cadence, but never schedule into the past
+                # (and never into this pass, or a zero delay would spin here)
+                next_deadline = deadline + delay
+                if next_deadline <= now:
+                    next_deadline = max(now_ms() + delay, now + 1)
+                self._push(job, next_deadline)
+
+        return self.next_delay_ms()
+
+    def run(self, should_continue=None, max_idle_ms=1000):
+        """
+        Run jobs until should_continue() returns False (blocking)
+        Sleeps until the next deadline between runs
+
+        Args:
+            should_continue: Optional callable; the loop exits when it returns False
+            max_idle_ms: Upper bound on a single sleep
+        """
+        while should_continue is None or should_continue():
+            delay = self.run_due()
+            if delay is None:
+                break
+            sleep_ms(min(delay, max_idle_ms))
@@ -1,120 +1,234 @@
 """
 State Machine (FSM) for Drone Delivery System
 Manages all delivery phases and state transitions
+
+States are small integer IDs. Transition rules and state categories are
+precomputed bitmasks, and per-state handlers live in tables indexed by
+state ID, so dispatch is O(1) and allocation-free on every tick
 """
 
 import sys
 sys.path.append('/utils')
 from helpers import log_message
+from clock import now_ms
 
 
 class DroneState:
     """
-    Enum-like class for drone FSM states
+    Enum-like class for drone FSM states (integer IDs, see STATE_NAMES)
     """
     # Idle and initialization
-    IDLE = "IDLE"
+    IDLE = 0
 
     # Order fetching
-    CHECK_ORDERS = "CHECK_ORDERS"
-    ORDER_ASSIGNED = "ORDER_ASSIGNED"
+    CHECK_ORDERS = 1
+    ORDER_ASSIGNED = 2
 
     # Flight preparation
-    MOTORS_ON = "MOTORS_ON"
+    MOTORS_ON = 3
 
     # Pickup phase
-    FLIGHT_TO_PICKUP = "FLIGHT_TO_PICKUP"
-    AT_PICKUP = "AT_PICKUP"
-    OPEN_COMPARTMENT_PICKUP = "OPEN_COMPARTMENT_PICKUP"
-    LOADING = "LOADING"
-    CLOSE_COMPARTMENT_PICKUP = "CLOSE_COMPARTMENT_PICKUP"
+    FLIGHT_TO_PICKUP = 4
+    AT_PICKUP = 5
+    OPEN_COMPARTMENT_PICKUP = 6
+    LOADING = 7
+    CLOSE_COMPARTMENT_PICKUP = 8
 
     # Delivery phase
-    FLIGHT_TO_DROPOFF = "FLIGHT_TO_DROPOFF"
-    AT_DROPOFF = "AT_DROPOFF"
-    OPEN_COMPARTMENT_DROPOFF = "OPEN_COMPARTMENT_DROPOFF"
-    WAIT_FOR_PICKUP = "WAIT_FOR_PICKUP"
-    PACKAGE_DELIVERED = "PACKAGE_DELIVERED"
-    CLOSE_COMPARTMENT_DROPOFF = "CLOSE_COMPARTMENT_DROPOFF"
+    FLIGHT_TO_DROPOFF = 9
+    AT_DROPOFF = 10
+    OPEN_COMPARTMENT_DROPOFF = 11
+    WAIT_FOR_PICKUP = 12
+    PACKAGE_DELIVERED = 13
+    CLOSE_COMPARTMENT_DROPOFF = 14
 
     # Return to charging
-    FLIGHT_TO_CHARGING = "FLIGHT_TO_CHARGING"
-    AT_CHARGING_STATION = "AT_CHARGING_STATION"
-    CHARGING = "CHARGING"
+    FLIGHT_TO_CHARGING = 15
+    AT_CHARGING_STATION = 16
+    CHARGING = 17
 
     # Error handling
-    ERROR = "ERROR"
+    ERROR = 18
+
+    COUNT = 19
+
+
+# State names indexed by state ID (for logs)
+STATE_NAMES = (
+    "IDLE",
+    "CHECK_ORDERS",
+    "ORDER_ASSIGNED",
+    "MOTORS_ON",
+    "FLIGHT_TO_PICKUP",
+    "AT_PICKUP",
+    "OPEN_COMPARTMENT_PICKUP",
+    "LOADING",
+    "CLOSE_COMPARTMENT_PICKUP",
+    "FLIGHT_TO_DROPOFF",
+    "AT_DROPOFF",
+    "OPEN_COMPARTMENT_DROPOFF",
+    "WAIT_FOR_PICKUP",
+    "PACKAGE_DELIVERED",
+    "CLOSE_COMPARTMENT_DROPOFF",
+    "FLIGHT_TO_CHARGING",
+    "AT_CHARGING_STATION",
+    "CHARGING",
+    "ERROR",
+)
+
+# State category flag bits
+FLAG_BUSY = 0x01        # Delivery in progress
+FLAG_FLYING = 0x02      # Drone is in the air
+FLAG_CHARGING = 0x04    # Returning to or at the charging station
+FLAG_NOTIFY = 0x08      # Entering the state requires server notification
+
+
+def state_name(state):
+    """
+    Get printable name of a state
 
+    Args:
+        state: State ID
 
-class DroneFSM:
-    """
-    Finite State Machine for drone delivery operations
-    Manages state transitions and validates state changes
+    Returns:
+        str: State name
     """
+    if 0 <= state < DroneState.COUNT:
+        return STATE_NAMES[state]
+    return "UNKNOWN({})".format(state)
 
-    def __init__(self, robot):
-        """
-        Initialize FSM
 
-        Args:
-            robot: Robot instance
-        """
-        self.robot = robot
-        self.current_state = DroneState.IDLE
-        self.previous_state = None
-        self.state_data = {}  # Store data for current state
+def _mask(*states):
+    mask = 0
+    for state in states:
+        mask |= 1 << state
+    return mask
+
 
-        # Define valid state transitions
-        self.valid_transitions = {
-            DroneState.IDLE: [DroneState.CHECK_ORDERS, DroneState.CHARGING, DroneState.ERROR],
+def _build_transitions():
+    S = DroneState
+    table = [0] * S.COUNT
 
-            DroneState.CHECK_ORDERS: [DroneState.IDLE, DroneState.CHARGING, DroneState.ORDER_ASSIGNED, DroneState.ERROR],
+    table[S.IDLE] = _mask(S.CHECK_ORDERS, S.CHARGING, S.ERROR)
+    table[S.CHECK_ORDERS] = _mask(S.IDLE, S.CHARGING, S.ORDER_ASSIGNED, S.ERROR)
+    table[S.ORDER_ASSIGNED] = _mask(S.MOTORS_ON, S.ERROR)
+    table[S.MOTORS_ON] = _mask(S.FLIGHT_TO_PICKUP, S.ERROR)
 
-            DroneState.ORDER_ASSIGNED: [DroneState.MOTORS_ON, DroneState.ERROR],
+    table[S.FLIGHT_TO_PICKUP] = _mask(S.AT_PICKUP, S.ERROR)
+    table[S.AT_PICKUP] = _mask(S.OPEN_COMPARTMENT_PICKUP, S.ERROR)
+    table[S.OPEN_COMPARTMENT_PICKUP] = _mask(S.LOADING, S.ERROR)
+    table[S.LOADING] = _mask(S.CLOSE_COMPARTMENT_PICKUP, S.ERROR)
+    table[S.CLOSE_COMPARTMENT_PICKUP] = _mask(S.FLIGHT_TO_DROPOFF, S.ERROR)
 
-            DroneState.MOTORS_ON: [DroneState.FLIGHT_TO_PICKUP, DroneState.ERROR],
+    table[S.FLIGHT_TO_DROPOFF] = _mask(S.AT_DROPOFF, S.ERROR)
+    table[S.AT_DROPOFF] = _mask(S.OPEN_COMPARTMENT_DROPOFF, S.ERROR)
+    table[S.OPEN_COMPARTMENT_DROPOFF] = _mask(S.WAIT_FOR_PICKUP, S.ERROR)
+    table[S.WAIT_FOR_PICKUP] = _mask(S.PACKAGE_DELIVERED, S.ERROR)
+    table[S.PACKAGE_DELIVERED] = _mask(S.CLOSE_COMPARTMENT_DROPOFF, S.ERROR)
+    table[S.CLOSE_COMPARTMENT_DROPOFF] = _mask(S.FLIGHT_TO_CHARGING, S.IDLE, S.ERROR)
 
-            DroneState.FLIGHT_TO_PICKUP: [
-                DroneState.AT_PICKUP,
-                DroneState.ERROR
-            ],
+    table[S.FLIGHT_TO_CHARGING] = _mask(S.AT_CHARGING_STATION, S.ERROR)
+    table[S.AT_CHARGING_STATION] = _mask(S.CHARGING, S.ERROR)
+    table[S.CHARGING] = _mask(S.CHECK_ORDERS, S.IDLE, S.ERROR)
 
-            DroneState.AT_PICKUP: [DroneState.OPEN_COMPARTMENT_PICKUP, DroneState.ERROR],
+    table[S.ERROR] = _mask(S.IDLE)
 
-            DroneState.OPEN_COMPARTMENT_PICKUP: [DroneState.LOADING, DroneState.ERROR],
+    return tuple(table)
 
-            DroneState.LOADING: [DroneState.CLOSE_COMPARTMENT_PICKUP, DroneState.ERROR],
 
-            DroneState.CLOSE_COMPARTMENT_PICKUP: [DroneState.FLIGHT_TO_DROPOFF, DroneState.ERROR],
+def _build_flags():
+    S = DroneState
+    table = [0] * S.COUNT
 
-            DroneState.FLIGHT_TO_DROPOFF: [
-                DroneState.AT_DROPOFF,
-                DroneState.ERROR
-            ],
+    for state in (S.ORDER_ASSIGNED, S.MOTORS_ON, S.FLIGHT_TO_PICKUP, S.AT_PICKUP,
+                  S.OPEN_COMPARTMENT_PICKUP, S.LOADING, S.CLOSE_COMPARTMENT_PICKUP,
+                  S.FLIGHT_TO_DROPOFF, S.AT_DROPOFF, S.OPEN_COMPARTMENT_DROPOFF,
+                  S.WAIT_FOR_PICKUP, S.PACKAGE_DELIVERED, S.CLOSE_COMPARTMENT_DROPOFF):
+        table[state] |= FLAG_BUSY
 
-            DroneState.AT_DROPOFF: [DroneState.OPEN_COMPARTMENT_DROPOFF, DroneState.ERROR],
+    for state in (S.FLIGHT_TO_PICKUP, S.FLIGHT_TO_DROPOFF, S.FLIGHT_TO_CHARGING):
+        table[state] |= FLAG_FLYING
 
-            DroneState.OPEN_COMPARTMENT_DROPOFF: [DroneState.WAIT_FOR_PICKUP, DroneState.ERROR],
+    for state in (S.CHARGING, S.AT_CHARGING_STATION, S.FLIGHT_TO_CHARGING):
+        table[state] |= FLAG_CHARGING
 
-            DroneState.WAIT_FOR_PICKUP: [DroneState.PACKAGE_DELIVERED, DroneState.ERROR],
+    for state in (S.AT_PICKUP, S.AT_DROPOFF, S.PACKAGE_DELIVERED, S.AT_CHARGING_STATION):
+        table[state] |= FLAG_NOTIFY
 
-            DroneState.PACKAGE_DELIVERED: [DroneState.CLOSE_COMPARTMENT_DROPOFF, DroneState.ERROR],
+    return tuple(table)
+
+
+def _build_phase_names():
+    S = DroneState
+    table = ["UNKNOWN"] * S.COUNT
+    table[S.FLIGHT_TO_PICKUP] = "FLIGHT_TO_PICKUP"
+    table[S.AT_PICKUP] = "AT_PICKUP"
+    table[S.LOADING] = "LOADING"
+    table[S.FLIGHT_TO_DROPOFF] = "FLIGHT_TO_DROPOFF"
+    table[S.AT_DROPOFF] = "AT_DROPOFF"
+    table[S.WAIT_FOR_PICKUP] = "UNLOADING"
+    table[S.PACKAGE_DELIVERED] = "PACKAGE_DELIVERED"
+    table[S.FLIGHT_TO_CHARGING] = "FLIGHT_TO_CHARGING"
+    return tuple(table)
+
+
+# Bit N of TRANSITIONS[state] is set if state -> N is allowed
+TRANSITIONS = _build_transitions()
+
+# Category flags per state
+STATE_FLAGS = _build_flags()
+
+# Server phase name per state
+PHASE_NAMES = _build_phase_names()
+
+
+class DroneFSM:
+    """
+    Finite State Machine for drone delivery operations
+    Manages state transitions and validates state changes
+    """
+
+    def __init__(self, robot):
+        """
+        Initialize FSM
 
-            DroneState.CLOSE_COMPARTMENT_DROPOFF: [DroneState.FLIGHT_TO_CHARGING, DroneState.IDLE, DroneState.ERROR],
+        Args:
+            robot: Robot instance
+        """
+        self.robot = robot
+        self.current_state = DroneState.IDLE
+        self.previous_state = None
+        self.state_data = {}  # Store data for current state
+        self.entered_at = now_ms()
 
-            DroneState.FLIGHT_TO_CHARGING: [
-                DroneState.AT_CHARGING_STATION,
-                DroneState.ERROR
-            ],
+        # Handler tables indexed by state ID
+        self._on_tick = [None] * DroneState.COUNT
+        self._on_enter = [None] * DroneState.COUNT
+        self._on_exit = [None] * DroneState.COUNT
 
-            DroneState.AT_CHARGING_STATION: [DroneState.CHARGING, DroneState.ERROR],
+        log_message("FSM initialized in {} state".format(state_name(self.current_state)))
 
-            DroneState.CHARGING: [DroneState.CHECK_ORDERS, DroneState.IDLE, DroneState.ERROR],
+    def register(self, state, on_tick=None, on_enter=None, on_exit=None):
+        """
+        Register handlers for a state
 
-            DroneState.ERROR: [DroneState.IDLE]
-        }
+        Args:
+            state: State ID
+            on_tick: Called on every tick() while in the state
+            on_enter: Called after transitioning into the state
+            on_exit: Called before transitioning out of the state
+        """
+        self._on_tick[state] = on_tick
+        self._on_enter[state] = on_enter
+        self._on_exit[state] = on_exit
 
-        log_message("FSM initialized in {} state".format(self.current_state))
+    def tick(self):
+        """
+        Run the current state's tick handler
+        """
+        handler = self._on_tick[self.current_state]
+        if handler is not None:
+            handler()
 
     def can_transition_to(self, new_state):
         """
@@ -126,8 +240,7 @@ class DroneFSM:
         Returns:
             bool: True if transition is valid
         """
-        valid_states = self.valid_transitions.get(self.current_state, [])
-        return new_state in valid_states
+        return (TRANSITIONS[self.current_state] >> new_state) & 1 == 1
 
     def transition_to(self, new_state, data=None):
         """
@@ -142,13 +255,20 @@ class DroneFSM:
         """
         if not self.can_transition_to(new_state):
             log_message(
-                "Invalid state transition: {} -> {}".format(self.current_state, new_state),
+                "Invalid state transition: {} -> {}".format(
+                    state_name(self.current_state), state_name(new_state)
+                ),
                 "ERROR"
             )
             return False
 
+        exit_handler = self._on_exit[self.current_state]
+        if exit_handler is not None:
+            exit_handler()
+
         self.previous_state = self.current_state
         self.current_state = new_state
+        self.entered_at = now_ms()
 
         # Update state data
         if data:
@@ -156,7 +276,14 @@ class DroneFSM:
         else:
             self.state_data = {}
 
-        log_message("State transition: {} -> {}".format(self.previous_state, new_state))
+        log_message("State transition: {} -> {}".format(
+            state_name(self.previous_state), state_name(new_state)
+        ))
+
+        # Entry handler runs last: it may itself transition (e.g. to ERROR)
+        enter_handler = self._on_enter[new_state]
+        if enter_handler is not None:
+            enter_handler()
 
         return True
 
@@ -165,10 +292,28 @@ class DroneFSM:
         Get current FSM state
 
         Returns:
-            str: Current state
+            int: Current state ID
         """
         return self.current_state
 
+    def get_state_name(self):
+        """
+        Get name of current FSM state
+
+        Returns:
+            str: Current state name
+        """
+        return state_name(self.current_state)
+
+    def ms_in_state(self):
+        """
+        Get time spent in the current state
+
+        Returns:
+            int: Milliseconds since the last transition
+        """
+        return now_ms() - self.entered_at
+
     def get_state_data(self, key, default=None):
         """
         Get data for current state
@@ -192,49 +337,43 @@ class DroneFSM:
         """
         self.state_data[key] = value
 
+    def has_flag(self, flag):
+        """
+        Check if current state has a category flag
+
+        Args:
+            flag: FLAG_* bit
+
+        Returns:
+            bool: True if flag is set
+        """
+        return STATE_FLAGS[self.current_state] & flag != 0
+
     def is_idle(self):
         """Check if FSM is in IDLE state"""
         return self.current_state == DroneState.IDLE
 
     def is_busy(self):
         """Check if FSM is busy with a delivery"""
-        busy_states = [
-            DroneState.ORDER_ASSIGNED,
-            DroneState.MOTORS_ON,
-            DroneState.FLIGHT_TO_PICKUP,
-            DroneState.AT_PICKUP,
-            DroneState.OPEN_COMPARTMENT_PICKUP,
-            DroneState.LOADING,
-            DroneState.CLOSE_COMPARTMENT_PICKUP,
-            DroneState.FLIGHT_TO_DROPOFF,
-            DroneState.AT_DROPOFF,
-            DroneState.OPEN_COMPARTMENT_DROPOFF,
-            DroneState.WAIT_FOR_PICKUP,
-            DroneState.PACKAGE_DELIVERED,
-            DroneState.CLOSE_COMPARTMENT_DROPOFF,
-        ]
-        return self.current_state in busy_states
+        return STATE_FLAGS[self.current_state] & FLAG_BUSY != 0
 
     def is_charging(self):
         """Check if FSM is in charging states"""
-        return self.current_state in [DroneState.CHARGING, DroneState.AT_CHARGING_STATION, DroneState.FLIGHT_TO_CHARGING]
+        return STATE_FLAGS[self.current_state] & FLAG_CHARGING != 0
 
     def is_flying(self):
         """Check if drone is currently flying"""
-        flying_states = [
-            DroneState.FLIGHT_TO_PICKUP,
-            DroneState.FLIGHT_TO_DROPOFF,
-            DroneState.FLIGHT_TO_CHARGING
-        ]
-        return self.current_state in flying_states
+        return STATE_FLAGS[self.current_state] & FLAG_FLYING != 0
 
     def reset_to_idle(self):
         """
         Force reset FSM to IDLE state (emergency use only)
+        Bypasses transition rules and handlers
         """
         log_message("Force resetting FSM to IDLE state", "WARNING")
         self.previous_state = self.current_state
         self.current_state = DroneState.IDLE
+        self.entered_at = now_ms()
         self.state_data = {}
 
     def handle_error(self, error_message):
@@ -255,18 +394,7 @@ class DroneFSM:
         Returns:
             str: Phase name for server
         """
-        state_to_phase = {
-            DroneState.FLIGHT_TO_PICKUP: "FLIGHT_TO_PICKUP",
-            DroneState.AT_PICKUP: "AT_PICKUP",
-            DroneState.LOADING: "LOADING",
-            DroneState.FLIGHT_TO_DROPOFF: "FLIGHT_TO_DROPOFF",
-            DroneState.AT_DROPOFF: "AT_DROPOFF",
-            DroneState.WAIT_FOR_PICKUP: "UNLOADING",
-            DroneState.PACKAGE_DELIVERED: "PACKAGE_DELIVERED",
-            DroneState.FLIGHT_TO_CHARGING: "FLIGHT_TO_CHARGING",
-        }
-
-        return state_to_phase.get(self.current_state, "UNKNOWN")
+        return PHASE_NAMES[self.current_state]
 
     def should_notify_server(self):
         """
@@ -275,13 +403,7 @@ class DroneFSM:
         Returns:
             bool: True if should notify server
         """
-        notify_states = [
-            DroneState.AT_PICKUP,
-            DroneState.AT_DROPOFF,
-            DroneState.PACKAGE_DELIVERED,
-            DroneState.AT_CHARGING_STATION
-        ]
-        return self.current_state in notify_states
+        return STATE_FLAGS[self.current_state] & FLAG_NOTIFY != 0
 
     def __str__(self):
         """
@@ -290,4 +412,4 @@ class DroneFSM:
         Returns:
             str: FSM state info
         """
-        return "FSM(state={}, data={})".format(self.current_state, self.state_data)
+        return "FSM(state={}, data={})".format(state_name(self.current_state), self.state_data)
@@ -0,0 +1,51 @@
+"""
+Hardware Abstraction Layer
+Selects the device (MicroPython) or host (CPython) backend for the
+machine, network, HTTP, JSON and display drivers used by the modules
+
+The host backend is used when "--host" is passed on the command line
+or when the machine module is not available (running on a PC)
+"""
+
+import sys
+
+sys.path.append('/hal')
+sys.path.append('/libs')
+
+
+def _use_host_backend():
+    if "--host" in sys.argv:
+        return True
+    try:
+        import machine
+        return False
+    except ImportError:
+        return True
+
+
+HOST = _use_host_backend()
+
+if HOST:
+    import host_machine as machine
+    import host_network as network
+    import host_urequests as urequests
+    import json as ujson
+    from host_display import I2cLcd, TM1637
+else:
+    import machine
+    import network
+    import urequests
+    import ujson
+    from i2c_lcd import I2cLcd
+    from tm1637 import TM1637
+
+Pin = machine.Pin
+PWM = machine.PWM
+I2C = machine.I2C
+
+if HOST:
+    flash_path = machine.flash_path
+else:
+    def flash_path(path):
+        """Device files live on the board's own flash filesystem"""
+        return path
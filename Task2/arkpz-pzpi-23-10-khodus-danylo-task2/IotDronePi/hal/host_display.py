@@ -0,0 +1,137 @@
+"""
+Host backend for the display drivers
+In-memory LCD2004 and TM1637 with the same methods as the device drivers
+"""
+
+
+class I2cLcd:
+    """
+    In-memory character LCD (i2c_lcd.I2cLcd / lcd_api.LcdApi subset)
+    The screen contents can be read back with get_lines()
+    """
+
+    def __init__(self, i2c, i2c_addr, num_lines, num_columns):
+        self.i2c = i2c
+        self.i2c_addr = i2c_addr
+        self.num_lines = min(num_lines, 4)
+        self.num_columns = min(num_columns, 40)
+        self.cursor_x = 0
+        self.cursor_y = 0
+        self.implied_newline = False
+        self.backlight = True
+        self.display = True
+        self.custom_chars = {}
+        self._rows = [bytearray(b" " * self.num_columns) for _ in range(self.num_lines)]
+
+    def clear(self):
+        for row in self._rows:
+            row[:] = b" " * self.num_columns
+        self.cursor_x = 0
+        self.cursor_y = 0
+
+    def show_cursor(self):
+        pass
+
+    def hide_cursor(self):
+        pass
+
+    def blink_cursor_on(self):
+        pass
+
+    def blink_cursor_off(self):
+        pass
+
+    def display_on(self):
+        self.display = True
+
+    def display_off(self):
+        self.display = False
+
+    def backlight_on(self):
+        self.backlight = True
+
+    def backlight_off(self):
+        self.backlight = False
+
+    def move_to(self, cursor_x, cursor_y):
+        self.cursor_x = cursor_x
+        self.cursor_y = cursor_y
+
+    def putchar(self, char):
+        if char == '\n':
+            if not self.implied_newline:
+                self.cursor_x = self.num_columns
+        else:
+            if self.cursor_y < self.num_lines and self.cursor_x < self.num_columns:
+                code = ord(char)
+                self._rows[self.cursor_y][self.cursor_x] = code if code < 256 else 0x3F
+            self.cursor_x += 1
+        if self.cursor_x >= self.num_columns:
+            self.cursor_x = 0
+            self.cursor_y += 1
+            if self.cursor_y >= self.num_lines:
+                self.cursor_y = 0
+
+    def putstr(self, string):
+        end = self.cursor_x + len(string)
+        if end <= self.num_columns and self.cursor_y < self.num_lines and '\n' not in string:
+            # Fast path: the text fits on the current row
+            self._rows[self.cursor_y][self.cursor_x:end] = string.encode("latin-1", "replace")
+            if end < self.num_columns:
+                self.cursor_x = end
+            else:
+                self.cursor_x = 0
+                self.cursor_y = (self.cursor_y + 1) % self.num_lines
+            return
+        for char in string:
+            self.putchar(char)
+
+    def custom_char(self, location, charmap):
+        self.custom_chars[location & 0x7] = bytes(charmap)
+
+    def get_lines(self):
+        """
+        Get the screen contents (custom characters shown as '#')
+
+        Returns:
+            list: One string per row
+        """
+        return [
+            "".join(chr(c) if c >= 32 else "#" for c in row)
+            for row in self._rows
+        ]
+
+
+class TM1637:
+    """
+    In-memory 4-digit 7-segment display (tm1637.TM1637 subset)
+    """
+
+    def __init__(self, clk, dio, brightness=7):
+        if not 0 <= brightness <= 7:
+            raise ValueError("Brightness must be 0-7")
+        self.clk = clk
+        self.dio = dio
+        self._brightness = brightness
+        self.text = "    "
+
+    def brightness(self, val=None):
+        if val is None:
+            return self._brightness
+        if not 0 <= val <= 7:
+            raise ValueError("Brightness must be 0-7")
+        self._brightness = val
+
+    def write(self, segments, pos=0):
+        if not 0 <= pos <= 3:
+            raise ValueError("Pos must be 0-3")
+
+    def hex(self, val):
+        self.show('{:04x}'.format(val & 0xffff))
+
+    def number(self, num):
+        num = max(-999, min(num, 9999))
+        self.show('{0: >4d}'.format(num))
+
+    def show(self, string, colon=False):
+        self.text = (string + "    ")[:4]
@@ -0,0 +1,216 @@
+"""
+Host backend for the machine module
+Simulated Pin, PWM and I2C peripherals that keep their state in memory
+"""
+
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import threading
+
+sys.path.append('/utils')
+
+from helpers import log_message
+
+# Board that new Pin objects belong to, per thread (see set_board)
+_board = threading.local()
+
+
+def set_board(board_id):
+    """
+    Select the simulated board that Pin(n) refers to in this thread
+    A fleet simulation gives every robot its own board, so their buttons
+    and outputs do not share pins
+
+    Args:
+        board_id: Any hashable board identifier (0 is the default board)
+    """
+    _board.id = board_id
+
+
+# Simulated flash: HOST_FLASH_DIR keeps files between runs, otherwise
+# every process starts with an empty flash that is removed at exit
+_flash_root = os.environ.get("HOST_FLASH_DIR")
+
+
+def flash_path(path):
+    """
+    Map a path on the device filesystem to a file of the simulated board
+    Every board gets its own folder, like every robot has its own flash
+
+    Args:
+        path: Device path, e.g. "/outbox.bin"
+
+    Returns:
+        str: Host file path (its folder exists)
+    """
+    global _flash_root
+    if _flash_root is None:
+        _flash_root = tempfile.mkdtemp(prefix="robot-flash-")
+        atexit.register(shutil.rmtree, _flash_root, True)
+    folder = os.path.join(_flash_root, "board-{}".format(getattr(_board, "id", 0)))
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, path.lstrip("/"))
+
+
+class Pin:
+    """
+    Simulated GPIO pin
+    Writing a new level (value(), on(), off()) runs the IRQ handler the
+    same way an edge on the real pin would, so tests and simulators can
+    drive inputs such as the button
+    """
+
+    IN = 1
+    OUT = 3
+    OPEN_DRAIN = 7
+    PULL_UP = 2
+    PULL_DOWN = 1
+    IRQ_FALLING = 2
+    IRQ_RISING = 1
+
+    # Pin objects by (board, GPIO number), so Pin(12) always refers to the same pin
+    _pins = {}
+
+    def __new__(cls, pin_id, *args, **kwargs):
+        key = (getattr(_board, "id", 0), pin_id)
+        pin = cls._pins.get(key)
+        if pin is None:
+            pin = object.__new__(cls)
+            pin.id = pin_id
+            pin.mode = cls.IN
+            pin.pull = None
+            pin._value = 0
+            pin._irq_handler = None
+            pin._irq_trigger = 0
+            cls._pins[key] = pin
+        return pin
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.init(mode, pull, value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        """
+        Reconfigure the pin (arguments left at -1 are unchanged)
+        """
+        if mode != -1:
+            self.mode = mode
+        if pull != -1:
+            self.pull = pull
+            # An unconnected input with pull-up reads high
+            if pull == self.PULL_UP:
+                self._value = 1
+        if value is not None:
+            self.value(value)
+
+    def value(self, level=None):
+        """
+        Get or set the pin level
+        """
+        if level is None:
+            return self._value
+
+        level = 1 if level else 0
+        old = self._value
+        self._value = level
+
+        if self._irq_handler is not None and level != old:
+            edge = self.IRQ_RISING if level else self.IRQ_FALLING
+            if self._irq_trigger & edge:
+                self._irq_handler(self)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        """
+        Set the edge handler
+        """
+        self._irq_handler = handler
+        self._irq_trigger = trigger
+
+    def __call__(self, level=None):
+        return self.value(level)
+
+    def __repr__(self):
+        return "Pin({})".format(self.id)
+
+
+class PWM:
+    """
+    Simulated PWM output
+    """
+
+    def __init__(self, pin, freq=0, duty=0):
+        self.pin = pin
+        self._freq = freq
+        self._duty = duty
+
+    def freq(self, value=None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty(self, value=None):
+        if value is None:
+            return self._duty
+        self._duty = value
+
+    def duty_u16(self, value=None):
+        if value is None:
+            return self._duty * 64
+        self._duty = value // 64
+
+    def deinit(self):
+        self._duty = 0
+
+
+class I2C:
+    """
+    Simulated I2C bus
+    Devices are registered by address; writes are kept for inspection
+    """
+
+    # Addresses that answer a scan (the LCD2004 backpack by default)
+    devices = [0x27]
+
+    def __init__(self, bus_id=0, scl=None, sda=None, freq=400000):
+        self.bus_id = bus_id
+        self.scl = scl
+        self.sda = sda
+        self.freq = freq
+        self.writes = 0
+
+    def scan(self):
+        return list(self.devices)
+
+    def writeto(self, addr, buf, stop=True):
+        if addr not in self.devices:
+            raise OSError(19)  # ENODEV, as on the device
+        self.writes += 1
+        return len(buf)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        if addr not in self.devices:
+            raise OSError(19)
+        return bytes(nbytes)
+
+
+def freq(value=None):
+    """CPU frequency (fixed on the host)"""
+    return 240000000
+
+
+def unique_id():
+    return b"\x00\x00\x00\x00\x00\x01"
+
+
+def reset():
+    """There is no board to reset on the host: stop the process instead"""
+    log_message("machine.reset() called on host - exiting", "WARNING")
+    raise SystemExit(1)
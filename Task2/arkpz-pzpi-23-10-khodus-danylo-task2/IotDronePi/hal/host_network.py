@@ -0,0 +1,133 @@
+"""
+Host backend for the network module
+Fake WLAN interface: the PC's own network connection is used for HTTP,
+so connecting only flips the interface state
+
+Connecting takes no time unless a simulation sets the radio timings
+below: a connect without a known BSSID and channel scans every channel
+first, and without a static IP it waits for DHCP
+"""
+
+import sys
+
+sys.path.append('/utils')
+
+from clock import now_ms
+
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+STAT_NO_AP_FOUND = 201
+STAT_WRONG_PASSWORD = 202
+STAT_BEACON_TIMEOUT = 200
+STAT_CONNECT_FAIL = 203
+
+# Set to False to simulate an access point that cannot be reached
+available = True
+
+# Access points in range, as returned by WLAN.scan():
+# (ssid, bssid, channel, RSSI, security, hidden)
+access_points = [(b"Wokwi-GUEST", b"\x02\x00\x5e\x10\x00\x01", 6, -50, 0, False)]
+
+# Radio timings in milliseconds (simulations set these)
+SCAN_MS = 0       # scan of all channels
+JOIN_MS = 0       # authenticate and associate with a known BSSID on a known channel
+DHCP_MS = 0       # DHCP lease (skipped with a static IP)
+
+
+class WLAN:
+    """
+    Simulated WLAN interface (one instance per interface, as on the ESP32)
+    """
+
+    _interfaces = {}
+
+    def __new__(cls, interface_id=STA_IF):
+        wlan = cls._interfaces.get(interface_id)
+        if wlan is None:
+            wlan = object.__new__(cls)
+            wlan.interface_id = interface_id
+            wlan._active = False
+            wlan._status = STAT_IDLE
+            wlan._ready_at = 0
+            wlan._joins = False
+            wlan._channel = 1
+            wlan._static = None
+            wlan.ssid = None
+            wlan.bssid = None
+            cls._interfaces[interface_id] = wlan
+        return wlan
+
+    def active(self, is_active=None):
+        if is_active is None:
+            return self._active
+        self._active = bool(is_active)
+        if not self._active:
+            self._status = STAT_IDLE
+
+    def scan(self):
+        if not self._active:
+            raise OSError("WLAN not active")
+        return list(access_points) if available else []
+
+    def config(self, *args, **kwargs):
+        if "channel" in kwargs:
+            self._channel = kwargs["channel"]
+        if args and args[0] == "channel":
+            return self._channel
+        if args and args[0] == "ssid":
+            return self.ssid
+        return None
+
+    def connect(self, ssid=None, key=None, *, bssid=None):
+        if not self._active:
+            raise OSError("WLAN not active")
+        self.ssid = ssid
+        ap = None
+        for entry in access_points:
+            if entry[0] == (ssid or "").encode() and (bssid is None or entry[1] == bssid):
+                ap = entry
+        if ap is not None and bssid is not None and ap[2] == self._channel:
+            delay = JOIN_MS
+        else:
+            delay = SCAN_MS + JOIN_MS
+        self._joins = ap is not None and available
+        if self._joins:
+            self.bssid = ap[1]
+            self._channel = ap[2]
+            if not self._static:
+                delay += DHCP_MS
+        self._status = STAT_CONNECTING
+        self._ready_at = now_ms() + delay
+
+    def disconnect(self):
+        self._status = STAT_IDLE
+        self._ready_at = 0
+
+    def drop(self):
+        """
+        Simulate a lost link (the access point stopped answering); the
+        driver does not reconnect on its own
+        """
+        self._status = STAT_BEACON_TIMEOUT
+
+    def isconnected(self):
+        return self._active and available and self.status() == STAT_GOT_IP
+
+    def status(self, param=None):
+        if param == "rssi":
+            return -50
+        if self._status == STAT_CONNECTING and now_ms() >= self._ready_at:
+            self._status = STAT_GOT_IP if self._joins and available else STAT_NO_AP_FOUND
+        return self._status
+
+    def ifconfig(self, config=None):
+        if config is not None:
+            self._static = config
+            return None
+        if self._static:
+            return self._static
+        return ("127.0.0.1", "255.0.0.0", "127.0.0.1", "127.0.0.1")
@@ -0,0 +1,204 @@
+"""
+Host backend for urequests
+Same call signatures and Response object as MicroPython's urequests,
+sent through http.client (or through a pluggable transport)
+"""
+
+import json
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+# Optional callable(method, url, body, headers) -> (status_code, body_bytes)
+# or (status_code, body_bytes, response_headers with lowercase names)
+# Replaces the network round trip, e.g. with an in-process fake API
+transport = None
+
+# Seconds before a connection or read gives up
+timeout = 10
+
+
+class Response:
+    """
+    HTTP response (urequests.Response subset)
+    """
+
+    def __init__(self, status_code, content, reason="", headers=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.content = content
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        pass
+
+
+def _open_connection(scheme, host, port):
+    if scheme == "https":
+        return http.client.HTTPSConnection(host, port, timeout=timeout)
+    return http.client.HTTPConnection(host, port, timeout=timeout)
+
+
+def _split(url):
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    return (parts.scheme, parts.hostname, parts.port), path
+
+
+def _headers(response):
+    return {name.lower(): value for name, value in response.getheaders()}
+
+
+def _http_transport(method, url, body, headers):
+    key, path = _split(url)
+    conn = _open_connection(*key)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read(), _headers(response)
+    finally:
+        conn.close()
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections shared by every caller in the process
+    Usable as a transport (urequests.transport = ConnectionPool()); safe
+    to call from several threads. Idle connections are kept per host and
+    reused, so many simulated robots do not open a socket per request
+    """
+
+    # A reused connection the server already closed fails with one of these
+    _STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                     BrokenPipeError, ConnectionResetError, ConnectionAbortedError)
+
+    def __init__(self, max_idle_per_host=64):
+        """
+        Args:
+            max_idle_per_host: Idle connections kept open per host
+        """
+        self.max_idle_per_host = max_idle_per_host
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.reused += 1
+                return idle.pop(), True
+            self.opened += 1
+        return _open_connection(*key), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def __call__(self, method, url, body, headers):
+        key, path = _split(url)
+        conn, reused = self._acquire(key)
+        try:
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+            except self._STALE_ERRORS:
+                if not reused:
+                    raise
+                # Idle connection was closed by the server: retry on a new one
+                conn.close()
+                conn, reused = _open_connection(*key), False
+                with self._lock:
+                    self.opened += 1
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+        return response.status, content, _headers(response)
+
+    def close(self):
+        """
+        Close every idle connection
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+
+def request(method, url, data=None, json=None, headers=None):
+    """
+    Send an HTTP request
+
+    Args:
+        method: HTTP method
+        url: Absolute URL
+        data: Optional str or bytes body
+        json: Optional object sent as a JSON body
+        headers: Optional dict of headers
+
+    Returns:
+        Response: Server response
+    """
+    headers = dict(headers) if headers else {}
+
+    if json is not None:
+        data = _dumps(json)
+        headers.setdefault("Content-Type", "application/json")
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+
+    send = transport or _http_transport
+    result = send(method, url, data, headers)
+    return Response(result[0], result[1] or b"", headers=result[2] if len(result) > 2 else None)
+
+
+# The json argument shadows the module inside request()
+_dumps = json.dumps
+
+
+def get(url, **kw):
+    return request("GET", url, **kw)
+
+
+def post(url, **kw):
+    return request("POST", url, **kw)
+
+
+def put(url, **kw):
+    return request("PUT", url, **kw)
+
+
+def patch(url, **kw):
+    return request("PATCH", url, **kw)
+
+
+def delete(url, **kw):
+    return request("DELETE", url, **kw)
+
+
+def head(url, **kw):
+    return request("HEAD", url, **kw)
@@ -1,7 +1,10 @@
-import time
 import sys
 import gc
-from machine import Pin
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 
 # Run garbage collection before any imports
 gc.collect()
@@ -11,16 +14,30 @@ sys.path.append('/config')
 sys.path.append('/core')
 sys.path.append('/modules')
 sys.path.append('/utils')
+sys.path.append('/hal')
+
+# On a PC (python main.py --host) the folders sit next to main.py
+if sys.implementation.name != "micropython":
+    import os
+    _base_dir = os.path.dirname(os.path.abspath(__file__))
+    for _folder in ("config", "core", "modules", "utils", "hal"):
+        sys.path.append(os.path.join(_base_dir, _folder))
 
 # Import configuration
-from config import DEBUG
+from config import DEBUG, API_CONFIG, RUNTIME_CONFIG, TELEMETRY_CONFIG, GPS_CONFIG, OUTBOX_CONFIG, \
+    NODE_CACHE_CONFIG
+from hardware_config import HARDWARE_TIMINGS
 
 # Import core classes
 from robot import Robot, RobotState as RobotStatus
 from state_machine import DroneFSM, DroneState
+from runtime import Runtime, sleep_ms as async_sleep_ms
+from boot import BootPipeline
 
 # Import utility functions
 from helpers import log_message
+from clock import now_ms, sleep_ms
+from hal import HOST
 
 # Import managers
 from wifi_manager import WiFiManager
@@ -29,6 +46,10 @@ from gps_simulator import GPSSimulator
 from battery_manager import BatteryManager
 from telemetry import TelemetryManager
 from order_manager import OrderManager
+from http_client import get_client
+from outbox import Outbox, MessageKind
+from node_cache import NodeCache
+from api_client import is_transient
 from hardware_controller import HardwareController
 from display_manager import DisplayManager
 
@@ -46,7 +67,19 @@ class RobotControllerFSM:
     Orchestrates all subsystems using finite state machine
     """
 
-    def __init__(self):
+    def __init__(self, robot_config=None, headless=False, wifi_manager=None):
+        """
+        Args:
+            robot_config: Optional per-robot overrides for SERIAL_NUMBER and
+                          ACCESS_KEY (ROBOT_CONFIG) and START_NODE (API_CONFIG),
+                          so several controllers can run in one process
+            headless: Skip the pause that keeps a boot error screen readable
+            wifi_manager: Optional WiFiManager shared with other controllers
+        """
+        robot_config = robot_config or {}
+        self.headless = headless
+        self.start_node_id = robot_config.get("START_NODE", API_CONFIG.get("START_NODE", 25))
+
         log_message("=" * 50)
         log_message("IoT Robot Delivery System (FSM) Starting...")
         log_message("=" * 50)
@@ -56,102 +89,205 @@ class RobotControllerFSM:
 
         # Initialize FSM
         self.fsm = DroneFSM(self.robot)
+        self.register_state_handlers()
 
         # Initialize managers
-        self.wifi_manager = WiFiManager()
-        self.auth_manager = AuthManager()
+        self.wifi_manager = wifi_manager or WiFiManager()
+        self.auth_manager = AuthManager(
+            robot_config.get("SERIAL_NUMBER"),
+            robot_config.get("ACCESS_KEY"),
+            self.start_node_id
+        )
         self.gps_simulator = None
         self.battery_manager = None
         self.telemetry_manager = None
         self.order_manager = None
+        self.outbox = None
+        self.node_cache = None
+        self.start_node = None
         self.hardware_controller = None
         self.display_manager = None
 
         # System state
         self.running = True
         self.initialized = False
+        self.boot = None
 
-        # Timers
-        self.last_order_check_time = 0
-        self.order_check_interval = 10  # Check for orders every 10 seconds
+        # Cooperative runtime (created in main_loop)
+        self.runtime = None
+        self.outbox_job = None
+        self.outbox_call = None
+        self.wifi_online = True
 
         # Home charging station coordinates
         self.home_charging_lat = None
         self.home_charging_lon = None
         self.home_charging_node_id = None
 
-        self.button = None 
-
     def initialize(self):
         """
         Initialize all subsystems
+        The boot steps run as a pipeline (see build_boot_pipeline):
+        steps that do not depend on each other overlap, and the time of
+        every step is logged
+
+        Returns:
+            bool: True if the robot is ready
         """
         log_message("Initializing robot subsystems...")
 
+        self.boot = self.build_boot_pipeline()
+        http = None
+        if API_CONFIG.get("NONBLOCKING", True):
+            # Server requests of the boot steps run side by side on an
+            # async client of their own (its sockets belong to this loop)
+            from async_http import AsyncHttpClient
+            http = AsyncHttpClient()
         try:
-            from machine import Pin
-            self.button = Pin(12, Pin.IN, Pin.PULL_UP)
-            log_message("Button initialized on Pin 12")
-        except Exception as e:
-            log_message(f"Failed to init button: {e}", "WARNING")
-
-        # Step 1: Connect to WiFi FIRST (before display to save memory)
-        log_message("Connecting to WiFi: {}".format(self.wifi_manager.wifi_ssid))
-        gc.collect()  # Free memory before WiFi init
-
-        if not self.wifi_manager.connect():
-            log_message("Failed to connect to WiFi. Cannot proceed.", "ERROR")
-            # Try to show error on display if it gets initialized
-            try:
-                if self.display_manager is None:
-                    self.display_manager = DisplayManager()
-                self.display_manager.display_wifi_error()
-            except:
-                pass
-            time.sleep(3)
+            ok = asyncio.run(self._run_boot(http))
+        finally:
+            # Reset uasyncio state for the runtime's event loop
+            if hasattr(asyncio, "new_event_loop"):
+                asyncio.new_event_loop()
+        self.boot.report()
+
+        if not ok:
+            log_message("Boot step {} failed. Cannot proceed.".format(self.boot.failed), "ERROR")
+            if self.boot.failed == "wifi":
+                # The LCD was not brought up yet
+                try:
+                    if self.display_manager is None:
+                        self.display_manager = DisplayManager()
+                except Exception:
+                    pass
+                self.show("display_wifi_error")
+            elif self.boot.failed == "auth":
+                self.show("display_auth_error")
+            self.pause(3000)
             return False
 
-        # Step 2: Initialize display AFTER WiFi is connected
-        log_message("Initializing display...")
-        self.display_manager = DisplayManager()
-        self.display_manager.display_boot()
-        time.sleep(1)
+        self.initialized = True
+        log_message("Robot initialization complete!")
+        log_message("=" * 50)
 
-        # Show WiFi connected status
+        return True
+
+    def build_boot_pipeline(self):
+        """
+        Declare the boot steps and what each one needs
+
+        Returns:
+            BootPipeline: Steps, not run yet
+        """
+        boot = BootPipeline()
+        boot.add("hardware", self.boot_hardware)
+        boot.add("managers", self.boot_managers)
+        boot.add("wifi", self.boot_wifi)
+        # LCD buffers are allocated after the WiFi stack took its memory
+        boot.add("display", self.boot_display, after=("wifi",))
+        boot.add("auth", self.boot_auth, after=("wifi", "display"))
+        # Independent requests: run side by side
+        boot.add("robot_info", self.boot_robot_info, after=("auth", "managers"), critical=False)
+        boot.add("start_node", self.boot_start_node, after=("auth", "managers"), critical=False)
+        boot.add("position", self.boot_position, after=("start_node",))
+        boot.add("telemetry", self.boot_telemetry, after=("robot_info", "position"), critical=False)
+        return boot
+
+    async def _run_boot(self, http):
+        api = self.auth_manager.api
+        if http is not None:
+            api.set_nonblocking(True, http)
+        try:
+            ok = await self.boot.run_async()
+            # Let requests submitted by the steps (initial telemetry) finish
+            while api.pending():
+                await async_sleep_ms(10)
+            return ok
+        finally:
+            if http is not None:
+                api.set_nonblocking(False)
+                http.close()
+
+    # Boot steps (see build_boot_pipeline); in non-blocking mode the
+    # network steps return coroutines that the pipeline awaits
+
+    def boot_display(self):
+        """LCD init (after WiFi, to save memory) and the WiFi screen"""
+        self.display_manager = DisplayManager()
         ip = self.wifi_manager.wlan.ifconfig()[0] if self.wifi_manager.wlan else "0.0.0.0"
         self.display_manager.display_wifi_connected(self.wifi_manager.wifi_ssid, ip)
-        time.sleep(2)
-
-        # Step 3: Authenticate with server
-        self.display_manager.display_authenticating()
-        if not self.auth_manager.login():
-            log_message("Failed to authenticate with server. Cannot proceed.", "ERROR")
-            self.display_manager.display_auth_error()
-            time.sleep(3)
-            return False
 
-        # Set robot ID from authentication
-        self.robot.robot_id = self.auth_manager.get_robot_id()
-        self.display_manager.display_auth_success(self.robot.robot_id)
-        time.sleep(2)
+    def boot_hardware(self):
+        """Motors, LEDs and button"""
+        self.hardware_controller = HardwareController()
 
-        # Step 4: Initialize managers (without GPS yet)
+    def boot_managers(self):
+        """Managers that need no server (GPS waits for the start position)"""
         self.battery_manager = BatteryManager(self.robot)
-        self.telemetry_manager = TelemetryManager(self.robot, self.auth_manager)
-        self.order_manager = OrderManager(self.robot, self.auth_manager)
-        self.hardware_controller = HardwareController()
+        self.outbox = Outbox()
+        self.outbox.open()
+        self.node_cache = NodeCache(self.auth_manager.api)
+        self.telemetry_manager = TelemetryManager(self.robot, self.auth_manager, self.outbox)
+        self.order_manager = OrderManager(self.robot, self.auth_manager, self.outbox)
+
+    def boot_wifi(self):
+        """Connect to WiFi"""
+        log_message("Connecting to WiFi: {}".format(self.wifi_manager.wifi_ssid))
+        if not self.wifi_manager.initialized:
+            gc.collect()  # Free memory before WiFi init
+        if self.auth_manager.api.is_nonblocking():
+            return self.wifi_manager.connect_async()
+        return self.wifi_manager.connect()
+
+    def boot_auth(self):
+        """Log in (token from the flash cache when it is still valid)"""
+        self.show("display_authenticating")
+        if self.auth_manager.api.is_nonblocking():
+            return self._auth_async()
+        return self._auth_done(self.auth_manager.login())
+
+    async def _auth_async(self):
+        return self._auth_done(await self.auth_manager.login_async())
+
+    def _auth_done(self, authenticated):
+        if not authenticated:
+            return False
+        self.robot.robot_id = self.auth_manager.get_robot_id()
+        self.show("display_auth_success", self.robot.robot_id)
+
+    def boot_robot_info(self):
+        """Robot information from the server"""
+        if self.auth_manager.api.is_nonblocking():
+            return self._robot_info_async()
+        self._robot_info_done(self.telemetry_manager.fetch_robot_info())
 
-        # Step 5: Fetch robot information from server
-        robot_info = self.telemetry_manager.fetch_robot_info()
+    async def _robot_info_async(self):
+        self._robot_info_done(await self.telemetry_manager.fetch_robot_info_async())
+
+    def _robot_info_done(self, robot_info):
         if robot_info:
             log_message("Robot initialized: {}".format(self.robot))
         else:
             log_message("Warning: Could not fetch robot info from server", "WARNING")
 
-        # Step 6: Fetch START_NODE coordinates and set robot position
-        from config import API_CONFIG
-        start_node_id = API_CONFIG.get("START_NODE", 25)
-        start_node = self.telemetry_manager.fetch_node_info(start_node_id)
+    def boot_start_node(self):
+        """START_NODE coordinates (first boot: all nodes at once; later boots read them from flash)"""
+        prefetch = not len(self.node_cache) and NODE_CACHE_CONFIG.get("PREFETCH_AT_BOOT", True)
+        if self.auth_manager.api.is_nonblocking():
+            return self._start_node_async(prefetch)
+        if prefetch:
+            self.node_cache.prefetch()
+        self.start_node = self.node_cache.get(self.start_node_id)
+
+    async def _start_node_async(self, prefetch):
+        if prefetch:
+            await self.node_cache.prefetch_async()
+        self.start_node = await self.node_cache.get_async(self.start_node_id)
+
+    def boot_position(self):
+        """Set the robot position from the start node; charge if it is a station"""
+        start_node_id = self.start_node_id
+        start_node = self.start_node
 
         start_node_is_charging_station = False
 
@@ -180,161 +316,330 @@ class RobotControllerFSM:
         else:
             log_message("Warning: Could not fetch start node, using config defaults", "WARNING")
 
-        # Step 7: Initialize GPS simulator (after robot position is set)
+        # GPS simulator starts from the robot position set above
         self.gps_simulator = GPSSimulator(self.robot)
 
-        # Step 8: If starting at charging station, begin charging
+        # If starting at charging station, begin charging
         if start_node_is_charging_station:
             log_message("Initializing at charging station - starting charge cycle")
             self.battery_manager.start_charging()
             self.robot.set_status("Charging")
             self.fsm.transition_to(DroneState.CHARGING)
 
-        # Step 9: Send initial telemetry
+    def boot_telemetry(self):
+        """Initial telemetry"""
         self.telemetry_manager.send_status_update(force=True)
 
-        self.initialized = True
-        log_message("Robot initialization complete!")
-        log_message("=" * 50)
+    def show(self, screen, *args):
+        """
+        Draw a boot screen if the display is up (boot does not wait for it)
 
-        return True
+        Args:
+            screen: DisplayManager method name, e.g. "display_auth_success"
+            *args: Arguments of that method
+        """
+        if self.display_manager is not None:
+            getattr(self.display_manager, screen)(*args)
+
+    def pause(self, ms):
+        """
+        Hold an error screen for a moment (skipped when headless)
+        """
+        if not self.headless:
+            sleep_ms(ms)
 
     def main_loop(self):
         """
         Main control loop with FSM
+        Runs every subsystem as a job on the deadline scheduler;
+        the loop sleeps until the next job is due
         """
         log_message("Entering main control loop with FSM...")
 
-        while self.running:
-            try:
-                # Check WiFi connection
-                if not self.wifi_manager.reconnect_if_needed():
-                    log_message("WiFi connection lost. Retrying...", "WARNING")
-                    self.display_manager.display_wifi_error()
-                    time.sleep(5)
-                    continue
-
-                # Update battery
-                self.battery_manager.update_battery()
-
-                # Check for critical battery
-                if self.battery_manager.check_battery_critical():
-                    if not self.battery_manager.is_charging:
-                        log_message("Battery critical! Emergency charging", "WARNING")
-                        self.handle_emergency_battery()
-                        continue
-
-                # Update GPS position if moving
-                if self.gps_simulator.is_moving:
-                    still_moving = self.gps_simulator.update_position()
-
-                    if not still_moving:
-                        # Reached destination
-                        self.handle_arrival_at_destination()
-
-                # Send telemetry update
-                if self.telemetry_manager.should_send_update():
-                    self.telemetry_manager.send_status_update()
-
-                # Process FSM state
-                self.process_current_state()
-
-                # Small delay to prevent excessive CPU usage
-                time.sleep(0.5)
-
-            except KeyboardInterrupt:
-                log_message("Received shutdown signal", "WARNING")
-                self.running = False
-                break
-            except Exception as e:
-                log_message("Error in main loop: {}".format(str(e)), "ERROR")
-                self.display_manager.display_error("Sys Error: " + str(e))
-                self.fsm.handle_error(str(e))
-                time.sleep(1)
+        self.setup_runtime()
 
-    def process_current_state(self):
-        """
-        Process current FSM state and execute appropriate actions
+        # Requests go through the async client while the event loop runs,
+        # so a slow server does not hold up the other tasks
+        api = self.auth_manager.api
+        api.set_nonblocking(API_CONFIG.get("NONBLOCKING", True))
+        try:
+            self.runtime.run()
+        except KeyboardInterrupt:
+            log_message("Received shutdown signal", "WARNING")
+        finally:
+            api.set_nonblocking(False)
+            self.running = False
+
+    def setup_runtime(self, runtime=None, wrap_task=None, name_prefix=""):
         """
-        state = self.fsm.get_current_state()
-
-        if state == DroneState.IDLE:
-            self.state_idle()
-
-        elif state == DroneState.CHECK_ORDERS:
-            self.state_check_orders()
+        Register every subsystem task on a runtime
+        (the simulators drive the same tasks with Runtime.run_until)
 
-        elif state == DroneState.ORDER_ASSIGNED:
-            self.state_order_assigned()
+        Args:
+            runtime: Runtime to use; a new one is created by default.
+                     A fleet simulation passes one runtime shared by all robots
+            wrap_task: Optional callable(name, func) returning the function to schedule
+            name_prefix: Prefix for task names (tells robots apart in a fleet)
 
-        elif state == DroneState.MOTORS_ON:
-            self.state_motors_on()
+        Returns:
+            Runtime: Configured runtime
+        """
+        if runtime is None:
+            runtime = Runtime(error_handler=self.handle_task_error)
+        self.runtime = runtime
+
+        def add(name, func, period_ms, guard=None):
+            if wrap_task:
+                func = wrap_task(name, func)
+            return runtime.add_task(name_prefix + name, func, period_ms, guard=guard)
+
+        add("wifi", self.task_wifi, RUNTIME_CONFIG["WIFI_CHECK_MS"])
+        add("battery", self.task_battery, RUNTIME_CONFIG["BATTERY_UPDATE_MS"])
+        add("gps", self.task_gps, GPS_CONFIG["UPDATE_INTERVAL"] * 1000)
+        add("telemetry", self.task_telemetry, TELEMETRY_CONFIG["UPDATE_INTERVAL"] * 1000)
+        self.outbox_job = add("outbox", self.task_outbox, RUNTIME_CONFIG["OUTBOX_REPLAY_MS"],
+                              guard=self.is_online)
+        # New messages (phase updates) are sent right away when online
+        self.outbox.on_push = lambda: runtime.wake(self.outbox_job)
+        add("orders", self.task_order_poll, RUNTIME_CONFIG["ORDER_CHECK_MS"], guard=self.is_online)
+        add("auth", self.task_auth, RUNTIME_CONFIG["AUTH_CHECK_MS"], guard=self.is_online)
+        add("wifi_scan", self.task_wifi_scan, RUNTIME_CONFIG["WIFI_SCAN_MS"], guard=self.can_scan_wifi)
+        fsm_job = add("fsm", self.process_current_state,
+                      RUNTIME_CONFIG["FSM_TICK_MS"], guard=self.is_online)
+
+        # Button edges run the FSM right away instead of at its next tick
+        self.hardware_controller.set_button_callback(lambda: runtime.wake(fsm_job))
+
+        # Actuator steps run when due; queuing a command wakes the job early
+        actuator_job = add("actuators", self.hardware_controller.update,
+                           RUNTIME_CONFIG["ACTUATOR_IDLE_MS"])
+        self.hardware_controller.set_wake_callback(lambda: runtime.wake(actuator_job))
+
+        return runtime
+
+    # Runtime tasks
+
+    def is_online(self):
+        """Guard for network-dependent tasks"""
+        return self.wifi_online
+
+    def can_scan_wifi(self):
+        """Guard for the access point scan: only while online and not on a delivery"""
+        return self.wifi_online and self.wifi_manager.scan_needed and not self.fsm.is_busy()
+
+    def task_wifi(self):
+        """WiFi supervision task (steps the connect state machine)"""
+        if not self.running:
+            self.runtime.stop()
+            return
+
+        # Runs every POLL_MS while connecting, at its period once connected
+        delay = self.wifi_manager.poll()
+        if self.wifi_manager.is_connected():
+            if not self.wifi_online:
+                # Sockets opened before the drop are dead, and endpoints
+                # that failed during the outage get another chance now
+                self.close_connections()
+                self.auth_manager.api.breakers.reset()
+                # Send what was stored while offline
+                if self.outbox_job is not None:
+                    self.runtime.wake(self.outbox_job)
+            self.wifi_online = True
+        else:
+            if self.wifi_online:
+                log_message("WiFi connection lost. Retrying...", "WARNING")
+                self.display_manager.display_wifi_error()
+            self.wifi_online = False
+        return delay
+
+    def close_connections(self):
+        """Close the keep-alive connections of the blocking and the async HTTP client"""
+        get_client().close()
+        if self.auth_manager.api.async_http is not None:
+            self.auth_manager.api.async_http.close()
+        from async_http import close_async_client
+        close_async_client()
+
+    def task_wifi_scan(self):
+        """Look up the access point after a connection made without it (blocks for the scan)"""
+        self.wifi_manager.scan_access_point()
+
+    def task_battery(self):
+        """Battery simulation and critical level check"""
+        self.battery_manager.update_battery()
+
+        if self.battery_manager.check_battery_critical():
+            if not self.battery_manager.is_charging:
+                log_message("Battery critical! Emergency charging", "WARNING")
+                self.handle_emergency_battery()
+
+    def task_gps(self):
+        """GPS movement simulation"""
+        if self.gps_simulator.is_moving:
+            still_moving = self.gps_simulator.update_position()
+
+            if not still_moving:
+                # Reached destination
+                self.handle_arrival_at_destination()
+
+    def task_telemetry(self):
+        """
+        Periodic telemetry upload; reschedules itself after forced updates
+        While offline the samples go to the outbox
+        """
+        telemetry = self.telemetry_manager
+        if telemetry.should_send_update():
+            if self.wifi_online:
+                telemetry.send_status_update()
+            else:
+                telemetry.store_status_update()
+        elif self.wifi_online and telemetry.batch_due():
+            telemetry.flush_batch()
+        return telemetry.ms_until_next_update()
 
-        elif state == DroneState.FLIGHT_TO_PICKUP:
-            self.state_flight_to_pickup()
+    def task_outbox(self):
+        """
+        Deliver outbox messages (phase updates, samples stored while
+        offline) oldest first, one request at a time; a message is removed
+        once the server answered it
+        """
+        call = self.outbox_call
+        if call is not None and not call.done:
+            # Previous message still on its way
+            return RUNTIME_CONFIG["FSM_TICK_MS"]
+        self.outbox_call = None
+        if call is not None and is_transient(call.status):
+            # Server still unreachable: try again at the normal period
+            return None
+        if not len(self.outbox):
+            return None
+
+        for _ in range(OUTBOX_CONFIG["REPLAY_BATCH"]):
+            call = self.send_stored_message(self.outbox.take())
+            if not call.done:
+                self.outbox_call = call
+                return RUNTIME_CONFIG["FSM_TICK_MS"]
+            if is_transient(call.status):
+                return None
+            if not len(self.outbox):
+                return None
+        # More waiting: next pass soon, other jobs run in between
+        return RUNTIME_CONFIG["FSM_TICK_MS"]
+
+    def send_stored_message(self, message):
+        """
+        Send one outbox message (from Outbox.take); it is dropped from
+        the outbox once the server answered (kept when the answer was
+        transient)
 
-        elif state == DroneState.AT_PICKUP:
-            self.state_at_pickup()
+        Returns:
+            ApiCall: Request for the message
+        """
+        def on_done(status, data):
+            self.outbox.release(not is_transient(status))
 
-        elif state == DroneState.OPEN_COMPARTMENT_PICKUP:
-            self.state_open_compartment_pickup()
+        if message["kind"] == MessageKind.PHASE:
+            return self.order_manager.replay_phase(message, on_done)
+        return self.telemetry_manager.replay_status(message, on_done)
 
-        elif state == DroneState.LOADING:
-            self.state_loading()
+    def task_auth(self):
+        """
+        Refresh the token shortly before it expires, so requests do not
+        run into a 401 first; in non-blocking mode the login runs in the
+        background
+        """
+        auth = self.auth_manager
+        if not auth.refresh_due():
+            return None
+        if auth.api.is_nonblocking():
+            return auth.refresh_token_async()
+        auth.refresh_token()
+        return None
+
+    def task_order_poll(self):
+        """
+        Poll the server for orders while idle or charged enough at the station
+        The next poll comes sooner after orders and deliveries, later while idle
+        """
+        state = self.fsm.get_current_state()
 
-        elif state == DroneState.CLOSE_COMPARTMENT_PICKUP:
-            self.state_close_compartment_pickup()
+        if state == DroneState.IDLE:
+            self.fsm.transition_to(DroneState.CHECK_ORDERS)
 
-        elif state == DroneState.FLIGHT_TO_DROPOFF:
-            self.state_flight_to_dropoff()
+        elif state == DroneState.CHARGING:
+            # Robot can still receive orders when Status=Charging and BatteryLevel>=95
+            # FSM will return to CHARGING if no orders
+            if self.robot.battery_level >= 95:
+                self.fsm.transition_to(DroneState.CHECK_ORDERS)
 
-        elif state == DroneState.AT_DROPOFF:
-            self.state_at_dropoff()
+        return self.order_manager.poll_delay_ms()
 
-        elif state == DroneState.OPEN_COMPARTMENT_DROPOFF:
-            self.state_open_compartment_dropoff()
+    def handle_task_error(self, task_name, error):
+        """
+        Handle an exception raised by a runtime task
+        """
+        log_message("Error in {} task: {}".format(task_name, str(error)), "ERROR")
+        self.display_manager.display_error("Sys Error: " + str(error))
+        self.fsm.handle_error(str(error))
 
-        elif state == DroneState.WAIT_FOR_PICKUP:
-            self.state_wait_for_pickup()
+    def process_current_state(self):
+        """
+        Process current FSM state (table dispatch, see register_state_handlers)
+        """
+        self.fsm.tick()
 
-        elif state == DroneState.PACKAGE_DELIVERED:
-            self.state_package_delivered()
+    def register_state_handlers(self):
+        """
+        Bind FSM states to their tick and entry handlers
+        """
+        S = DroneState
+        register = self.fsm.register
 
-        elif state == DroneState.CLOSE_COMPARTMENT_DROPOFF:
-            self.state_close_compartment_dropoff()
+        register(S.IDLE, self.state_idle)
+        register(S.CHECK_ORDERS, self.state_check_orders, self.enter_check_orders)
+        register(S.ORDER_ASSIGNED, self.state_order_assigned)
+        register(S.MOTORS_ON, self.state_motors_on, self.enter_motors_on)
 
-        elif state == DroneState.FLIGHT_TO_CHARGING:
-            self.state_flight_to_charging()
+        register(S.FLIGHT_TO_PICKUP, self.state_flight_to_pickup, self.enter_flight_to_pickup)
+        register(S.AT_PICKUP, self.state_await_action, self.enter_at_pickup)
+        register(S.OPEN_COMPARTMENT_PICKUP, self.state_await_action, self.enter_open_compartment_pickup)
+        register(S.LOADING, self.state_loading, self.enter_wait_for_button)
+        register(S.CLOSE_COMPARTMENT_PICKUP, self.state_await_action, self.enter_close_compartment_pickup)
 
-        elif state == DroneState.AT_CHARGING_STATION:
-            self.state_at_charging_station()
+        register(S.FLIGHT_TO_DROPOFF, self.state_flight_to_dropoff, self.enter_flight_with_motors)
+        register(S.AT_DROPOFF, self.state_await_action, self.enter_at_dropoff)
+        register(S.OPEN_COMPARTMENT_DROPOFF, self.state_await_action, self.enter_open_compartment_dropoff)
+        register(S.WAIT_FOR_PICKUP, self.state_wait_for_pickup, self.enter_wait_for_button)
+        register(S.PACKAGE_DELIVERED, self.state_package_delivered, self.enter_package_delivered)
+        register(S.CLOSE_COMPARTMENT_DROPOFF, self.state_await_action, self.enter_close_compartment_dropoff)
 
-        elif state == DroneState.CHARGING:
-            self.state_charging()
+        register(S.FLIGHT_TO_CHARGING, self.state_flight_to_charging, self.enter_flight_with_motors)
+        register(S.AT_CHARGING_STATION, self.state_at_charging_station, self.enter_at_charging_station)
+        register(S.CHARGING, self.state_charging)
 
-        elif state == DroneState.ERROR:
-            self.state_error()
+        register(S.ERROR, self.state_error, self.enter_error)
 
     # FSM State Handlers
+    # enter_* run once on transition into a state, state_* run on every tick
 
     def state_idle(self):
-        """IDLE state: Wait and check for orders periodically"""
+        """IDLE state: Wait for the order polling task"""
         self.display_manager.display_idle(self.robot)
         
         # Ensure robot status is Idle
         if self.robot.status != "Idle":
             self.robot.set_status("Idle")
 
-        current_time = time.time()
-
-        if current_time - self.last_order_check_time >= self.order_check_interval:
-            self.last_order_check_time = current_time
-            self.fsm.transition_to(DroneState.CHECK_ORDERS)
+    def enter_check_orders(self):
+        self.display_manager.display_checking_orders(self.robot)
 
     def state_check_orders(self):
         """CHECK_ORDERS state: Fetch orders from server"""
-        self.display_manager.display_checking_orders(self.robot)
-        orders = self.order_manager.fetch_assigned_orders()
+        done, call = self.state_call(self.order_manager.request_assigned_orders)
+        if not done:
+            # Answer not in yet; the other tasks keep running
+            return
+        orders = self.order_manager.assigned_orders(call)
 
         if orders and len(orders) > 0:
             # Take first order
@@ -356,10 +661,20 @@ class RobotControllerFSM:
             self.display_manager.display_order_assigned(self.robot, order_id)
 
             # Accept order on server
-            if self.order_manager.accept_order(order_id):
+            done, call = self.state_call(self.order_manager.request_accept, order_id)
+            if not done:
+                return
+
+            if self.order_manager.order_accepted(order_id, call):
+                # Orders can be taken while charging: leave the pad first
+                if self.battery_manager.is_charging:
+                    self.battery_manager.stop_charging()
+                if self.robot.status == "Charging":
+                    self.robot.set_status("Idle")
+
                 # Start order locally
                 if self.order_manager.start_order(order):
-                    self.fsm.transition_to(DroneState.MOTORS_ON)
+                    self.fsm.transition_to(DroneState.MOTORS_ON, {"order": order})
                 else:
                     log_message("Failed to start order locally", "ERROR")
                     self.fsm.transition_to(DroneState.ERROR)
@@ -369,37 +684,39 @@ class RobotControllerFSM:
         else:
             self.fsm.transition_to(DroneState.IDLE)
 
-    def state_motors_on(self):
-        """MOTORS_ON state: Start motors and begin flight"""
+    def enter_motors_on(self):
         # Show preparing/motors starting
         order = self.fsm.get_state_data("order")
         order_id = order.get("orderId") if order else "..."
         self.display_manager.display_order_assigned(self.robot, order_id)
-        
-        self.hardware_controller.start_motors()
-        self.fsm.transition_to(DroneState.FLIGHT_TO_PICKUP)
+
+        self.start_action(self.hardware_controller.start_motors())
+
+    def state_motors_on(self):
+        """MOTORS_ON state: Take off once motors are up to speed"""
+        if self.action_done():
+            self.fsm.transition_to(DroneState.FLIGHT_TO_PICKUP)
+
+    def enter_flight_to_pickup(self):
+        # Set destination
+        pickup_coords = self.order_manager.get_pickup_coordinates()
+        if pickup_coords:
+            self.gps_simulator.set_destination(pickup_coords[0], pickup_coords[1])
+
+            # Notify server
+            self.order_manager.update_order_phase("FLIGHT_TO_PICKUP")
+        else:
+            log_message("No pickup coordinates available", "ERROR")
+            self.fsm.handle_error("No pickup coordinates")
 
     def state_flight_to_pickup(self):
         """FLIGHT_TO_PICKUP state: Flying to pickup location"""
         self.display_manager.display_flight_to_pickup(self.robot)
-        
-        # Check if destination has been set (one-time setup)
-        if not self.gps_simulator.is_moving:
-            # Set destination
-            pickup_coords = self.order_manager.get_pickup_coordinates()
-            if pickup_coords:
-                self.gps_simulator.set_destination(pickup_coords[0], pickup_coords[1])
-
-                # Notify server
-                self.order_manager.update_order_phase("FLIGHT_TO_PICKUP")
-            else:
-                log_message("No pickup coordinates available", "ERROR")
-                self.fsm.handle_error("No pickup coordinates")
 
-    def state_at_pickup(self):
+    def enter_at_pickup(self):
         """AT_PICKUP state: Arrived at pickup location"""
         self.display_manager.display_at_pickup(self.robot)
-        
+
         # Update current node to pickup node
         pickup_node_id = self.order_manager.get_pickup_node_id()
         if pickup_node_id:
@@ -409,59 +726,58 @@ class RobotControllerFSM:
         # Notify server
         self.order_manager.update_order_phase("AT_PICKUP")
 
-        # Stop motors
-        self.hardware_controller.stop_motors()
-
-        # Transition to open compartment
-        time.sleep(1)
-        self.fsm.transition_to(DroneState.OPEN_COMPARTMENT_PICKUP)
+        # Stop motors, then transition to open compartment
+        self.start_action(self.land(), DroneState.OPEN_COMPARTMENT_PICKUP)
 
-    def state_open_compartment_pickup(self):
+    def enter_open_compartment_pickup(self):
         """OPEN_COMPARTMENT_PICKUP state: Open compartment for loading"""
         self.display_manager.display_at_pickup(self.robot) # Still at pickup
-        self.hardware_controller.open_compartment()
-        self.fsm.transition_to(DroneState.LOADING, {"entry_time": time.time()})
+        self.start_action(self.hardware_controller.open_compartment(), DroneState.LOADING)
+
+    def enter_wait_for_button(self):
+        # Only presses made while the hatch is open count
+        self.hardware_controller.clear_button_events()
 
     def state_loading(self):
+        """LOADING state: Wait for sender to confirm with the button"""
         self.display_manager.display_loading(self.robot, 0)
-        
-        if self.button.value() == 0:
+
+        if self.hardware_controller.is_button_pressed():
             log_message("Button pressed - Package loaded")
- 
-            time.sleep(0.2) 
-        
             self.fsm.transition_to(DroneState.CLOSE_COMPARTMENT_PICKUP)
 
-    def state_close_compartment_pickup(self):
+    def enter_close_compartment_pickup(self):
         """CLOSE_COMPARTMENT_PICKUP state: Close compartment after loading"""
         self.display_manager.display_custom_message("Package Loaded!", "Closing hatch...", "Preparing for", "takeoff")
-        self.hardware_controller.close_compartment()
-        self.fsm.transition_to(DroneState.FLIGHT_TO_DROPOFF)
+        self.start_action(self.hardware_controller.close_compartment(), DroneState.FLIGHT_TO_DROPOFF)
+
+    def enter_flight_with_motors(self):
+        # Motors were stopped on landing; start them before departing
+        self.start_action(self.hardware_controller.start_motors())
 
     def state_flight_to_dropoff(self):
         """FLIGHT_TO_DROPOFF state: Flying to dropoff location"""
         self.display_manager.display_flight_to_dropoff(self.robot)
-        
-        # Check if destination has been set (one-time setup)
-        if not self.gps_simulator.is_moving:
-            # Start motors
-            self.hardware_controller.start_motors()
-
-            # Set destination
-            dropoff_coords = self.order_manager.get_dropoff_coordinates()
-            if dropoff_coords:
-                self.gps_simulator.set_destination(dropoff_coords[0], dropoff_coords[1])
-
-                # Notify server
-                self.order_manager.update_order_phase("FLIGHT_TO_DROPOFF")
-            else:
-                log_message("No dropoff coordinates available", "ERROR")
-                self.fsm.handle_error("No dropoff coordinates")
 
-    def state_at_dropoff(self):
+        # One-time setup once motors are up to speed
+        if not self.depart():
+            return
+
+        # Set destination
+        dropoff_coords = self.order_manager.get_dropoff_coordinates()
+        if dropoff_coords:
+            self.gps_simulator.set_destination(dropoff_coords[0], dropoff_coords[1])
+
+            # Notify server
+            self.order_manager.update_order_phase("FLIGHT_TO_DROPOFF")
+        else:
+            log_message("No dropoff coordinates available", "ERROR")
+            self.fsm.handle_error("No dropoff coordinates")
+
+    def enter_at_dropoff(self):
         """AT_DROPOFF state: Arrived at dropoff location"""
         self.display_manager.display_at_dropoff(self.robot)
-        
+
         # Update current node to dropoff node
         dropoff_node_id = self.order_manager.get_dropoff_node_id()
         if dropoff_node_id:
@@ -471,86 +787,80 @@ class RobotControllerFSM:
         # Notify server
         self.order_manager.update_order_phase("AT_DROPOFF")
 
-        # Stop motors
-        self.hardware_controller.stop_motors()
-
-        # Transition to open compartment
-        time.sleep(1)
-        self.fsm.transition_to(DroneState.OPEN_COMPARTMENT_DROPOFF)
+        # Stop motors, then transition to open compartment
+        self.start_action(self.land(), DroneState.OPEN_COMPARTMENT_DROPOFF)
 
-    def state_open_compartment_dropoff(self):
+    def enter_open_compartment_dropoff(self):
         """OPEN_COMPARTMENT_DROPOFF state: Open compartment for unloading"""
         self.display_manager.display_at_dropoff(self.robot)
-        self.hardware_controller.open_compartment()
-        self.fsm.transition_to(DroneState.WAIT_FOR_PICKUP, {"entry_time": time.time()})
+        self.start_action(self.hardware_controller.open_compartment(), DroneState.WAIT_FOR_PICKUP)
 
     def state_wait_for_pickup(self):
-        entry_time = self.fsm.get_state_data("entry_time", time.time())
-        elapsed = time.time() - entry_time
+        """WAIT_FOR_PICKUP state: Wait for recipient to confirm with the button"""
+        elapsed = self.fsm.ms_in_state() / 1000.0
         self.display_manager.display_unloading(self.robot, elapsed)
-    
-        if self.button.value() == 0:
+
+        if self.hardware_controller.is_button_pressed():
             log_message("Package picked up by recipient")
-            
-            time.sleep(0.2)  
-            
             self.fsm.transition_to(DroneState.PACKAGE_DELIVERED)
-    
+
         elif elapsed >= 10:
             log_message("Package pickup timeout (simulation)", "WARNING")
             self.fsm.transition_to(DroneState.PACKAGE_DELIVERED)
 
-    def state_package_delivered(self):
+    def enter_package_delivered(self):
         """PACKAGE_DELIVERED state: Package delivered successfully"""
         self.display_manager.display_package_delivered(self.robot)
-        
+
         # Notify server
         self.order_manager.update_order_phase("PACKAGE_DELIVERED")
 
         # Complete order
         self.order_manager.complete_order()
 
-        # Transition to close compartment
-        time.sleep(1)
-        self.fsm.transition_to(DroneState.CLOSE_COMPARTMENT_DROPOFF)
+    def state_package_delivered(self):
+        # Keep the screen up briefly, then transition to close compartment
+        if self.fsm.ms_in_state() >= RUNTIME_CONFIG["DELIVERED_HOLD_MS"]:
+            self.fsm.transition_to(DroneState.CLOSE_COMPARTMENT_DROPOFF)
 
-    def state_close_compartment_dropoff(self):
+    def enter_close_compartment_dropoff(self):
         """CLOSE_COMPARTMENT_DROPOFF state: Close compartment after delivery"""
         self.display_manager.display_custom_message("Delivery Done!", "Closing hatch...", "Return to base", "initiated")
-        self.hardware_controller.close_compartment()
 
         # Always return to charging station after delivery
         # This ensures robot is always ready and at known location
-        self.fsm.transition_to(DroneState.FLIGHT_TO_CHARGING)
+        self.start_action(self.hardware_controller.close_compartment(), DroneState.FLIGHT_TO_CHARGING)
 
     def state_flight_to_charging(self):
         """FLIGHT_TO_CHARGING state: Flying to charging station"""
         self.display_manager.display_flight_to_charging(self.robot)
-        
-        # Check if destination has been set (one-time setup)
-        if not self.gps_simulator.is_moving:
-            # Start motors
-            self.hardware_controller.start_motors()
 
-            # Notify server
-            self.order_manager.update_order_phase("FLIGHT_TO_CHARGING")
-
-            # Use saved home charging station coordinates
-            if self.home_charging_lat and self.home_charging_lon:
-                self.gps_simulator.set_destination(
-                    self.home_charging_lat,
-                    self.home_charging_lon,
-                    self.home_charging_node_id
-                )
-            else:
-                log_message("No home charging station saved, using current location", "WARNING")
+        # One-time setup once motors are up to speed
+        if not self.depart():
+            return
+
+        # Notify server
+        self.order_manager.update_order_phase("FLIGHT_TO_CHARGING")
+
+        # Use saved home charging station coordinates
+        if self.home_charging_lat and self.home_charging_lon:
+            self.gps_simulator.set_destination(
+                self.home_charging_lat,
+                self.home_charging_lon,
+                self.home_charging_node_id
+            )
+        else:
+            log_message("No home charging station saved, using current location", "WARNING")
+
+    def enter_at_charging_station(self):
+        self.display_manager.display_charging(self.robot)
+        self.start_action(self.hardware_controller.stop_motors())
 
     def state_at_charging_station(self):
         """AT_CHARGING_STATION state: Arrived at charging station"""
-        self.display_manager.display_charging(self.robot)
-        
-        # Stop motors
-        self.hardware_controller.stop_motors()
+        # Wait for motors to stop, then start charging
+        if not self.action_done():
+            return
 
         # Start charging
         self.battery_manager.start_charging()
@@ -566,21 +876,9 @@ class RobotControllerFSM:
         self.display_manager.display_charging(self.robot)
         
         # Stay in charging state even at 100%
-        # Robot can still receive orders when Status=Charging and BatteryLevel>=95
-
-        # Check for orders periodically (like IDLE state)
-        current_time = time.time()
+        # Orders are polled by the "orders" runtime task (see task_order_poll)
 
-        if current_time - self.last_order_check_time >= self.order_check_interval:
-            self.last_order_check_time = current_time
-
-            # Check if battery is ready for delivery (>=95%)
-            if self.robot.battery_level >= 95:
-                # Temporarily transition to CHECK_ORDERS to fetch assignments
-                # FSM will return to CHARGING if no orders
-                self.fsm.transition_to(DroneState.CHECK_ORDERS)
-
-    def state_error(self):
+    def enter_error(self):
         """ERROR state: Handle error condition"""
         error = self.fsm.get_state_data("error", "Unknown error")
         log_message("In ERROR state: {}".format(error), "ERROR")
@@ -597,14 +895,85 @@ class RobotControllerFSM:
         # Reset robot status to Idle
         self.robot.set_status("Idle")
 
-        # Wait a bit
-        time.sleep(5)
+    def state_error(self):
+        # Wait a bit (and for the hardware to settle), then try to recover to IDLE
+        if (self.fsm.ms_in_state() >= RUNTIME_CONFIG["ERROR_RECOVERY_MS"]
+                and not self.hardware_controller.is_busy()):
+            self.fsm.transition_to(DroneState.IDLE)
 
-        # Try to recover to IDLE
-        self.fsm.transition_to(DroneState.IDLE)
+    def state_await_action(self):
+        """Shared tick handler: move on once the state's actuator command is done"""
+        if self.action_done():
+            next_state = self.fsm.get_state_data("next_state")
+            if next_state is not None:
+                self.fsm.transition_to(next_state)
 
     # Helper methods
 
+    def start_action(self, action, next_state=None):
+        """
+        Attach an actuator command to the current state
+
+        Args:
+            action: ActuatorCommand returned by HardwareController
+            next_state: Optional state to enter once the command is done
+                        (used by state_await_action)
+        """
+        self.fsm.set_state_data("action", action)
+        self.fsm.set_state_data("next_state", next_state)
+
+    def state_call(self, start, *args):
+        """
+        Run the current state's server request: it is started on the
+        state's first tick and polled on the following ones, so the tick
+        never waits for the network
+
+        Args:
+            start: Callable(*args) returning an ApiCall (or None)
+
+        Returns:
+            tuple: (done, call) - done is False while the answer is not in
+        """
+        call = self.fsm.get_state_data("call", False)
+        if call is False:
+            call = start(*args)
+            self.fsm.set_state_data("call", call)
+        return call is None or call.done, call
+
+    def action_done(self):
+        """
+        Check if the current state's actuator command has finished
+
+        Returns:
+            bool: True if done (or if the state has no command)
+        """
+        action = self.fsm.get_state_data("action")
+        return action is None or action.done
+
+    def depart(self):
+        """
+        Check if a flight state should run its one-time departure setup
+        Returns True exactly once, after the motors are up to speed
+
+        Returns:
+            bool: True if departure setup should run now
+        """
+        if self.fsm.get_state_data("departed") or not self.action_done():
+            return False
+        self.fsm.set_state_data("departed", True)
+        return True
+
+    def land(self):
+        """
+        Stop motors and wait for the drone to settle
+
+        Returns:
+            ActuatorCommand: Queued stop command
+        """
+        return self.hardware_controller.stop_motors(
+            settle_ms=HARDWARE_TIMINGS["LANDING_SETTLE_TIME"] * 1000
+        )
+
     def handle_arrival_at_destination(self):
         """
         Handle robot arrival at destination
@@ -660,7 +1029,13 @@ class RobotControllerFSM:
             self.robot.set_status("Maintenance")
             self.telemetry_manager.send_status_update(force=True)
 
-        # Disconnect WiFi
+        if self.outbox:
+            self.outbox.close()
+        if self.node_cache:
+            self.node_cache.close()
+
+        # Close keep-alive connections, then disconnect WiFi
+        self.close_connections()
         self.wifi_manager.disconnect()
 
         log_message("Shutdown complete.")
@@ -669,10 +1044,19 @@ class RobotControllerFSM:
 def main():
     """
     Main entry point
+
+    On a PC run "python main.py --host [--api URL]": the host HAL backend
+    simulates the board, and --api points the robot at another backend
     """
+    if HOST:
+        log_message("Using host hardware backend (simulated board)", "WARNING")
+        if "--api" in sys.argv:
+            API_CONFIG["BASE_URL"] = sys.argv[sys.argv.index("--api") + 1]
+            log_message("API base URL: {}".format(API_CONFIG["BASE_URL"]))
+
     # Give system time to stabilize after boot
     print("System initializing...")
-    time.sleep(2)
+    sleep_ms(2000)
     gc.collect()
 
     controller = RobotControllerFSM()
@@ -0,0 +1,172 @@
+"""
+Actuator Command Queue
+Non-blocking, timed execution of motor, servo and LED actions
+"""
+
+import sys
+
+sys.path.append('/utils')
+
+from helpers import log_message
+from clock import now_ms, sleep_ms
+
+
+class ActuatorCommand:
+    """
+    A queued hardware action made of timed steps
+    Each step is (action, hold_ms): the action runs once, then the
+    command waits hold_ms before moving on to the next step
+    """
+
+    def __init__(self, name, steps, callback=None):
+        """
+        Args:
+            name: Command name (used in logs)
+            steps: List of (callable or None, hold_ms) tuples
+            callback: Optional callable(command) run when the command finishes
+        """
+        self.name = name
+        self.steps = steps
+        self.callback = callback
+        self.index = 0
+        self.step_deadline = None
+        self.done = False
+
+    def _finish(self):
+        self.done = True
+        if self.callback:
+            try:
+                self.callback(self)
+            except Exception as e:
+                log_message("Actuator callback for {} failed: {}".format(self.name, str(e)), "ERROR")
+
+    def advance(self, now):
+        """
+        Run the current step if it is due
+
+        Args:
+            now: Current clock.now_ms() value
+
+        Returns:
+            int: Milliseconds until the next step, or None if finished
+        """
+        while self.index < len(self.steps):
+            action, hold_ms = self.steps[self.index]
+
+            if self.step_deadline is None:
+                if action:
+                    action()
+                self.step_deadline = now + hold_ms
+
+            if now < self.step_deadline:
+                return self.step_deadline - now
+
+            self.index += 1
+            self.step_deadline = None
+
+        self._finish()
+        return None
+
+
+class ActuatorQueue:
+    """
+    FIFO of actuator commands for one channel (motors, compartment, LED)
+    Commands on the same channel run one after another; separate
+    channels run side by side
+    """
+
+    def __init__(self, name):
+        """
+        Args:
+            name: Channel name
+        """
+        self.name = name
+        self.commands = []
+
+    def enqueue(self, command):
+        """
+        Add a command to the end of the queue
+
+        Args:
+            command: ActuatorCommand
+
+        Returns:
+            ActuatorCommand: The queued command
+        """
+        self.commands.append(command)
+        return command
+
+    def is_busy(self):
+        """Check if the channel has pending commands"""
+        return len(self.commands) > 0
+
+    def clear(self):
+        """
+        Drop pending commands (the running step is not undone)
+        """
+        self.commands = []
+
+    def update(self, now):
+        """
+        Advance the head command
+
+        Args:
+            now: Current clock.now_ms() value
+
+        Returns:
+            int: Milliseconds until the next step, or None if idle
+        """
+        while self.commands:
+            delay = self.commands[0].advance(now)
+            if delay is not None:
+                return delay
+            self.commands.pop(0)
+        return None
+
+
+def done_command(name):
+    """
+    Create a command that is already finished (for no-op requests)
+
+    Args:
+        name: Command name
+
+    Returns:
+        ActuatorCommand: Finished command
+    """
+    command = ActuatorCommand(name, [])
+    command.done = True
+    return command
+
+
+def run_until_idle(update, max_step_ms=50):
+    """
+    Block until every queued command has finished (shutdown use only)
+
+    Args:
+        update: Callable returning ms until the next step or None when idle
+        max_step_ms: Upper bound on a single sleep
+    """
+    delay = update()
+    while delay is not None:
+        sleep_ms(min(delay, max_step_ms))
+        delay = update()
+
+
+def update_all(queues):
+    """
+    Advance every queue
+
+    Args:
+        queues: Iterable of ActuatorQueue
+
+    Returns:
+        int: Milliseconds until the next step on any queue, or None if all idle
+    """
+    now = now_ms()
+    result = None
+    for queue in queues:
+        delay = queue.update(now)
+        if delay is not None and (result is None or delay < result):
+            result = delay
+    return result
@@ -0,0 +1,477 @@
+"""
+API Client
+One place for every call to the server: URLs, headers, JSON and errors.
+Header blocks are encoded once per token, an expired token is refreshed
+and the request retried once on 401, and network errors or 429/5xx
+answers are retried with bounded exponential backoff and jitter.
+Conditional GETs send the ETag of the previous answer, so an unchanged
+resource costs a 304 without a body. Large answers can be parsed while
+they are read (stream=...) instead of being decoded in one piece.
+
+request() blocks until the answer is in. submit() returns an ApiCall
+right away: in non-blocking mode (set_nonblocking, used while the
+runtime's event loop runs) the calls of one robot are sent in order by
+a background task on the async client, and the control loop polls
+ApiCall.done or gets a callback. Otherwise submit() sends at once, so
+the simulators see the same call sequence on a virtual clock
+"""
+
+import sys
+
+sys.path.append('/config')
+sys.path.append('/core')
+sys.path.append('/utils')
+sys.path.append('/hal')
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from hal import ujson
+
+from config import API_CONFIG, DEBUG
+from helpers import log_message, backoff_ms
+from http_client import get_client, HeaderBlock
+from circuit_breaker import CircuitBreakers, endpoint_key
+from clock import sleep_ms
+from runtime import sleep_ms as async_sleep_ms
+
+JSON = "application/json"
+
+# Answers worth another attempt (the server or a proxy is overloaded)
+TRANSIENT_STATUS = (429, 500, 502, 503, 504)
+
+# Methods the server may receive twice without harm; other requests are
+# only retried with an Idempotency-Key (a retried order accept that had
+# gone through the first time would get 409)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+
+def is_transient(status):
+    """
+    Check if a request result may succeed later (no answer, 429 or 5xx)
+
+    Args:
+        status: Status code returned by ApiClient.request (None: no answer)
+
+    Returns:
+        bool: True if the message should be kept and sent again
+    """
+    return status is None or status in TRANSIENT_STATUS
+
+
+class ApiCall:
+    """
+    A request started with ApiClient.submit
+    status and data are set once done is True (see ApiClient.request)
+    """
+
+    def __init__(self, method, path, payload, options, on_done):
+        self.method = method
+        self.path = path
+        self.payload = payload
+        self.options = options
+        self.on_done = on_done
+        self.done = False
+        self.status = None
+        self.data = None
+
+    def finish(self, status, data):
+        """
+        Store the result and run the callback
+        """
+        self.status = status
+        self.data = data
+        self.done = True
+        if self.on_done is not None:
+            self.on_done(status, data)
+
+
+class ApiClient:
+    """
+    JSON client for the RobDeliveryAPI
+    One instance per robot, owned by its AuthManager
+    """
+
+    def __init__(self, auth_manager, http=None, base_url=None):
+        """
+        Args:
+            auth_manager: AuthManager providing the token (and refreshing it)
+            http: HttpClient to send through (default: shared client)
+            base_url: Server URL (default: API_CONFIG BASE_URL)
+        """
+        self.auth_manager = auth_manager
+        self.http = http or get_client()
+        self.base_url = base_url or API_CONFIG["BASE_URL"]
+        self.retry_attempts = API_CONFIG.get("RETRY_ATTEMPTS", 2)
+        self.retry_base_ms = API_CONFIG.get("RETRY_BASE_MS", 250)
+        self.retry_max_ms = API_CONFIG.get("RETRY_MAX_MS", 2000)
+
+        # Encoded header blocks by content type, without and with the token
+        self._plain_headers = {}
+        self._auth_headers = {}
+        self._auth_token = None
+
+        # Path (without query) -> (ETag, data) of the last conditional answer
+        self._validators = {}
+
+        # Endpoints that keep failing are skipped (see circuit_breaker)
+        self.breakers = CircuitBreakers()
+
+        # Non-blocking mode: async client, calls waiting to be sent and
+        # the task sending them; unordered calls in flight, by call (the
+        # event loop keeps only weak references to its tasks)
+        self.async_http = None
+        self._queue = []
+        self._worker = None
+        self._tasks = {}
+
+        # Counters (for logs and benchmarks)
+        self.retries = 0
+        self.refreshes = 0
+
+    def get(self, path, **kw):
+        return self.request("GET", path, **kw)
+
+    def post(self, path, payload=None, **kw):
+        return self.request("POST", path, payload, **kw)
+
+    def post_binary(self, path, data, content_type, **kw):
+        """
+        POST an already encoded body (e.g. a binary telemetry batch)
+
+        Args:
+            path: Path on the server
+            data: Body bytes
+            content_type: Content-Type of the body
+
+        Returns:
+            tuple: (status_code, data), see request
+        """
+        return self.request("POST", path, body=data, content_type=content_type, **kw)
+
+    def request(self, method, path, payload=None, auth=True, retry=None, body=None, content_type=JSON,
+                conditional=False, timeout_ms=None, idempotency_key=None, stream=None):
+        """
+        Send a request and decode the JSON answer
+
+        Args:
+            method: HTTP method
+            path: Path on the server, e.g. "/api/Robot/me"
+            payload: Object sent as the JSON body (POST sends "{}" if None)
+            auth: Send the robot token; on 401 it is refreshed once
+            retry: Retry network errors and 429/5xx answers with backoff
+                   (default: only idempotent methods and requests with an
+                   idempotency_key; True for a request known to be safe
+                   to send twice)
+            body: Encoded body sent instead of payload
+            content_type: Content-Type of body
+            conditional: Send If-None-Match with the ETag of the last answer
+                         for this path; a 304 answer returns the data kept
+                         from that answer
+            timeout_ms: Deadline per attempt (default: REQUEST_TIMEOUT;
+                        longer e.g. for a request the server holds)
+            idempotency_key: Sent as Idempotency-Key, so the server applies
+                             a request that is sent again only once
+            stream: Parser class for a 200 body, created per attempt: the
+                    body is passed to its feed(chunk) as it is read and
+                    its result() is returned as data (see order_stream)
+
+        Returns:
+            tuple: (status_code, data) - data is the decoded body or None;
+                   status_code is None if the server could not be reached
+                   or the endpoint's circuit is open
+        """
+        url = self.base_url + path
+        body = self._body(method, payload, body)
+        extra = self._extra_headers(path, conditional, idempotency_key)
+        endpoint = endpoint_key(method, path)
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS or idempotency_key is not None
+
+        status, data, headers = self._send(method, url, body, auth, retry, content_type, extra,
+                                           timeout_ms, stream, endpoint)
+        if status == 401 and auth and self._refresh():
+            status, data, headers = self._send(method, url, body, auth, retry, content_type, extra,
+                                               timeout_ms, stream, endpoint)
+        if conditional:
+            return self._validate(path, status, data, headers)
+        return status, data
+
+    def submit(self, method, path, payload=None, on_done=None, ordered=True, **kw):
+        """
+        Start a request without waiting for the answer
+        Ordered calls are sent one at a time in the order they were submitted
+
+        Args:
+            method: HTTP method
+            path: Path on the server
+            payload: Object sent as the JSON body
+            on_done: Optional callable(status, data) run with the result
+            ordered: False sends the call on its own task, next to the
+                     ordered ones (for requests the server may hold)
+            **kw: auth, retry, body, content_type, conditional, timeout_ms,
+                  idempotency_key, stream (see request)
+
+        Returns:
+            ApiCall: Handle; done is already True in blocking mode
+        """
+        call = ApiCall(method, path, payload, kw, on_done)
+        if self.async_http is None:
+            call.finish(*self.request(method, path, payload, **kw))
+            return call
+        if not ordered:
+            self._tasks[call] = asyncio.create_task(self._send_call(call))
+            return call
+        self._queue.append(call)
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._drain())
+        return call
+
+    def set_nonblocking(self, enabled, http=None):
+        """
+        Switch submit() to the async client (needs a running event loop)
+
+        Args:
+            enabled: True while the runtime's event loop runs
+            http: AsyncHttpClient to use (default: shared async client)
+        """
+        if enabled:
+            if http is None:
+                from async_http import get_async_client
+                http = get_async_client()
+            self.async_http = http
+        else:
+            self.async_http = None
+            self._worker = None
+            self._tasks = {}
+            if self._queue:
+                log_message("{} request(s) dropped with the event loop".format(len(self._queue)), "WARNING")
+                self._queue = []
+
+    def pending(self):
+        """
+        Get the number of submitted calls without an answer yet
+        """
+        return len(self._queue) + (1 if self._worker is not None else 0) + len(self._tasks)
+
+    async def request_async(self, method, path, payload=None, auth=True, retry=None, body=None,
+                            content_type=JSON, conditional=False, timeout_ms=None, idempotency_key=None,
+                            stream=None):
+        """
+        Coroutine version of request (same arguments and result) on the
+        async client; backoff waits let other tasks run
+        """
+        url = self.base_url + path
+        body = self._body(method, payload, body)
+        extra = self._extra_headers(path, conditional, idempotency_key)
+        endpoint = endpoint_key(method, path)
+        if retry is None:
+            retry = method in IDEMPOTENT_METHODS or idempotency_key is not None
+
+        status, data, headers = await self._send_async(method, url, body, auth, retry, content_type,
+                                                       extra, timeout_ms, stream, endpoint)
+        if status == 401 and auth and await self._refresh_async():
+            status, data, headers = await self._send_async(method, url, body, auth, retry, content_type,
+                                                           extra, timeout_ms, stream, endpoint)
+        if conditional:
+            return self._validate(path, status, data, headers)
+        return status, data
+
+    def is_nonblocking(self):
+        """
+        Check if submit() sends on the async client
+        """
+        return self.async_http is not None
+
+    def invalidate(self):
+        """
+        Drop the cached auth header blocks and ETags (e.g. after logout)
+        """
+        self._auth_headers = {}
+        self._auth_token = None
+        self._validators = {}
+
+    def _headers(self, auth, content_type, extra=None):
+        # Encoded header block for the current token, rebuilt only when
+        # the token changes; per-request fields (If-None-Match,
+        # Idempotency-Key) get a block of their own
+        if extra:
+            fields = dict(self._headers(auth, content_type).fields)
+            fields.update(extra)
+            return HeaderBlock(fields)
+        if not auth:
+            block = self._plain_headers.get(content_type)
+            if block is None:
+                block = self._plain_headers[content_type] = HeaderBlock({"Content-Type": content_type})
+            return block
+        token = self.auth_manager.get_token()
+        if token != self._auth_token:
+            self._auth_token = token
+            self._auth_headers = {}
+        block = self._auth_headers.get(content_type)
+        if block is None:
+            block = self._auth_headers[content_type] = HeaderBlock({
+                "Authorization": "Bearer {}".format(token),
+                "Content-Type": content_type
+            })
+        return block
+
+    def _send(self, method, url, body, auth, retry, content_type=JSON, extra=None, timeout_ms=None,
+              stream=None, endpoint=None):
+        attempts = 1 + (self.retry_attempts if retry else 0)
+        status = data = headers = None
+        for attempt in range(attempts):
+            if not self._allow(method, url, endpoint):
+                break
+            if attempt:
+                self.retries += 1
+                sleep_ms(backoff_ms(attempt - 1, self.retry_base_ms, self.retry_max_ms))
+            sink = stream() if stream is not None else None
+            try:
+                response = self.http.request(method, url, data=body, headers=self._headers(auth, content_type, extra),
+                                             sink=sink, timeout_ms=timeout_ms)
+            except Exception as e:
+                log_message("{} {} failed: {}".format(method, url, e), "WARNING")
+                status = data = headers = None
+                self.breakers.record(endpoint, False)
+                continue
+
+            status = response.status_code
+            data = self._result(response, sink)
+            headers = response.headers
+            response.close()
+            self.breakers.record(endpoint, status not in TRANSIENT_STATUS)
+            if status not in TRANSIENT_STATUS:
+                break
+            if DEBUG:
+                log_message("{} {}: status {}".format(method, url, status), "DEBUG")
+        return status, data, headers
+
+    async def _send_async(self, method, url, body, auth, retry, content_type, extra=None, timeout_ms=None,
+                          stream=None, endpoint=None):
+        attempts = 1 + (self.retry_attempts if retry else 0)
+        status = data = headers = None
+        for attempt in range(attempts):
+            if not self._allow(method, url, endpoint):
+                break
+            if attempt:
+                self.retries += 1
+                await async_sleep_ms(backoff_ms(attempt - 1, self.retry_base_ms, self.retry_max_ms))
+            sink = stream() if stream is not None else None
+            try:
+                response = await self.async_http.request(method, url, data=body,
+                                                         headers=self._headers(auth, content_type, extra),
+                                                         timeout_ms=timeout_ms, sink=sink)
+            except Exception as e:
+                log_message("{} {} failed: {}".format(method, url, e), "WARNING")
+                status = data = headers = None
+                self.breakers.record(endpoint, False)
+                continue
+
+            status = response.status_code
+            data = self._result(response, sink)
+            headers = response.headers
+            self.breakers.record(endpoint, status not in TRANSIENT_STATUS)
+            if status not in TRANSIENT_STATUS:
+                break
+            if DEBUG:
+                log_message("{} {}: status {}".format(method, url, status), "DEBUG")
+        return status, data, headers
+
+    def _allow(self, method, url, endpoint):
+        # Circuit check before every attempt: an endpoint whose circuit
+        # opened during the retries is not tried again
+        if self.breakers.allow(endpoint):
+            return True
+        if DEBUG:
+            log_message("{} {} skipped: circuit open".format(method, url), "DEBUG")
+        return False
+
+    async def _drain(self):
+        # Send submitted calls in order; one request in flight per robot
+        # keeps phase updates ordered and the heap use bounded
+        try:
+            while self._queue and self.async_http is not None:
+                await self._send_one(self._queue.pop(0))
+        finally:
+            self._worker = None
+
+    async def _send_call(self, call):
+        try:
+            await self._send_one(call)
+        finally:
+            self._tasks.pop(call, None)
+
+    async def _send_one(self, call):
+        try:
+            status, data = await self.request_async(call.method, call.path, call.payload, **call.options)
+        except Exception as e:
+            log_message("{} {} failed: {}".format(call.method, call.path, e), "ERROR")
+            status = data = None
+        try:
+            call.finish(status, data)
+        except Exception as e:
+            log_message("Callback for {} {} failed: {}".format(call.method, call.path, e), "ERROR")
+
+    def _body(self, method, payload, body):
+        if body is None:
+            if payload is not None:
+                return ujson.dumps(payload)
+            if method == "POST":
+                return "{}"
+        return body
+
+    def _extra_headers(self, path, conditional, idempotency_key):
+        # Per-request header fields, or None for the cached blocks
+        extra = None
+        if conditional:
+            kept = self._validators.get(path.partition("?")[0])
+            if kept:
+                extra = {"If-None-Match": kept[0]}
+        if idempotency_key is not None:
+            extra = extra or {}
+            extra["Idempotency-Key"] = idempotency_key
+        return extra
+
+    def _validate(self, path, status, data, headers):
+        # Keep the ETag and data of a conditional answer; on 304 the
+        # kept data stands in for the body the server did not send
+        key = path.partition("?")[0]
+        if status == 304:
+            kept = self._validators.get(key)
+            return status, kept[1] if kept else None
+        etag = headers.get("etag") if headers else None
+        if status == 200 and etag:
+            self._validators[key] = (etag, data)
+        else:
+            self._validators.pop(key, None)
+        return status, data
+
+    def _result(self, response, sink):
+        # A streamed 200 body was parsed by the sink; anything else
+        # (errors included) is decoded from the content
+        if sink is not None and response.status_code == 200:
+            return sink.result()
+        return self._decode(response)
+
+    def _decode(self, response):
+        content = response.content
+        if not content:
+            return None
+        try:
+            return ujson.loads(content)
+        except ValueError:
+            return None
+
+    def _refresh(self):
+        # The token expired or was revoked: log in again
+        self.refreshes += 1
+        log_message("Token rejected (401), refreshing", "WARNING")
+        return self.auth_manager.refresh_token()
+
+    async def _refresh_async(self):
+        self.refreshes += 1
+        log_message("Token rejected (401), refreshing", "WARNING")
+        return await self.auth_manager.refresh_token_async()
@@ -0,0 +1,321 @@
+"""
+Async HTTP Client
+Non-blocking counterpart of http_client.HttpClient on (u)asyncio
+streams: while a request waits for the server the event loop keeps
+running the other jobs (FSM, buttons, display, GPS).
+
+Every request has a deadline (API_CONFIG REQUEST_TIMEOUT) covering
+connect, send and the whole response, so a server that stops answering
+costs the caller a failed request instead of a frozen controller.
+Connections are kept alive and reused like in HttpClient
+"""
+
+import sys
+
+sys.path.append('/config')
+sys.path.append('/utils')
+sys.path.append('/hal')
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+from hal import urequests
+
+from config import API_CONFIG
+from helpers import log_message
+from clock import now_ms
+import http_client
+from http_client import (HttpResponse, HeaderBlock, STREAM_CHUNK, split_url, build_request,
+                         parse_status_line, parse_header, parse_chunk_size, has_body, hook_response,
+                         _encode_headers, _StaleConnection)
+
+
+async def with_deadline(awaitable, timeout_ms):
+    """
+    Await with a deadline; the awaitable is cancelled when it passes
+
+    Raises:
+        asyncio.TimeoutError: The deadline passed
+    """
+    if hasattr(asyncio, "wait_for_ms"):
+        return await asyncio.wait_for_ms(awaitable, timeout_ms)
+    return await asyncio.wait_for(awaitable, timeout_ms / 1000)
+
+
+class _StreamConnection:
+    """
+    One open stream pair to a host
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.last_used = now_ms()
+        self.requests = 0
+
+    async def send(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def readline(self):
+        return await self.reader.readline()
+
+    async def read_exactly(self, size):
+        chunks = []
+        while size > 0:
+            chunk = await self.reader.read(size)
+            if not chunk:
+                raise OSError("Connection closed mid-response")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    async def read_to_end(self):
+        chunks = []
+        while True:
+            chunk = await self.reader.read(1024)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def close(self):
+        try:
+            self.writer.close()
+        except Exception:
+            pass
+
+
+class AsyncHttpClient:
+    """
+    Keep-alive HTTP/1.1 client for coroutines
+    Use get_async_client() for the instance shared by the managers
+    """
+
+    def __init__(self, timeout_ms=None, max_idle_ms=60000, max_requests=1000):
+        """
+        Args:
+            timeout_ms: Deadline per request (default: REQUEST_TIMEOUT)
+            max_idle_ms: Idle connections older than this are reopened
+            max_requests: Requests per connection before it is recycled
+        """
+        self.timeout_ms = timeout_ms or API_CONFIG.get("REQUEST_TIMEOUT", 10) * 1000
+        self.max_idle_ms = max_idle_ms
+        self.max_requests = max_requests
+        self._connections = {}
+
+        # Counters (for logs and benchmarks)
+        self.opened = 0
+        self.reused = 0
+        self.retries = 0
+        self.timeouts = 0
+
+    async def request(self, method, url, data=None, headers=None, timeout_ms=None, sink=None):
+        """
+        Send a request without blocking the event loop
+
+        Args:
+            method: HTTP method
+            url: Absolute URL
+            data: Optional str or bytes body
+            headers: Optional dict of headers, or a HeaderBlock
+            timeout_ms: Deadline for this request (default: client deadline)
+            sink: Optional object whose feed(chunk) gets the body of a 200
+                  answer in pieces of at most STREAM_CHUNK bytes as they
+                  arrive; the response content is then empty
+
+        Returns:
+            HttpResponse: Server response
+
+        Raises:
+            OSError: Connection failed or the deadline passed
+        """
+        if isinstance(headers, HeaderBlock):
+            fields = headers.fields
+            block = headers.encoded
+        else:
+            fields = headers or {}
+            block = _encode_headers(fields)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        hook = http_client.transport or getattr(urequests, "transport", None)
+        if hook is not None:
+            # Simulated network: answers right away
+            return hook_response(hook(method, url, data, fields), sink)
+
+        timeout_ms = timeout_ms or self.timeout_ms
+        try:
+            return await with_deadline(self._request(method, url, data, block, fields, sink), timeout_ms)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise OSError("Request timed out after {} ms".format(timeout_ms))
+
+    def close(self):
+        """
+        Close every open connection
+        """
+        connections = self._connections
+        self._connections = {}
+        for conn in connections.values():
+            conn.close()
+
+    # Internals
+
+    async def _request(self, method, url, data, block, fields, sink):
+        https, host, port, path = split_url(url)
+        key = (https, host, port)
+        message = build_request(method, host, path, data, block, "Connection" not in fields)
+
+        conn, reused = await self._acquire(key)
+        try:
+            try:
+                status, reason, content, keep_alive, headers = await self._exchange(conn, message, method,
+                                                                                    reused, sink)
+            except _StaleConnection:
+                # The server closed the idle socket: reconnect once and resend
+                conn.close()
+                self.retries += 1
+                conn, reused = await self._acquire(key, fresh=True)
+                status, reason, content, keep_alive, headers = await self._exchange(conn, message, method,
+                                                                                    False, sink)
+        except BaseException:
+            # Includes cancellation at the deadline: the stream is mid-request
+            conn.close()
+            raise
+
+        conn.requests += 1
+        conn.last_used = now_ms()
+        if keep_alive and conn.requests < self.max_requests:
+            old = self._connections.get(key)
+            if old is not None:
+                # Another request opened its own connection meanwhile
+                old.close()
+            self._connections[key] = conn
+        else:
+            conn.close()
+        return HttpResponse(status, content, reason, headers)
+
+    async def _acquire(self, key, fresh=False):
+        # Returns (connection, reused); in-use connections are not pooled,
+        # so concurrent requests to one host each get their own stream
+        conn = self._connections.pop(key, None)
+        if conn is not None:
+            if not fresh and now_ms() - conn.last_used < self.max_idle_ms:
+                self.reused += 1
+                return conn, True
+            conn.close()
+        https, host, port = key
+        reader, writer = await asyncio.open_connection(host, port, ssl=True if https else None)
+        self.opened += 1
+        return _StreamConnection(reader, writer), False
+
+    async def _exchange(self, conn, message, method, reused, sink=None):
+        # Send one request and read its response
+        # Returns (status, reason, body, keep_alive, headers)
+        try:
+            await conn.send(message)
+            status_line = await conn.readline()
+        except OSError:
+            if reused:
+                raise _StaleConnection()
+            raise
+        if not status_line:
+            if reused:
+                raise _StaleConnection()
+            raise OSError("Connection closed by server")
+
+        status, reason, keep_alive = parse_status_line(status_line)
+
+        length = None
+        chunked = False
+        headers = {}
+        while True:
+            line = await conn.readline()
+            if not line or line == b"\r\n":
+                break
+            length, chunked, keep_alive = parse_header(line, length, chunked, keep_alive, headers)
+
+        if not has_body(method, status):
+            body = b""
+        elif sink is not None and status == 200:
+            body = b""
+            if not await self._stream(conn, sink, length, chunked):
+                keep_alive = False
+        elif chunked:
+            body = await self._read_chunked(conn)
+        elif length is not None:
+            body = await conn.read_exactly(length)
+        else:
+            body = await conn.read_to_end()
+            keep_alive = False
+        return status, reason, body, keep_alive, headers
+
+    async def _stream(self, conn, sink, length, chunked):
+        # Feed the body to sink; returns False if it ran to the end of
+        # the stream (no length), so the connection cannot be reused
+        if chunked:
+            while True:
+                size = parse_chunk_size(await conn.readline())
+                if size == 0:
+                    while True:
+                        line = await conn.readline()
+                        if not line or line == b"\r\n":
+                            return True
+                await self._stream_exactly(conn, sink, size)
+                await conn.read_exactly(2)
+        if length is not None:
+            await self._stream_exactly(conn, sink, length)
+            return True
+        while True:
+            chunk = await conn.reader.read(STREAM_CHUNK)
+            if not chunk:
+                return False
+            sink.feed(chunk)
+
+    async def _stream_exactly(self, conn, sink, size):
+        while size > 0:
+            chunk = await conn.reader.read(min(size, STREAM_CHUNK))
+            if not chunk:
+                raise OSError("Connection closed mid-response")
+            sink.feed(chunk)
+            size -= len(chunk)
+
+    async def _read_chunked(self, conn):
+        chunks = []
+        while True:
+            size = parse_chunk_size(await conn.readline())
+            if size == 0:
+                while True:
+                    line = await conn.readline()
+                    if not line or line == b"\r\n":
+                        return b"".join(chunks)
+            chunks.append(await conn.read_exactly(size))
+            await conn.read_exactly(2)
+
+
+_client = None
+
+
+def get_async_client():
+    """
+    Get the async HTTP client shared by all managers
+
+    Returns:
+        AsyncHttpClient: Shared client
+    """
+    global _client
+    if _client is None:
+        _client = AsyncHttpClient()
+        log_message("Async HTTP client ready (deadline {} ms)".format(_client.timeout_ms))
+    return _client
+
+
+def close_async_client():
+    """
+    Close the shared client's connections, if it was created (e.g. after
+    a WiFi drop, when they are dead)
+    """
+    if _client is not None:
+        _client.close()
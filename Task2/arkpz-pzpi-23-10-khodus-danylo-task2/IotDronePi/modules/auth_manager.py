@@ -1,36 +1,92 @@
-import urequests
-import ujson
+import os
 import sys
+import time
+
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
 
 sys.path.append('/config')
 sys.path.append('/utils')
+sys.path.append('/hal')
+
+from hal import ujson, flash_path
 
 from config import API_CONFIG, ROBOT_CONFIG, DEBUG
-from helpers import log_message
+from helpers import log_message, clock_valid
+from clock import now_ms
+from api_client import ApiClient
+
+def token_claims(token):
+    """
+    Decode the payload of a JWT without checking its signature (the
+    server does that; the robot only reads the expiry)
+
+    Args:
+        token: JWT string
+
+    Returns:
+        dict: Claims, or None if the token is not a JWT
+    """
+    try:
+        payload = token.split(".")[1].replace("-", "+").replace("_", "/")
+        payload += "=" * (-len(payload) % 4)
+        claims = ujson.loads(binascii.a2b_base64(payload).decode("utf-8"))
+    except (IndexError, ValueError):
+        return None
+    return claims if isinstance(claims, dict) else None
+
 
 class AuthManager:
     """
     Manages robot authentication with the server
     """
 
-    def __init__(self):
+    def __init__(self, serial_number=None, access_key=None, start_node=None):
+        """
+        Args:
+            serial_number: Robot serial number (default: ROBOT_CONFIG)
+            access_key: Robot access key (default: ROBOT_CONFIG)
+            start_node: Node reported on registration (default: API_CONFIG START_NODE)
+        """
         self.base_url = API_CONFIG["BASE_URL"]
         self.auth_endpoint = API_CONFIG["AUTH_ENDPOINT"]
         self.register_endpoint = "/api/Auth/robot/register"
-        self.serial_number = ROBOT_CONFIG["SERIAL_NUMBER"]
-        self.access_key = ROBOT_CONFIG["ACCESS_KEY"]
+        self.serial_number = serial_number or ROBOT_CONFIG["SERIAL_NUMBER"]
+        self.access_key = access_key or ROBOT_CONFIG["ACCESS_KEY"]
+        self.start_node = start_node if start_node is not None else API_CONFIG.get("START_NODE", 25)
         self.robot_type = ROBOT_CONFIG.get("TYPE", "Drone")
         self.token = None
         self.robot_id = None
+        # Shared by the order and telemetry managers of this robot
+        self.api = ApiClient(self)
+
+        # Token cache on flash: the next boot reuses the token, or at
+        # least knows the robot is registered and logs in directly
+        self.cache_path = flash_path(API_CONFIG.get("TOKEN_CACHE_PATH", "/auth.json"))
+        self.refresh_margin_s = API_CONFIG.get("TOKEN_REFRESH_MARGIN_S", 600)
+        self.registered = False
+        self.expires = None      # JWT exp claim (time.time() seconds)
+        self.refresh_at_ms = None  # now_ms() of the next proactive refresh
 
     def login(self):
         """
         Authenticate robot with the server
-        First tries to register, if robot exists - then login
+        A token cached on flash by an earlier boot is used without any
+        request while it is valid; a robot known to be registered logs in
+        directly; otherwise registration is tried first, then login
 
         Returns:
             bool: True if authentication successful, False otherwise
         """
+        if self._load_cache():
+            return True
+
+        if self.registered:
+            log_message("Robot registered before. Logging in...")
+            return self._try_login() or self._try_register()
+
         # Try to register first
         if self._try_register():
             return True
@@ -39,6 +95,24 @@ class AuthManager:
         log_message("Robot already registered. Attempting login...")
         return self._try_login()
 
+    async def login_async(self):
+        """
+        Coroutine version of login on the async client (used at boot,
+        where other steps run while the server answers)
+        """
+        if self._load_cache():
+            return True
+
+        if self.registered:
+            log_message("Robot registered before. Logging in...")
+            return await self._try_login_async() or await self._try_register_async()
+
+        if await self._try_register_async():
+            return True
+
+        log_message("Robot already registered. Attempting login...")
+        return await self._try_login_async()
+
     def _try_register(self):
         """
         Try to register robot on the server
@@ -46,58 +120,32 @@ class AuthManager:
         Returns:
             bool: True if registration successful, False otherwise
         """
-        try:
-            url = self.base_url + self.register_endpoint
-
-            payload = {
-                "name": "{}-{}".format(self.robot_type, self.serial_number[-3:]),
-                "model": "ESP32-{}".format(self.robot_type),
-                "type": self.robot_type,
-                "serialNumber": self.serial_number,
-                "accessKey": self.access_key,
-                "batteryCapacityJoules": ROBOT_CONFIG.get("BATTERY_CAPACITY_JOULES", 360000),
-                "energyConsumptionPerMeterJoules": ROBOT_CONFIG.get("ENERGY_CONSUMPTION_PER_METER", 36),
-                "currentNodeId": API_CONFIG.get("START_NODE", 25)
-            }
-
-            headers = {
-                'Content-Type': 'application/json'
-            }
-
-            if DEBUG:
-                log_message("Attempting robot registration: {}".format(self.serial_number))
-
-            response = urequests.post(
-                url,
-                data=ujson.dumps(payload),
-                headers=headers
-            )
-
-            if response.status_code == 200:
-                data = ujson.loads(response.text)
-                self.token = data.get('token')
-                self.robot_id = data.get('robotId')
-
-                if self.token:
-                    log_message("Robot registered successfully! Robot ID: {}".format(self.robot_id))
-                    response.close()
-                    return True
-                else:
-                    log_message("Registration failed: No token received", "ERROR")
-                    response.close()
-                    return False
-            else:
-                if DEBUG:
-                    log_message("Registration failed: Status {}".format(response.status_code), "DEBUG")
-                    log_message("Response: {}".format(response.text), "DEBUG")
-                response.close()
-                return False
-
-        except Exception as e:
-            if DEBUG:
-                log_message("Registration error: {}".format(str(e)), "DEBUG")
+        if DEBUG:
+            log_message("Attempting robot registration: {}".format(self.serial_number))
+
+        return self._registered(*self.api.post(self.register_endpoint, self._register_payload(), auth=False))
+
+    async def _try_register_async(self):
+        if DEBUG:
+            log_message("Attempting robot registration: {}".format(self.serial_number))
+
+        return self._registered(*(await self.api.request_async(
+            "POST", self.register_endpoint, self._register_payload(), auth=False)))
+
+    def _registered(self, status, data):
+        # Result of a register request
+        if status == 200:
+            if self._accept_token(data):
+                log_message("Robot registered successfully! Robot ID: {}".format(self.robot_id))
+                return True
+            log_message("Registration failed: No token received", "ERROR")
             return False
 
+        if DEBUG:
+            log_message("Registration failed: Status {}".format(status), "DEBUG")
+            log_message("Response: {}".format(data), "DEBUG")
+        return False
+
     def _try_login(self):
         """
         Try to login robot on the server
@@ -105,51 +153,136 @@ class AuthManager:
         Returns:
             bool: True if login successful, False otherwise
         """
+        if DEBUG:
+            log_message("Authenticating robot: {}".format(self.serial_number))
+
+        # Login only issues a token: safe to retry
+        return self._logged_in(*self.api.post(self.auth_endpoint, self._login_payload(), auth=False, retry=True))
+
+    async def _try_login_async(self):
+        if DEBUG:
+            log_message("Authenticating robot: {}".format(self.serial_number))
+
+        return self._logged_in(*(await self.api.request_async(
+            "POST", self.auth_endpoint, self._login_payload(), auth=False, retry=True)))
+
+    def _logged_in(self, status, data):
+        # Result of a login request
+        if status == 200:
+            if self._accept_token(data):
+                log_message("Login successful! Robot ID: {}".format(self.robot_id))
+                return True
+            log_message("Login failed: No token received", "ERROR")
+            return False
+
+        log_message("Login failed: Status {}".format(status), "ERROR")
+        if DEBUG:
+            log_message("Response: {}".format(data), "DEBUG")
+        return False
+
+    def _register_payload(self):
+        return {
+            "name": "{}-{}".format(self.robot_type, self.serial_number[-3:]),
+            "model": "ESP32-{}".format(self.robot_type),
+            "type": self.robot_type,
+            "serialNumber": self.serial_number,
+            "accessKey": self.access_key,
+            "batteryCapacityJoules": ROBOT_CONFIG.get("BATTERY_CAPACITY_JOULES", 360000),
+            "energyConsumptionPerMeterJoules": ROBOT_CONFIG.get("ENERGY_CONSUMPTION_PER_METER", 36),
+            "currentNodeId": self.start_node
+        }
+
+    def _login_payload(self):
+        return {
+            "serialNumber": self.serial_number,
+            "accessKey": self.access_key
+        }
+
+    def _accept_token(self, data):
+        """
+        Store the token and robot ID from a register/login answer
+        (in memory and in the flash cache)
+
+        Returns:
+            bool: True if the answer had a token
+        """
+        if not isinstance(data, dict) or not data.get('token'):
+            return False
+        self.token = data['token']
+        self.robot_id = data.get('robotId')
+        self.registered = True
+        claims = token_claims(self.token)
+        self.expires = claims.get("exp") if claims else None
+        self._schedule_refresh(fresh=True)
+        self._save_cache()
+        return True
+
+    def _schedule_refresh(self, fresh):
+        # Refresh refresh_margin_s before exp. Without a set clock the
+        # time left is unknown: a token from the cache is refreshed right
+        # away (in the background), a fresh one when the server rejects it
+        if self.expires is None:
+            self.refresh_at_ms = None
+        elif clock_valid():
+            left_s = self.expires - time.time() - self.refresh_margin_s
+            self.refresh_at_ms = now_ms() + max(0, int(left_s)) * 1000
+        else:
+            self.refresh_at_ms = None if fresh else now_ms()
+
+    def _load_cache(self):
+        """
+        Read the flash cache of an earlier boot
+
+        Returns:
+            bool: True if its token can be used now
+        """
         try:
-            url = self.base_url + self.auth_endpoint
-
-            payload = {
-                "serialNumber": self.serial_number,
-                "accessKey": self.access_key
-            }
-
-            headers = {
-                'Content-Type': 'application/json'
-            }
-
-            if DEBUG:
-                log_message("Authenticating robot: {}".format(self.serial_number))
-
-            response = urequests.post(
-                url,
-                data=ujson.dumps(payload),
-                headers=headers
-            )
-
-            if response.status_code == 200:
-                data = ujson.loads(response.text)
-                self.token = data.get('token')
-                self.robot_id = data.get('robotId')
-
-                if self.token:
-                    log_message("Login successful! Robot ID: {}".format(self.robot_id))
-                    response.close()
-                    return True
-                else:
-                    log_message("Login failed: No token received", "ERROR")
-                    response.close()
-                    return False
-            else:
-                log_message("Login failed: Status {}".format(response.status_code), "ERROR")
-                if DEBUG:
-                    log_message("Response: {}".format(response.text), "DEBUG")
-                response.close()
-                return False
-
-        except Exception as e:
-            log_message("Login error: {}".format(str(e)), "ERROR")
+            with open(self.cache_path) as f:
+                cache = ujson.loads(f.read())
+        except (OSError, ValueError):
+            return False
+        if not isinstance(cache, dict) or cache.get("serialNumber") != self.serial_number \
+                or cache.get("baseUrl") != self.base_url:
+            # Another robot or server: start over
+            return False
+
+        self.registered = True
+        expires = cache.get("expires")
+        if not cache.get("token") or (expires is not None and clock_valid()
+                                      and expires - time.time() < self.refresh_margin_s):
+            log_message("Cached token expired")
             return False
 
+        self.token = cache["token"]
+        self.robot_id = cache.get("robotId")
+        self.expires = expires
+        self._schedule_refresh(fresh=False)
+        log_message("Using cached token. Robot ID: {}".format(self.robot_id))
+        return True
+
+    def _save_cache(self):
+        # Written to a temporary file first, so a reset mid-write keeps
+        # the previous cache
+        temp_path = self.cache_path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                f.write(ujson.dumps({
+                    "serialNumber": self.serial_number,
+                    "baseUrl": self.base_url,
+                    "token": self.token,
+                    "robotId": self.robot_id,
+                    "expires": self.expires
+                }))
+            os.rename(temp_path, self.cache_path)
+        except OSError as e:
+            log_message("Token cache not written: {}".format(e), "WARNING")
+
+    def _clear_cache(self):
+        try:
+            os.remove(self.cache_path)
+        except OSError:
+            pass
+
     def get_auth_header(self):
         """
         Get authorization header for API requests
@@ -190,15 +323,45 @@ class AuthManager:
         """
         return self.token
 
+    def refresh_due(self):
+        """
+        Check if the token should be refreshed now (shortly before it
+        expires, see TOKEN_REFRESH_MARGIN_S)
+
+        Returns:
+            bool: True if a proactive refresh is due
+        """
+        return self.refresh_at_ms is not None and now_ms() >= self.refresh_at_ms
+
     def refresh_token(self):
         """
         Refresh authentication token by re-authenticating
+        The robot is already registered, so login goes first; registration
+        is only tried if the server no longer knows the robot
+
+        Returns:
+            bool: True if refresh successful, False otherwise
+        """
+        log_message("Refreshing authentication token...")
+        return self._try_login() or self._try_register()
+
+    async def refresh_token_async(self):
+        """
+        Coroutine version of refresh_token for requests sent by the
+        async client (the event loop keeps running meanwhile)
 
         Returns:
             bool: True if refresh successful, False otherwise
         """
         log_message("Refreshing authentication token...")
-        return self.login()
+        for endpoint, payload, retry in ((self.auth_endpoint, self._login_payload(), True),
+                                         (self.register_endpoint, self._register_payload(), None)):
+            status, data = await self.api.request_async("POST", endpoint, payload, auth=False, retry=retry)
+            if status == 200 and self._accept_token(data):
+                log_message("Token refreshed. Robot ID: {}".format(self.robot_id))
+                return True
+        log_message("Token refresh failed: Status {}".format(status), "ERROR")
+        return False
 
     def logout(self):
         """
@@ -206,4 +369,8 @@ class AuthManager:
         """
         self.token = None
         self.robot_id = None
+        self.expires = None
+        self.refresh_at_ms = None
+        self.api.invalidate()
+        self._clear_cache()
         log_message("Logged out")
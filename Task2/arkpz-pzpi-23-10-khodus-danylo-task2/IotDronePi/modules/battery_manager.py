@@ -1,4 +1,3 @@
-import time
 import sys
 
 sys.path.append('/config')
@@ -6,6 +5,7 @@ sys.path.append('/utils')
 
 from config import TELEMETRY_CONFIG, DEBUG
 from helpers import log_message, clamp
+from clock import now_ms
 
 class BatteryManager:
     """
@@ -16,7 +16,8 @@ class BatteryManager:
         self.robot = robot
         self.drain_rate = TELEMETRY_CONFIG["BATTERY_DRAIN_RATE"]
         self.charging_rate = 2.0  # percent per second when charging
-        self.last_update_time = time.time()
+        self.last_update_time = now_ms()
+        self.last_log_time = self.last_update_time
         self.is_charging = False
 
     def start_charging(self):
@@ -39,8 +40,8 @@ class BatteryManager:
         Update battery level based on current state
         Should be called periodically
         """
-        current_time = time.time()
-        time_elapsed = current_time - self.last_update_time
+        current_time = now_ms()
+        time_elapsed = (current_time - self.last_update_time) / 1000.0
         self.last_update_time = current_time
 
         if self.is_charging:
@@ -53,7 +54,8 @@ class BatteryManager:
                 log_message("Battery fully charged")
                 self.stop_charging()
 
-            if DEBUG and int(current_time) % 5 == 0:  # Log every 5 seconds
+            if DEBUG and current_time - self.last_log_time >= 5000:  # Log every 5 seconds
+                self.last_log_time = current_time
                 log_message(
                     "Charging: Battery at {:.1f}%".format(self.robot.battery_level),
                     "DEBUG"
@@ -130,8 +132,7 @@ class BatteryManager:
         """
         if not self.is_charging and self.robot.status == "Idle":
             # Idle drain is much slower (0.01% per second)
-            current_time = time.time()
-            time_elapsed = current_time - self.last_update_time
+            time_elapsed = (now_ms() - self.last_update_time) / 1000.0
             drain_amount = 0.01 * time_elapsed
             new_level = self.robot.battery_level - drain_amount
             self.robot.update_battery_level(new_level)
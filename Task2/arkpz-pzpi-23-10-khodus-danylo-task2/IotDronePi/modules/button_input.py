@@ -0,0 +1,199 @@
+"""
+Button Input for ESP32 Drone
+Interrupt-driven edge capture with software debouncing
+"""
+
+import time
+import sys
+from array import array
+
+sys.path.append('/config')
+sys.path.append('/utils')
+sys.path.append('/hal')
+
+from hardware_config import HARDWARE_TIMINGS
+from helpers import log_message
+from clock import now_ms
+
+try:
+    from hal import Pin
+    HARDWARE_AVAILABLE = True
+except ImportError:
+    HARDWARE_AVAILABLE = False
+
+try:
+    import micropython
+    # Lets exceptions raised inside the IRQ handler be reported
+    micropython.alloc_emergency_exception_buf(100)
+except (ImportError, AttributeError):
+    micropython = None
+
+if hasattr(time, "ticks_us"):
+    _ticks_us = time.ticks_us
+    _ticks_diff = time.ticks_diff
+else:
+    # Host: follow the shared clock so debouncing also works in simulated time
+    def _ticks_us():
+        return (now_ms() * 1000) & 0x3FFFFFFF
+
+    def _ticks_diff(end, start):
+        return ((end - start + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+
+
+class ButtonInput:
+    """
+    Push button read through Pin.irq
+    The IRQ handler stores raw edges (level + ticks_us) in a fixed-size
+    ring buffer without allocating; debouncing and press detection run
+    later in normal context when the FSM consumes events
+    """
+
+    def __init__(self, pin_number, active_low=True, debounce_ms=None, buffer_size=None):
+        """
+        Args:
+            pin_number: GPIO number of the button
+            active_low: True if pressed reads 0 (pull-up wiring)
+            debounce_ms: Edges closer than this to the last accepted edge are ignored
+            buffer_size: Number of raw edges the ring buffer can hold
+        """
+        if debounce_ms is None:
+            debounce_ms = HARDWARE_TIMINGS["BUTTON_DEBOUNCE_MS"]
+        if buffer_size is None:
+            buffer_size = HARDWARE_TIMINGS["BUTTON_EVENT_BUFFER"]
+
+        self.active_low = active_low
+        self.debounce_us = debounce_ms * 1000
+
+        # Ring buffer written by the IRQ handler (head) and read here (tail)
+        self._size = buffer_size
+        self._times = array('L', [0] * buffer_size)
+        self._levels = bytearray(buffer_size)
+        self._head = 0
+        self._tail = 0
+        self.overflows = 0
+
+        # Debounced state
+        self.pressed = False
+        self._last_edge_us = None
+        self._pending_presses = 0
+        self.last_press_us = None
+
+        # Optional callable run (outside the IRQ) after an edge is captured
+        self.on_event = None
+        self._scheduled_ref = self._scheduled_event
+
+        self.pin = None
+        self.irq_enabled = False
+
+        if HARDWARE_AVAILABLE:
+            self.pin = Pin(pin_number, Pin.IN, Pin.PULL_UP)
+            try:
+                self.pin.irq(trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING, handler=self._irq)
+                self.irq_enabled = True
+            except (AttributeError, OSError) as e:
+                log_message("Button IRQ unavailable, polling instead: {}".format(e), "WARNING")
+
+        log_message("Button input on GPIO{} (irq={})".format(pin_number, self.irq_enabled))
+
+    def _irq(self, pin):
+        # Runs in interrupt context: no allocation, no logging
+        head = self._head
+        next_head = head + 1
+        if next_head == self._size:
+            next_head = 0
+        if next_head == self._tail:
+            self.overflows += 1
+            return
+        self._times[head] = _ticks_us()
+        self._levels[head] = pin.value()
+        self._head = next_head
+
+        if self.on_event is not None and micropython is not None:
+            try:
+                micropython.schedule(self._scheduled_ref, 0)
+            except RuntimeError:
+                # Schedule queue full; the event is still in the buffer
+                pass
+
+    def _scheduled_event(self, _):
+        if self.on_event is not None:
+            self.on_event()
+
+    def _is_active(self, level):
+        return (level == 0) if self.active_low else (level == 1)
+
+    def _is_bounce(self, edge_us):
+        # A negative difference means the last edge is more than half a
+        # ticks_us period old (the counter wrapped), not that it is recent
+        if self._last_edge_us is None:
+            return False
+        return 0 <= _ticks_diff(edge_us, self._last_edge_us) < self.debounce_us
+
+    def _accept(self, active, edge_us):
+        self.pressed = active
+        self._last_edge_us = edge_us
+        if active:
+            self._pending_presses += 1
+            self.last_press_us = edge_us
+
+    def update(self):
+        """
+        Debounce buffered edges into press events
+        Called automatically by consume_press() and is_pressed()
+        """
+        tail = self._tail
+        while tail != self._head:
+            edge_us = self._times[tail]
+            active = self._is_active(self._levels[tail])
+            tail += 1
+            if tail == self._size:
+                tail = 0
+
+            if active == self.pressed:
+                continue
+            if self._is_bounce(edge_us):
+                # Contact bounce
+                continue
+            self._accept(active, edge_us)
+        self._tail = tail
+
+        if self.pin is None:
+            return
+
+        # Reconcile with the pin level: catches a release rejected as bounce
+        # and is the only input source when IRQs are unavailable
+        active = self._is_active(self.pin.value())
+        if active != self.pressed:
+            now_us = _ticks_us()
+            if not self._is_bounce(now_us):
+                self._accept(active, now_us)
+
+    def consume_press(self):
+        """
+        Take one press event from the buffer
+
+        Returns:
+            bool: True if a press happened since the last call
+        """
+        self.update()
+        if self._pending_presses > 0:
+            self._pending_presses -= 1
+            return True
+        return False
+
+    def is_pressed(self):
+        """
+        Get debounced button level
+
+        Returns:
+            bool: True while the button is held down
+        """
+        self.update()
+        return self.pressed
+
+    def clear(self):
+        """
+        Drop buffered edges and unconsumed presses
+        """
+        self.update()
+        self._pending_presses = 0
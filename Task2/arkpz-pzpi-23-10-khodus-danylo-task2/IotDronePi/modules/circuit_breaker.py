@@ -0,0 +1,159 @@
+"""
+Circuit Breaker
+Per-endpoint record of recent failures, so calls to an endpoint that
+keeps failing are skipped at once instead of each waiting out its
+deadline.
+
+An endpoint's circuit opens after API_CONFIG BREAKER_FAILURES failed
+attempts in a row (no answer, 429 or 5xx). While open, calls are
+skipped; after BREAKER_OPEN_MS one call goes through as a probe
+(half-open). A probe that succeeds closes the circuit, one that fails
+opens it again for twice as long, up to BREAKER_MAX_OPEN_MS
+"""
+
+import sys
+
+sys.path.append('/config')
+sys.path.append('/utils')
+
+from config import API_CONFIG
+from helpers import log_message
+from clock import now_ms
+
+
+class CircuitState:
+    """
+    Enum-like class for circuit states
+    """
+    CLOSED = "closed"        # calls go through
+    OPEN = "open"            # calls are skipped until the probe time
+    HALF_OPEN = "half_open"  # one probe call is in flight
+
+
+def endpoint_key(method, path):
+    """
+    Get the endpoint a request belongs to: method and path without the
+    query, with numeric segments (IDs) replaced by {id}
+
+    Args:
+        method: HTTP method
+        path: Path on the server, e.g. "/api/Robot/order/12/phase"
+
+    Returns:
+        str: e.g. "POST /api/Robot/order/{id}/phase"
+    """
+    path = path.partition("?")[0]
+    if any(c.isdigit() for c in path):
+        path = "/".join("{id}" if part.isdigit() else part for part in path.split("/"))
+    return method + " " + path
+
+
+class _Circuit:
+    """
+    State of one endpoint
+    """
+
+    def __init__(self):
+        self.state = CircuitState.CLOSED
+        self.failures = 0      # failed attempts in a row
+        self.open_ms = 0       # current open period
+        self.retry_at = 0      # now_ms() of the next probe
+        self.skipped = 0
+
+
+class CircuitBreakers:
+    """
+    Circuit breakers of all endpoints of one client
+    """
+
+    def __init__(self, failures=None, open_ms=None, max_open_ms=None):
+        """
+        Args:
+            failures: Failed attempts in a row that open a circuit
+                      (default: API_CONFIG BREAKER_FAILURES; 0 disables)
+            open_ms: First open period (default: API_CONFIG BREAKER_OPEN_MS)
+            max_open_ms: Open period cap (default: API_CONFIG BREAKER_MAX_OPEN_MS)
+        """
+        self.failures = API_CONFIG.get("BREAKER_FAILURES", 3) if failures is None else failures
+        self.open_ms = open_ms or API_CONFIG.get("BREAKER_OPEN_MS", 5000)
+        self.max_open_ms = max_open_ms or API_CONFIG.get("BREAKER_MAX_OPEN_MS", 60000)
+        self._circuits = {}
+
+        # Counters (for logs and benchmarks)
+        self.skipped = 0
+        self.opened = 0
+
+    def allow(self, key):
+        """
+        Check if a call to an endpoint may be sent now; in the half-open
+        state this lets exactly one probe through
+
+        Args:
+            key: Endpoint (see endpoint_key)
+
+        Returns:
+            bool: False if the call should be skipped
+        """
+        circuit = self._circuits.get(key)
+        if circuit is None or circuit.state == CircuitState.CLOSED:
+            return True
+        now = now_ms()
+        if now < circuit.retry_at:
+            circuit.skipped += 1
+            self.skipped += 1
+            return False
+        # Probe time (or a probe that never reported back): let one call
+        # through and hold the others until it is done
+        circuit.state = CircuitState.HALF_OPEN
+        circuit.retry_at = now + circuit.open_ms
+        return True
+
+    def record(self, key, ok):
+        """
+        Record the result of an attempt
+
+        Args:
+            key: Endpoint (see endpoint_key)
+            ok: True if the server answered (anything but 429/5xx)
+        """
+        circuit = self._circuits.get(key)
+        if ok:
+            if circuit is not None and circuit.state != CircuitState.CLOSED:
+                log_message("Circuit closed for {} ({} call(s) skipped)".format(key, circuit.skipped))
+                circuit.state = CircuitState.CLOSED
+                circuit.skipped = 0
+            if circuit is not None:
+                circuit.failures = 0
+            return
+        if not self.failures:
+            return
+        if circuit is None:
+            circuit = self._circuits[key] = _Circuit()
+        circuit.failures += 1
+        if circuit.state == CircuitState.HALF_OPEN:
+            circuit.open_ms = min(self.max_open_ms, circuit.open_ms * 2)
+        elif circuit.state == CircuitState.CLOSED and circuit.failures >= self.failures:
+            circuit.open_ms = self.open_ms
+            self.opened += 1
+        else:
+            return
+        circuit.state = CircuitState.OPEN
+        circuit.retry_at = now_ms() + circuit.open_ms
+        log_message("Circuit open for {} ({} failure(s)), next probe in {} ms".format(
+            key, circuit.failures, circuit.open_ms), "WARNING")
+
+    def state(self, key):
+        """
+        Get the state of an endpoint's circuit
+
+        Returns:
+            str: CircuitState value
+        """
+        circuit = self._circuits.get(key)
+        return circuit.state if circuit is not None else CircuitState.CLOSED
+
+    def reset(self):
+        """
+        Close every circuit (e.g. after WiFi came back)
+        """
+        self._circuits = {}
@@ -3,17 +3,16 @@ Display Manager for LCD2004 Screen
 Manages display output for robot status and logs
 """
 
-import time
 import sys
 
-sys.path.append('/libs')
 sys.path.append('/utils')
+sys.path.append('/hal')
 
 from helpers import log_message
+from clock import sleep_ms
 
 try:
-    from machine import I2C, Pin
-    from i2c_lcd import I2cLcd
+    from hal import I2C, Pin, I2cLcd
     HARDWARE_AVAILABLE = True
 except ImportError:
     HARDWARE_AVAILABLE = False
@@ -564,5 +563,5 @@ class DisplayManager:
             self.clear()
             self.write_line("System shutdown", 1, center=True)
             self.write_line("Goodbye!", 2, center=True)
-            time.sleep(2)
+            sleep_ms(2000)
             self.lcd.backlight = False
@@ -1,4 +1,3 @@
-import time
 import sys
 
 sys.path.append('/config')
@@ -6,6 +5,7 @@ sys.path.append('/utils')
 
 from config import GPS_CONFIG, ROBOT_CHARACTERISTICS, DEBUG
 from helpers import log_message, calculate_distance, calculate_bearing, move_coordinates
+from clock import now_ms
 
 class GPSSimulator:
     """
@@ -19,6 +19,7 @@ class GPSSimulator:
         self.start_longitude = GPS_CONFIG["START_LONGITUDE"]
         self.movement_step = GPS_CONFIG["MOVEMENT_STEP"]
         self.update_interval = GPS_CONFIG["UPDATE_INTERVAL"]
+        self.update_interval_ms = self.update_interval * 1000
         self.max_speed_ms = ROBOT_CHARACTERISTICS["MAX_SPEED_MS"]
 
         # Initialize robot location only if not already set (from server)
@@ -40,6 +41,7 @@ class GPSSimulator:
         """
         self.robot.set_target(target_lat, target_lon, target_node_id)
         self.is_moving = True
+        self.last_update_time = now_ms()
 
         distance = calculate_distance(
             self.robot.current_latitude,
@@ -55,17 +57,14 @@ class GPSSimulator:
     def update_position(self):
         """
         Update robot position (simulate movement)
-        Should be called periodically
+        Called by the scheduler every update_interval; the distance moved
+        is based on the actual time elapsed since the previous update
 
         Returns:
             bool: True if robot is still moving, False if reached destination
         """
-        current_time = time.time()
-
-        # Check if it's time to update
-        if current_time - self.last_update_time < self.update_interval:
-            return self.is_moving
-
+        current_time = now_ms()
+        elapsed_ms = current_time - self.last_update_time
         self.last_update_time = current_time
 
         if not self.is_moving or self.robot.target_latitude is None:
@@ -99,7 +98,7 @@ class GPSSimulator:
 
         # Calculate movement distance for this update
         # distance = speed * time
-        movement_distance = self.max_speed_ms * self.update_interval
+        movement_distance = self.max_speed_ms * elapsed_ms / 1000.0
 
         # Don't overshoot the target
         if movement_distance > distance_to_target:
@@ -1,19 +1,24 @@
 """
 Hardware Controller for ESP32 Drone
-Manages GPIO pins for motors, compartment, buttons, and LEDs
+Manages GPIO pins for motors, compartment, button, and LEDs
+Actuator actions are queued and advanced by the scheduler, so none of
+the public methods block the control loop
 """
 
-import time
 import sys
 
 sys.path.append('/config')
 sys.path.append('/utils')
+sys.path.append('/hal')
 
-from hardware_config import GPIO_CONFIG, HARDWARE_TIMINGS, MOTOR_CONFIG
+from hardware_config import GPIO_CONFIG, HARDWARE_TIMINGS, MOTOR_CONFIG, SERVO_CONFIG
 from helpers import log_message
+from clock import now_ms, sleep_ms
+from actuator_queue import ActuatorCommand, ActuatorQueue, done_command, update_all, run_until_idle
+from button_input import ButtonInput
 
 try:
-    from machine import Pin, PWM
+    from hal import Pin, PWM
     HARDWARE_AVAILABLE = True
 except ImportError:
     # Running on PC (for testing)
@@ -39,10 +44,22 @@ class HardwareController:
         else:
             self._init_simulation()
 
-        # State tracking
+        # State tracking (actual state, updated when a step runs)
         self.motors_running = False
         self.compartment_open = False
-        self.last_button_time = 0
+
+        # Requested state (updated when a command is queued)
+        self.motors_target = False
+        self.compartment_target = False
+
+        # One command queue per actuator channel
+        self.motor_queue = ActuatorQueue("motors")
+        self.compartment_queue = ActuatorQueue("compartment")
+        self.led_queue = ActuatorQueue("led")
+        self.queues = (self.motor_queue, self.compartment_queue, self.led_queue)
+
+        # Called when a command is queued so the scheduler can run update() early
+        self.wake_callback = None
 
         log_message("Hardware controller initialized (hardware={})".format(self.hardware_available))
 
@@ -56,11 +73,11 @@ class HardwareController:
 
         # Compartment pin (PWM for servo)
         self.compartment_pin = PWM(Pin(GPIO_CONFIG["COMPARTMENT_PIN"]))
-        self.compartment_pin.freq(50)  # 50Hz for servo
+        self.compartment_pin.freq(SERVO_CONFIG["PWM_FREQUENCY"])
         self._close_compartment_servo()
 
-        # Button pin (input with pullup)
-        self.button_pin = Pin(GPIO_CONFIG["BUTTON_PIN"], Pin.IN, Pin.PULL_UP)
+        # Button (input with pullup, edges captured by IRQ)
+        self.button = ButtonInput(GPIO_CONFIG["BUTTON_PIN"])
 
         # LED pins (digital output)
         self.led_status = Pin(GPIO_CONFIG["LED_STATUS"], Pin.OUT)
@@ -76,48 +93,106 @@ class HardwareController:
         """
         self.motor_pin = None
         self.compartment_pin = None
-        self.button_pin = None
+        self.button = None
         self.led_status = None
         self.led_battery = None
 
         log_message("Simulation mode initialized")
 
+    # Command queue
+
+    def set_wake_callback(self, callback):
+        """
+        Set callback invoked whenever a command is queued
+
+        Args:
+            callback: Callable with no arguments
+        """
+        self.wake_callback = callback
+
+    def _enqueue(self, queue, name, steps, callback=None):
+        command = queue.enqueue(ActuatorCommand(name, steps, callback))
+        if self.wake_callback:
+            self.wake_callback()
+        return command
+
+    def update(self):
+        """
+        Advance queued actuator commands
+        Should be called by the scheduler; returns when the next step is due
+
+        Returns:
+            int: Milliseconds until the next step, or None if all channels idle
+        """
+        return update_all(self.queues)
+
+    def is_busy(self):
+        """
+        Check if any actuator command is pending
+
+        Returns:
+            bool: True if a channel is busy
+        """
+        for queue in self.queues:
+            if queue.is_busy():
+                return True
+        return False
+
     # Motor control
 
-    def start_motors(self):
+    def start_motors(self, callback=None):
         """
         Start drone motors (begin flight)
+
+        Args:
+            callback: Optional callable(command) run once motors are up to speed
+
+        Returns:
+            ActuatorCommand: Command whose done flag is set after the startup delay
         """
-        if self.motors_running:
+        if self.motors_target:
             log_message("Motors already running", "WARNING")
-            return
+            return done_command("start_motors")
 
         log_message("Starting motors...")
+        self.motors_target = True
 
-        if self.hardware_available and self.motor_pin:
-            self.motor_pin.on()
+        return self._enqueue(self.motor_queue, "start_motors", [
+            (self._motors_on, MOTOR_CONFIG["STARTUP_DELAY"] * 1000),
+            (lambda: log_message("Motors started"), 0),
+        ], callback)
 
-        self.motors_running = True
-        time.sleep(MOTOR_CONFIG["STARTUP_DELAY"])
-
-        log_message("Motors started")
-
-    def stop_motors(self):
+    def stop_motors(self, callback=None, settle_ms=0):
         """
         Stop drone motors (land)
+
+        Args:
+            callback: Optional callable(command) run once motors are stopped
+            settle_ms: Extra time to wait after the motors stop
+
+        Returns:
+            ActuatorCommand: Command whose done flag is set once motors are stopped
         """
-        if not self.motors_running:
-            return
+        if not self.motors_target:
+            return done_command("stop_motors")
 
         log_message("Stopping motors...")
+        self.motors_target = False
 
-        time.sleep(MOTOR_CONFIG["SHUTDOWN_DELAY"])
+        return self._enqueue(self.motor_queue, "stop_motors", [
+            (None, MOTOR_CONFIG["SHUTDOWN_DELAY"] * 1000),
+            (self._motors_off, settle_ms),
+        ], callback)
 
+    def _motors_on(self):
         if self.hardware_available and self.motor_pin:
-            self.motor_pin.off()
+            self.motor_pin.on()
+        self.motors_running = True
 
+    def _motors_off(self):
+        if self.hardware_available and self.motor_pin:
+            self.motor_pin.off()
         self.motors_running = False
-
         log_message("Motors stopped")
 
     def are_motors_running(self):
@@ -131,45 +206,57 @@ class HardwareController:
 
     # Compartment control
 
-    def open_compartment(self):
+    def open_compartment(self, callback=None):
         """
         Open compartment (for loading/unloading)
+
+        Args:
+            callback: Optional callable(command) run once the servo has settled
+
+        Returns:
+            ActuatorCommand: Command whose done flag is set once the hatch is open
         """
-        if self.compartment_open:
+        if self.compartment_target:
             log_message("Compartment already open", "WARNING")
-            return
+            return done_command("open_compartment")
 
         log_message("Opening compartment...")
+        self.compartment_target = True
 
-        if self.hardware_available and self.compartment_pin:
-            self._open_compartment_servo()
-        else:
-            # Simulation mode
-            time.sleep(HARDWARE_TIMINGS["COMPARTMENT_OPEN_TIME"])
+        return self._enqueue(self.compartment_queue, "open_compartment", [
+            (self._open_compartment_servo, HARDWARE_TIMINGS["COMPARTMENT_OPEN_TIME"] * 1000),
+            (self._compartment_opened, 0),
+        ], callback)
 
-        self.compartment_open = True
-        self.blink_status_led(times=2)
-
-        log_message("Compartment opened")
-
-    def close_compartment(self):
+    def close_compartment(self, callback=None):
         """
         Close compartment (secure package)
+
+        Args:
+            callback: Optional callable(command) run once the servo has settled
+
+        Returns:
+            ActuatorCommand: Command whose done flag is set once the hatch is closed
         """
-        if not self.compartment_open:
-            return
+        if not self.compartment_target:
+            return done_command("close_compartment")
 
         log_message("Closing compartment...")
+        self.compartment_target = False
 
-        if self.hardware_available and self.compartment_pin:
-            self._close_compartment_servo()
-        else:
-            # Simulation mode
-            time.sleep(HARDWARE_TIMINGS["COMPARTMENT_CLOSE_TIME"])
+        return self._enqueue(self.compartment_queue, "close_compartment", [
+            (self._close_compartment_servo, HARDWARE_TIMINGS["COMPARTMENT_CLOSE_TIME"] * 1000),
+            (self._compartment_closed, 0),
+        ], callback)
+
+    def _compartment_opened(self):
+        self.compartment_open = True
+        self.blink_status_led(times=2)
+        log_message("Compartment opened")
 
+    def _compartment_closed(self):
         self.compartment_open = False
         self.blink_status_led(times=1)
-
         log_message("Compartment closed")
 
     def is_compartment_open(self):
@@ -183,21 +270,17 @@ class HardwareController:
 
     def _open_compartment_servo(self):
         """
-        Open compartment using servo (internal)
+        Move servo to open position (internal, returns immediately)
         """
-        # Set servo to open position (90 degrees = ~77 duty cycle on ESP32)
-        duty = self._angle_to_duty(90)
-        self.compartment_pin.duty(duty)
-        time.sleep(HARDWARE_TIMINGS["COMPARTMENT_OPEN_TIME"])
+        if self.hardware_available and self.compartment_pin:
+            self.compartment_pin.duty(self._angle_to_duty(SERVO_CONFIG["OPEN_ANGLE"]))
 
     def _close_compartment_servo(self):
         """
-        Close compartment using servo (internal)
+        Move servo to closed position (internal, returns immediately)
         """
-        # Set servo to closed position (0 degrees = ~26 duty cycle on ESP32)
-        duty = self._angle_to_duty(0)
-        self.compartment_pin.duty(duty)
-        time.sleep(HARDWARE_TIMINGS["COMPARTMENT_CLOSE_TIME"])
+        if self.hardware_available and self.compartment_pin:
+            self.compartment_pin.duty(self._angle_to_duty(SERVO_CONFIG["CLOSED_ANGLE"]))
 
     def _angle_to_duty(self, angle):
         """
@@ -219,33 +302,40 @@ class HardwareController:
 
     def is_button_pressed(self):
         """
-        Check if button is pressed (with debouncing)
+        Consume one debounced button press
 
         Returns:
-            bool: True if button pressed
+            bool: True if the button was pressed since the last call
         """
-        current_time = time.time()
-
-        # Check debounce
-        if current_time - self.last_button_time < HARDWARE_TIMINGS["BUTTON_DEBOUNCE_TIME"]:
-            return False
-
-        if self.hardware_available and self.button_pin:
-            # Button is active LOW (pressed = 0)
-            pressed = self.button_pin.value() == 0
-        else:
+        if self.button is None:
             # Simulation mode - always return False (manual trigger needed)
-            pressed = False
+            return False
 
-        if pressed:
-            self.last_button_time = current_time
+        if self.button.consume_press():
             log_message("Button pressed!")
+            return True
+        return False
 
-        return pressed
+    def clear_button_events(self):
+        """
+        Discard button presses that happened before now
+        """
+        if self.button is not None:
+            self.button.clear()
+
+    def set_button_callback(self, callback):
+        """
+        Set callback run (outside the IRQ) whenever a button edge is captured
+
+        Args:
+            callback: Callable with no arguments
+        """
+        if self.button is not None:
+            self.button.on_event = callback
 
     def wait_for_button_press(self, timeout=None):
         """
-        Wait for button press (blocking)
+        Wait for button press (blocking, not for use inside the control loop)
 
         Args:
             timeout: Maximum wait time in seconds (None = wait forever)
@@ -257,17 +347,17 @@ class HardwareController:
             " (timeout={}s)".format(timeout) if timeout else ""
         ))
 
-        start_time = time.time()
+        start_time = now_ms()
 
         while True:
             if self.is_button_pressed():
                 return True
 
-            if timeout and (time.time() - start_time) >= timeout:
+            if timeout and (now_ms() - start_time) >= timeout * 1000:
                 log_message("Button press timeout", "WARNING")
                 return False
 
-            time.sleep(0.1)
+            sleep_ms(20)
 
     # LED control
 
@@ -297,22 +387,34 @@ class HardwareController:
             else:
                 self.led_battery.off()
 
-    def blink_status_led(self, times=3, interval=None):
+    def blink_status_led(self, times=3, interval=None, callback=None):
         """
         Blink status LED
 
         Args:
             times: Number of blinks
             interval: Blink interval (seconds)
+            callback: Optional callable(command) run after the last blink
+
+        Returns:
+            ActuatorCommand: Queued LED pattern
         """
         if interval is None:
             interval = HARDWARE_TIMINGS["LED_BLINK_INTERVAL"]
+        interval_ms = int(interval * 1000)
 
+        steps = []
         for _ in range(times):
-            self.set_status_led(True)
-            time.sleep(interval)
-            self.set_status_led(False)
-            time.sleep(interval)
+            steps.append((self._status_led_on, interval_ms))
+            steps.append((self._status_led_off, interval_ms))
+
+        return self._enqueue(self.led_queue, "blink_status_led", steps, callback)
+
+    def _status_led_on(self):
+        self.set_status_led(True)
+
+    def _status_led_off(self):
+        self.set_status_led(False)
 
     def shutdown(self):
         """
@@ -320,13 +422,17 @@ class HardwareController:
         """
         log_message("Shutting down hardware controller...")
 
+        # Skip cosmetic LED patterns
+        self.led_queue.clear()
+
         # Stop motors
-        if self.motors_running:
-            self.stop_motors()
+        self.stop_motors()
 
         # Close compartment
-        if self.compartment_open:
-            self.close_compartment()
+        self.close_compartment()
+
+        # The control loop is no longer running, so finish the queue here
+        run_until_idle(self.update)
 
         # Turn off LEDs
         self.set_status_led(False)
@@ -0,0 +1,559 @@
+"""
+HTTP Client
+Small HTTP/1.1 client with persistent (keep-alive) connections.
+One socket per host is kept open and reused by every manager, so the
+TCP (and TLS) handshake is paid once instead of on every request.
+Stale connections (closed by the server while idle) are detected and
+the request is retried once on a fresh connection. Every request has a
+deadline (API_CONFIG REQUEST_TIMEOUT) covering connect to last byte
+"""
+
+import sys
+
+sys.path.append('/config')
+sys.path.append('/utils')
+sys.path.append('/hal')
+
+try:
+    import usocket as socket
+except ImportError:
+    import socket
+
+try:
+    import ussl as ssl
+except ImportError:
+    try:
+        import ssl
+    except ImportError:
+        ssl = None
+
+from hal import urequests, ujson
+
+from config import API_CONFIG
+from helpers import log_message
+from clock import now_ms
+
+# Optional callable(method, url, body, headers) -> (status_code, body_bytes)
+# or (status_code, body_bytes, response_headers) that replaces the network;
+# defaults to the host urequests transport hook so the simulators keep working
+transport = None
+
+# Response headers kept in HttpResponse.headers (lowercase names); the
+# rest are only parsed for framing, to keep responses small
+KEPT_HEADERS = ("etag",)
+
+# Bytes handed to a streaming sink at a time (see HttpClient.request)
+STREAM_CHUNK = 256
+
+
+class HttpResponse:
+    """
+    HTTP response (same fields as a urequests response)
+    """
+
+    def __init__(self, status_code, content, reason="", headers=None):
+        self.status_code = status_code
+        self.reason = reason
+        self.content = content
+        # Lowercase name -> value, for the names in KEPT_HEADERS
+        self.headers = headers or {}
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return ujson.loads(self.content)
+
+    def close(self):
+        # The body is read in full; the connection stays with the client
+        pass
+
+
+class HeaderBlock:
+    """
+    Request headers encoded once and sent as-is on every request
+    (pass instead of a headers dict; the dict must not be changed later)
+    """
+
+    def __init__(self, fields):
+        """
+        Args:
+            fields: Dict of header name -> value
+        """
+        self.fields = fields
+        self.encoded = _encode_headers(fields)
+
+
+def _encode_headers(fields):
+    return "".join("{}: {}\r\n".format(name, value)
+                   for name, value in fields.items()).encode("utf-8")
+
+
+class _Connection:
+    """
+    One open socket to a host
+    """
+
+    def __init__(self, sock, reader):
+        self.sock = sock
+        self.reader = reader
+        self.last_used = now_ms()
+        self.requests = 0
+        # now_ms() by which the current request must be done (see arm)
+        self.deadline = None
+
+    def arm(self):
+        # Give the next socket operation only the time left until the
+        # deadline, so a request cannot outlive it by a timeout per read
+        if self.deadline is None:
+            return
+        left = self.deadline - now_ms()
+        if left <= 0:
+            raise OSError(110, "Request deadline passed")
+        try:
+            self.sock.settimeout(left / 1000)
+        except (AttributeError, OSError):
+            pass  # TLS socket without settimeout: the connect timeout stays
+
+    def send(self, data):
+        self.arm()
+        if hasattr(self.sock, "sendall"):
+            self.sock.sendall(data)
+        else:
+            # MicroPython TLS sockets only have write()
+            view = memoryview(data)
+            while view:
+                written = self.sock.write(view)
+                view = view[written:]
+
+    def readline(self):
+        self.arm()
+        return self.reader.readline()
+
+    def read_exactly(self, size):
+        chunks = []
+        while size > 0:
+            self.arm()
+            chunk = self.reader.read(size)
+            if not chunk:
+                raise OSError("Connection closed mid-response")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def read_to_end(self):
+        chunks = []
+        while True:
+            self.arm()
+            chunk = self.reader.read(1024)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def readinto(self, view):
+        # Returns the number of bytes read (0 at the end of the stream)
+        self.arm()
+        if hasattr(self.reader, "readinto"):
+            return self.reader.readinto(view) or 0
+        chunk = self.reader.read(len(view))
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+class _StaleConnection(Exception):
+    """A reused connection failed before any response arrived"""
+
+
+def _is_timeout(error):
+    # CPython raises TimeoutError; MicroPython OSError(ETIMEDOUT)
+    return type(error).__name__ in ("TimeoutError", "timeout") or (
+        error.args and error.args[0] in (110, 116))
+
+
+def build_request(method, host, path, data, block, keep_alive):
+    """
+    Build a request message: request line and Host, the encoded header
+    block, then the per-request Connection and Content-Length headers
+
+    Returns:
+        bytes: Message ready to send
+    """
+    tail = "Connection: keep-alive\r\n" if keep_alive else ""
+    if data is not None or method in ("POST", "PUT", "PATCH"):
+        tail += "Content-Length: {}\r\n".format(len(data) if data else 0)
+    return b"".join((
+        "{} {} HTTP/1.1\r\nHost: {}\r\n".format(method, path, host).encode("utf-8"),
+        block,
+        (tail + "\r\n").encode("utf-8"),
+        data or b""
+    ))
+
+
+def parse_status_line(line):
+    """
+    Parse a response status line
+
+    Returns:
+        tuple: (status, reason, keep_alive)
+
+    Raises:
+        OSError: Not an HTTP status line
+    """
+    parts = line.decode("latin-1").split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+        raise OSError("Bad status line: {}".format(line))
+    reason = parts[2].strip() if len(parts) > 2 else ""
+    return int(parts[1]), reason, parts[0] != "HTTP/1.0"
+
+
+def parse_header(line, length, chunked, keep_alive, headers):
+    """
+    Apply one response header line to the framing state
+    Headers listed in KEPT_HEADERS are stored in headers
+
+    Returns:
+        tuple: (content_length, chunked, keep_alive)
+    """
+    name, _, value = line.decode("latin-1").partition(":")
+    name = name.strip().lower()
+    value = value.strip()
+    if name in KEPT_HEADERS:
+        headers[name] = value
+    elif name == "content-length":
+        length = int(value)
+    elif name == "transfer-encoding":
+        chunked = "chunked" in value.lower()
+    elif name == "connection":
+        keep_alive = value.lower() != "close"
+    return length, chunked, keep_alive
+
+
+def hook_response(result, sink=None):
+    """
+    Turn a transport hook result into an HttpResponse
+
+    Args:
+        result: (status, body) or (status, body, headers)
+        sink: Optional streaming sink; a 200 body is fed to it in
+              STREAM_CHUNK pieces like one read from a socket
+    """
+    headers = result[2] if len(result) > 2 else None
+    content = result[1] or b""
+    if sink is not None and result[0] == 200:
+        view = memoryview(content)
+        for start in range(0, len(content), STREAM_CHUNK):
+            sink.feed(view[start:start + STREAM_CHUNK])
+        content = b""
+    return HttpResponse(result[0], content, headers=headers)
+
+
+def parse_chunk_size(line):
+    """
+    Parse the size line of a chunked body
+
+    Returns:
+        int: Chunk size (0 for the last chunk)
+
+    Raises:
+        OSError: The connection closed instead
+    """
+    if not line:
+        raise OSError("Connection closed mid-response")
+    return int(line.split(b";")[0].strip(), 16)
+
+
+def has_body(method, status):
+    """Check if a response to this request can carry a body"""
+    return method != "HEAD" and status not in (204, 304) and not 100 <= status < 200
+
+
+def split_url(url):
+    """
+    Split an absolute URL
+
+    Returns:
+        tuple: (https, host, port, path)
+    """
+    scheme, _, rest = url.partition("://")
+    https = scheme == "https"
+    host_port, slash, path = rest.partition("/")
+    path = slash + path if slash else "/"
+    host, _, port = host_port.partition(":")
+    port = int(port) if port else (443 if https else 80)
+    return https, host, port, path
+
+
+class HttpClient:
+    """
+    Keep-alive HTTP/1.1 client
+    Use get_client() for the instance shared by the managers
+    """
+
+    def __init__(self, timeout_s=None, max_idle_ms=60000, max_requests=1000):
+        """
+        Args:
+            timeout_s: Deadline per request in seconds (default: REQUEST_TIMEOUT)
+            max_idle_ms: Idle connections older than this are reopened
+                         before use (servers drop idle keep-alive sockets)
+            max_requests: Requests per connection before it is recycled
+        """
+        self.timeout_s = timeout_s or API_CONFIG.get("REQUEST_TIMEOUT", 10)
+        self.max_idle_ms = max_idle_ms
+        self.max_requests = max_requests
+        self._connections = {}
+        # Read buffer for streamed bodies (one request at a time)
+        self._stream_buffer = bytearray(STREAM_CHUNK)
+
+        # Counters (for logs and benchmarks)
+        self.opened = 0
+        self.reused = 0
+        self.retries = 0
+
+    # Public API (urequests-compatible subset)
+
+    def request(self, method, url, data=None, json=None, headers=None, sink=None, timeout_ms=None):
+        """
+        Send a request, within a deadline covering connect to last byte
+
+        Args:
+            method: HTTP method
+            url: Absolute URL
+            data: Optional str or bytes body
+            json: Optional object sent as a JSON body
+            headers: Optional dict of headers, or a HeaderBlock
+            sink: Optional object whose feed(chunk) gets the body of a 200
+                  answer as it is read, through one reused buffer; the
+                  response content is then empty
+            timeout_ms: Deadline for this request (default: REQUEST_TIMEOUT)
+
+        Returns:
+            HttpResponse: Server response
+
+        Raises:
+            OSError: Connection failed or the deadline passed
+        """
+        if isinstance(headers, HeaderBlock):
+            fields = headers.fields
+            block = headers.encoded
+        else:
+            fields = dict(headers) if headers else {}
+            block = None
+        if json is not None:
+            data = ujson.dumps(json)
+            if "Content-Type" not in fields:
+                fields["Content-Type"] = "application/json"
+                block = None
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        hook = transport or getattr(urequests, "transport", None)
+        if hook is not None:
+            return hook_response(hook(method, url, data, fields), sink)
+
+        https, host, port, path = split_url(url)
+        key = (https, host, port)
+        if block is None:
+            block = _encode_headers(fields)
+        message = build_request(method, host, path, data, block, "Connection" not in fields)
+
+        deadline = now_ms() + (timeout_ms or self.timeout_s * 1000)
+        conn, reused = self._acquire(key, deadline=deadline)
+        try:
+            status, reason, content, keep_alive, headers = self._exchange(conn, message, method, reused, sink)
+        except _StaleConnection:
+            # The server closed the idle socket: reconnect once and resend
+            conn.close()
+            self.retries += 1
+            conn, reused = self._acquire(key, fresh=True, deadline=deadline)
+            try:
+                status, reason, content, keep_alive, headers = self._exchange(conn, message, method, False, sink)
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        conn.requests += 1
+        conn.last_used = now_ms()
+        conn.deadline = None
+        if keep_alive and conn.requests < self.max_requests:
+            self._connections[key] = conn
+        else:
+            conn.close()
+        return HttpResponse(status, content, reason, headers)
+
+    def get(self, url, **kw):
+        return self.request("GET", url, **kw)
+
+    def post(self, url, **kw):
+        return self.request("POST", url, **kw)
+
+    def put(self, url, **kw):
+        return self.request("PUT", url, **kw)
+
+    def delete(self, url, **kw):
+        return self.request("DELETE", url, **kw)
+
+    def close(self):
+        """
+        Close every open connection (e.g. before WiFi goes down)
+        """
+        connections = self._connections
+        self._connections = {}
+        for conn in connections.values():
+            conn.close()
+
+    # Internals
+
+    def _acquire(self, key, fresh=False, deadline=None):
+        # Returns (connection, reused); the connection is removed from the
+        # pool while in use and put back when the response is complete
+        conn = self._connections.pop(key, None)
+        if conn is not None:
+            if not fresh and now_ms() - conn.last_used < self.max_idle_ms:
+                self.reused += 1
+                conn.deadline = deadline
+                return conn, True
+            conn.close()
+        conn = self._open(*key, deadline=deadline)
+        conn.deadline = deadline
+        return conn, False
+
+    def _open(self, https, host, port, deadline=None):
+        addr = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0][-1]
+        sock = socket.socket()
+        try:
+            left = self.timeout_s * 1000 if deadline is None else deadline - now_ms()
+            if left <= 0:
+                raise OSError(110, "Request deadline passed")
+            sock.settimeout(left / 1000)
+            sock.connect(addr)
+            if https:
+                sock = self._wrap_tls(sock, host)
+        except Exception:
+            sock.close()
+            raise
+        self.opened += 1
+        reader = sock.makefile("rb") if hasattr(sock, "makefile") else sock
+        return _Connection(sock, reader)
+
+    def _wrap_tls(self, sock, host):
+        if ssl is None:
+            raise OSError("TLS is not available")
+        if hasattr(ssl, "create_default_context"):
+            return ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+        return ssl.wrap_socket(sock, server_hostname=host)
+
+    def _exchange(self, conn, message, method, reused, sink=None):
+        # Send one request and read its response
+        # Returns (status, reason, body, keep_alive, headers)
+        try:
+            conn.send(message)
+            status_line = conn.readline()
+        except OSError as e:
+            # A timeout may mean the server is still working on the
+            # request, so only a reset or closed socket is retried
+            if reused and not _is_timeout(e):
+                raise _StaleConnection()
+            raise
+        if not status_line:
+            if reused:
+                raise _StaleConnection()
+            raise OSError("Connection closed by server")
+
+        status, reason, keep_alive = parse_status_line(status_line)
+
+        length = None
+        chunked = False
+        headers = {}
+        while True:
+            line = conn.readline()
+            if not line or line == b"\r\n":
+                break
+            length, chunked, keep_alive = parse_header(line, length, chunked, keep_alive, headers)
+
+        if not has_body(method, status):
+            body = b""
+        elif sink is not None and status == 200:
+            body = b""
+            if not self._stream(conn, sink, length, chunked):
+                keep_alive = False
+        elif chunked:
+            body = self._read_chunked(conn)
+        elif length is not None:
+            body = conn.read_exactly(length)
+        else:
+            # No length: the body runs until the server closes the socket
+            body = conn.read_to_end()
+            keep_alive = False
+        return status, reason, body, keep_alive, headers
+
+    def _stream(self, conn, sink, length, chunked):
+        # Feed the body to sink; returns False if it ran to the end of
+        # the stream (no length), so the connection cannot be reused
+        if chunked:
+            while True:
+                size = parse_chunk_size(conn.readline())
+                if size == 0:
+                    while True:
+                        line = conn.readline()
+                        if not line or line == b"\r\n":
+                            return True
+                self._stream_exactly(conn, sink, size)
+                conn.read_exactly(2)
+        if length is not None:
+            self._stream_exactly(conn, sink, length)
+            return True
+        view = memoryview(self._stream_buffer)
+        while True:
+            count = conn.readinto(view)
+            if not count:
+                return False
+            sink.feed(view[:count])
+
+    def _stream_exactly(self, conn, sink, size):
+        view = memoryview(self._stream_buffer)
+        while size > 0:
+            count = conn.readinto(view[:min(size, STREAM_CHUNK)])
+            if not count:
+                raise OSError("Connection closed mid-response")
+            sink.feed(view[:count])
+            size -= count
+
+    def _read_chunked(self, conn):
+        chunks = []
+        while True:
+            size = parse_chunk_size(conn.readline())
+            if size == 0:
+                # Skip trailers up to the blank line
+                while True:
+                    line = conn.readline()
+                    if not line or line == b"\r\n":
+                        return b"".join(chunks)
+            chunks.append(conn.read_exactly(size))
+            conn.read_exactly(2)  # CRLF after each chunk
+
+
+_client = None
+
+
+def get_client():
+    """
+    Get the HTTP client shared by all managers
+
+    Returns:
+        HttpClient: Shared client
+    """
+    global _client
+    if _client is None:
+        _client = HttpClient()
+        log_message("HTTP client ready (keep-alive)")
+    return _client
@@ -0,0 +1,290 @@
+"""
+JSON Stream
+Incremental JSON tokenizer for answers that are a list of objects. It
+is fed the body piece by piece as it comes off the socket (see
+ApiClient.request stream=...), so neither the body text nor an object
+tree is built: subclasses pick the values they need from the events
+(container opened/closed, scalar, string) and drop the rest.
+
+Only keys and the strings a subclass asks for are copied, into one
+token buffer of MAX_TOKEN bytes, so memory use does not depend on the
+length of the answer
+"""
+
+import sys
+
+sys.path.append('/config')
+sys.path.append('/utils')
+sys.path.append('/hal')
+
+from hal import ujson
+
+from helpers import log_message
+
+# Longest key, number or kept string; longer strings are cut
+MAX_TOKEN = 64
+
+# Deepest nesting accepted
+MAX_DEPTH = 16
+
+OBJECT = 0x7B  # {
+ARRAY = 0x5B   # [
+
+# Parser modes
+_BETWEEN = 0
+_STRING = 1
+_SCALAR = 2
+
+# Byte classes: whitespace, and bytes of numbers and true/false/null
+_SPACE = 1
+_SCALAR_BYTE = 2
+_CLASSES = bytearray(256)
+for _c in b" \t\r\n":
+    _CLASSES[_c] = _SPACE
+for _c in b"0123456789+-.eEtruefalsn":
+    _CLASSES[_c] = _SCALAR_BYTE
+
+
+def _utf8_end(data, length):
+    # Length of data[:length] without a trailing incomplete UTF-8 sequence
+    start = length - 1
+    while start >= 0 and length - start < 4 and data[start] & 0xC0 == 0x80:
+        start -= 1
+    if start < 0 or data[start] < 0xC0:
+        return length
+    lead = data[start]
+    size = 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4
+    return length if length - start >= size else start
+
+
+def micro_degrees(text):
+    """
+    Convert a decimal degree string to integer microdegrees without a
+    float (single precision on the ESP32 would lose about a meter)
+
+    Args:
+        text: JSON number, e.g. "50.0045123"
+
+    Returns:
+        int: Microdegrees, rounded
+
+    Raises:
+        ValueError: Not a number
+    """
+    if "e" in text or "E" in text:
+        return int(round(float(text) * 1000000))
+    negative = text.startswith("-")
+    whole, _, fraction = text.lstrip("-").partition(".")
+    value = int(whole or "0") * 1000000 + int((fraction + "000000")[:6])
+    if len(fraction) > 6 and fraction[6] >= "5":
+        value += 1
+    return -value if negative else value
+
+
+def scalar_value(text):
+    """
+    Convert the text of a number or literal to its value
+
+    Raises:
+        ValueError: Not a number or literal
+    """
+    if text == "true":
+        return True
+    if text == "false":
+        return False
+    if text == "null":
+        return None
+    if "." in text or "e" in text or "E" in text:
+        return float(text)
+    return int(text)
+
+
+class ListParser:
+    """
+    Streaming parser for a JSON array; subclasses handle the events
+    While an event runs, depth is the number of open containers (1 in
+    the top-level list, 2 in one of its objects) and key is the last
+    object key read. Create one parser per response
+    """
+
+    # Name used in log messages
+    NAME = "List"
+
+    def __init__(self):
+        self.error = None
+        self.depth = 0
+        self.key = None
+
+        self._kinds = bytearray(MAX_DEPTH)  # open containers: { or [
+        self._started = False
+        self._expect_key = False
+        self._mode = _BETWEEN
+        self._escape = False
+        self._keep = False
+        self._is_key = False
+        self._token = bytearray(MAX_TOKEN)
+        self._length = 0
+
+    def feed(self, data):
+        """
+        Parse the next piece of the body
+
+        Args:
+            data: bytes, bytearray or memoryview
+        """
+        if self.error is not None:
+            return
+        token = self._token
+        classes = _CLASSES
+        for c in data:
+            mode = self._mode
+            if mode == _STRING:
+                if self._escape:
+                    self._escape = False
+                elif c == 0x5C:  # backslash: the next byte is escaped
+                    self._escape = True
+                elif c == 0x22:  # closing quote
+                    self._mode = _BETWEEN
+                    self._string_done()
+                    continue
+                if self._keep and self._length < MAX_TOKEN:
+                    token[self._length] = c
+                    self._length += 1
+                continue
+
+            if mode == _SCALAR:
+                if classes[c] == _SCALAR_BYTE:
+                    if self._length < MAX_TOKEN:
+                        token[self._length] = c
+                        self._length += 1
+                    continue
+                self._mode = _BETWEEN
+                self._scalar_done()
+
+            if classes[c] == _SPACE:
+                continue
+            if c == 0x22:  # opening quote
+                self._start_string()
+            elif c == OBJECT or c == ARRAY:
+                self._open(c)
+            elif c == 0x7D or c == 0x5D:  # } or ]
+                self._close(OBJECT if c == 0x7D else ARRAY)
+            elif c == 0x2C:  # ,
+                self._expect_key = self.depth > 0 and self._kinds[self.depth - 1] == OBJECT
+            elif c == 0x3A:  # :
+                continue
+            elif classes[c] == _SCALAR_BYTE:
+                self._mode = _SCALAR
+                token[0] = c
+                self._length = 1
+            else:
+                self.fail("Unexpected byte {}".format(c))
+            if self.error is not None:
+                return
+
+    def result(self):
+        """
+        Get the parsed data once the whole body was fed
+
+        Returns:
+            The subclass result (see finish), or None if the body was not
+            a complete JSON array
+        """
+        if self._mode == _SCALAR:
+            self._mode = _BETWEEN
+            self._scalar_done()
+        if self.error is None and (self.depth or self._mode != _BETWEEN or not self._started):
+            self.fail("Truncated body")
+        if self.error is not None:
+            log_message("{} not parsed: {}".format(self.NAME, self.error), "ERROR")
+            return None
+        return self.finish()
+
+    def fail(self, message):
+        """
+        Stop parsing; result() will return None
+        """
+        if self.error is None:
+            self.error = message
+
+    # Events (override in subclasses)
+
+    def keep_string(self):
+        """Return True to get the current value string through on_string"""
+        return False
+
+    def on_open(self, kind):
+        """A container (OBJECT or ARRAY) was opened; depth includes it"""
+
+    def on_close(self, kind):
+        """A container was closed; depth no longer includes it"""
+
+    def on_scalar(self, text):
+        """A number or literal was read (its text, see scalar_value)"""
+
+    def on_string(self, text):
+        """A value string asked for with keep_string was read"""
+
+    def finish(self):
+        """Return the result of a complete parse"""
+        return None
+
+    # Internals
+
+    def _start_string(self):
+        self._mode = _STRING
+        self._length = 0
+        self._escape = False
+        self._is_key = self._expect_key
+        self._keep = self._is_key or self.keep_string()
+
+    def _text(self):
+        length = self._length
+        if length == MAX_TOKEN:
+            # Cut string: drop a multi-byte character the cut split
+            length = _utf8_end(self._token, length)
+        raw = bytes(self._token[:length])
+        try:
+            if 0x5C in raw:
+                try:
+                    return ujson.loads('"' + str(raw, "utf-8") + '"')
+                except ValueError:
+                    # Cut inside an escape: keep the text before it
+                    raw = raw[:raw.rfind(b"\\")]
+                    return ujson.loads('"' + str(raw, "utf-8") + '"')
+            return str(raw, "utf-8")
+        except ValueError:
+            # Invalid UTF-8 or escape from the server
+            return ""
+
+    def _string_done(self):
+        if self._is_key:
+            self.key = self._text()
+            self._expect_key = False
+        elif self._keep:
+            self.on_string(self._text())
+
+    def _scalar_done(self):
+        self.on_scalar(str(bytes(self._token[:self._length]), "ascii"))
+
+    def _open(self, kind):
+        depth = self.depth
+        if depth == 0 and kind != ARRAY:
+            self.fail("Not a list")
+            return
+        if depth == MAX_DEPTH:
+            self.fail("Nested too deeply")
+            return
+        self._started = True
+        self._kinds[depth] = kind
+        self.depth = depth + 1
+        self._expect_key = kind == OBJECT
+        self.on_open(kind)
+
+    def _close(self, kind):
+        if not self.depth or self._kinds[self.depth - 1] != kind:
+            self.fail("Unbalanced {}".format(chr(kind + 2)))
+            return
+        self.depth -= 1
+        self._expect_key = False
+        self.on_close(kind)
@@ -0,0 +1,394 @@
+"""
+Node Cache
+Node coordinates and types (NodeResponseDTO) kept in RAM and on flash,
+so a boot or a mission does not have to ask the server for nodes it
+already knows.
+
+RAM holds the most recently used nodes (least recently used evicted);
+flash holds a fixed table of 20-byte records addressed by node ID
+(slot = ID % slots, linear probing; ID 0 marks an empty slot).
+Coordinates are stored as microdegrees, so nothing is decoded twice.
+
+Entries older than NODE_CACHE_CONFIG TTL_S are fetched again when used;
+if the server cannot be reached the old entry is returned. Without a
+set wall clock the fetch time cannot be compared, so an entry is
+trusted for TTL_S of uptime after it was loaded.
+
+prefetch() reads the whole node list in one streamed request
+"""
+
+import sys
+import time
+import struct
+
+sys.path.append('/config')
+sys.path.append('/utils')
+sys.path.append('/hal')
+sys.path.append('/modules')
+
+from hal import flash_path
+
+from config import NODE_CACHE_CONFIG
+from helpers import log_message, clock_valid
+from clock import now_ms
+from json_stream import ListParser, OBJECT, micro_degrees, scalar_value
+
+MAGIC = b"NOD1"
+HEADER_FORMAT = "<4sHHH"  # magic, slots, record size, used slots
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# node ID, latitude, longitude (microdegrees), fetched (time.time()), type
+RECORD_FORMAT = "<iiiII"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# Names for NodeResponseDTO Type values (the server's NodeType enum)
+NODE_TYPE_NAMES = ("UserNode", "ChargingStation", "Depot")
+
+
+def node_type_code(value):
+    """
+    Get the NodeType value of a node's type field; the server sends the
+    enum name (JsonStringEnumConverter), older builds the number
+
+    Args:
+        value: "ChargingStation", 1, ...
+
+    Returns:
+        int: NodeType value (0 if unknown)
+    """
+    if isinstance(value, int):
+        return value
+    if value in NODE_TYPE_NAMES:
+        return NODE_TYPE_NAMES.index(value)
+    return 0
+
+# RAM entry fields
+_LAT = 0
+_LON = 1
+_TYPE = 2
+_FETCHED = 3
+_LOADED = 4
+_USED = 5
+
+
+class NodeListParser(ListParser):
+    """
+    Streaming parser for GET /api/Node: every node is stored in the
+    cache as soon as its object ends, and only the count is returned
+    """
+
+    NAME = "Node list"
+
+    def __init__(self, cache):
+        """
+        Args:
+            cache: NodeCache to fill
+        """
+        super().__init__()
+        self.cache = cache
+        self.count = 0
+        self._node = None
+
+    def finish(self):
+        """
+        Returns:
+            int: Number of nodes stored
+        """
+        return self.count
+
+    def keep_string(self):
+        # Only the enum name of the type is copied
+        return self.depth == 2 and self._node is not None and self.key == "type"
+
+    def on_string(self, text):
+        self._node["type"] = node_type_code(text)
+
+    def on_scalar(self, text):
+        if self.depth != 2 or self._node is None:
+            return
+        key = self.key
+        try:
+            if key == "latitude" or key == "longitude":
+                self._node[key] = micro_degrees(text)
+            elif key == "id":
+                self._node[key] = scalar_value(text)
+            elif key == "type":
+                self._node[key] = node_type_code(scalar_value(text))
+        except ValueError:
+            self.fail("Bad number {}".format(text))
+
+    def on_open(self, kind):
+        if self.depth == 2 and kind == OBJECT:
+            self._node = {}
+
+    def on_close(self, kind):
+        if self.depth != 1 or self._node is None:
+            return
+        node = self._node
+        self._node = None
+        if node.get("id") and "latitude" in node and "longitude" in node:
+            self.cache.put(node["id"], node["latitude"], node["longitude"], node.get("type") or 0,
+                           flush=False)
+            self.count += 1
+
+
+class NodeCache:
+    """
+    Node metadata cache: RAM LRU in front of a flash table
+    The flash file is created on the first put
+    """
+
+    def __init__(self, api, path=None, ram_entries=None, flash_slots=None, ttl_s=None):
+        """
+        Args:
+            api: ApiClient used to fetch nodes
+            path: Device file path (default: NODE_CACHE_CONFIG PATH)
+            ram_entries: Nodes kept in RAM (default: NODE_CACHE_CONFIG RAM_ENTRIES)
+            flash_slots: Nodes kept on flash (default: NODE_CACHE_CONFIG FLASH_SLOTS)
+            ttl_s: Seconds before a node is fetched again (default:
+                   NODE_CACHE_CONFIG TTL_S)
+        """
+        self.api = api
+        self.path = flash_path(path or NODE_CACHE_CONFIG["PATH"])
+        self.ram_entries = ram_entries or NODE_CACHE_CONFIG["RAM_ENTRIES"]
+        self.slots = flash_slots or NODE_CACHE_CONFIG["FLASH_SLOTS"]
+        self.ttl_s = ttl_s or NODE_CACHE_CONFIG["TTL_S"]
+        self.used = 0
+        self.fetches = 0
+
+        self._ram = {}    # node ID -> [lat, lon, type, fetched, loaded ms, use stamp]
+        self._stamp = 0
+        self._file = None
+        self._record = bytearray(RECORD_SIZE)
+        self._open_existing()
+
+    def __len__(self):
+        # Nodes on flash (all nodes ever stored, RAM only mirrors them)
+        return self.used
+
+    def get(self, node_id, fetch=True):
+        """
+        Get a node, fetching it from the server if it is missing or stale
+
+        Args:
+            node_id: Node ID
+            fetch: False to only look in the cache
+
+        Returns:
+            dict: id, latitude, longitude, type, typeName (like
+                  NodeResponseDTO), or None if the node is unknown
+        """
+        entry = self._lookup(node_id)
+        if entry is not None and (not fetch or self._fresh(entry)):
+            return _node(node_id, entry)
+        if not fetch:
+            return None
+        status, data = self.api.get("/api/Node/{}".format(node_id))
+        return self._fetched(node_id, entry, status, data)
+
+    async def get_async(self, node_id):
+        """
+        Coroutine version of get on the async client
+        """
+        entry = self._lookup(node_id)
+        if entry is not None and self._fresh(entry):
+            return _node(node_id, entry)
+        status, data = await self.api.request_async("GET", "/api/Node/{}".format(node_id))
+        return self._fetched(node_id, entry, status, data)
+
+    def prefetch(self):
+        """
+        Fetch every node in one request and store them all
+
+        Returns:
+            int: Number of nodes stored (0 if the request failed)
+        """
+        return self._prefetched(*self.api.get("/api/Node", stream=self._list_parser))
+
+    async def prefetch_async(self):
+        """
+        Coroutine version of prefetch on the async client
+        """
+        return self._prefetched(*(await self.api.request_async("GET", "/api/Node", stream=self._list_parser)))
+
+    def put(self, node_id, latitude, longitude, node_type, fetched=None, flush=True):
+        """
+        Store a node in RAM and on flash
+
+        Args:
+            node_id: Node ID (> 0)
+            latitude: Latitude in microdegrees
+            longitude: Longitude in microdegrees
+            node_type: NodeType value
+            fetched: time.time() when it was read (default: now)
+            flush: False to leave the header write to a later flush()
+                   (e.g. while a node list is being stored)
+        """
+        if fetched is None:
+            fetched = int(time.time())
+        self._remember(node_id, [latitude, longitude, node_type, fetched, now_ms(), 0])
+        self._store(node_id, latitude, longitude, node_type, fetched)
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the header (node count) and flush the file
+        """
+        if self._file is not None:
+            self._write_header()
+
+    def close(self):
+        """
+        Close the file (nodes stay on flash)
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Internals
+
+    def _fresh(self, entry):
+        if clock_valid():
+            return time.time() - entry[_FETCHED] < self.ttl_s
+        return now_ms() - entry[_LOADED] < self.ttl_s * 1000
+
+    def _lookup(self, node_id):
+        # RAM, then flash; marks the entry as used
+        entry = self._ram.get(node_id)
+        if entry is None:
+            entry = self._load(node_id)
+        if entry is not None:
+            self._stamp += 1
+            entry[_USED] = self._stamp
+        return entry
+
+    def _fetched(self, node_id, entry, status, data):
+        # Store a GET /api/Node/{id} answer; if there is none, fall back
+        # to the stale entry
+        if status == 200 and isinstance(data, dict) \
+                and data.get("latitude") is not None and data.get("longitude") is not None:
+            latitude = data["latitude"]
+            longitude = data["longitude"]
+            self.fetches += 1
+            self.put(node_id, int(round(latitude * 1000000)), int(round(longitude * 1000000)),
+                     node_type_code(data.get("type")))
+            log_message("Node {} info fetched: ({:.6f}, {:.6f})".format(node_id, latitude, longitude))
+            return _node(node_id, self._ram[node_id])
+        log_message("Failed to fetch node {}: Status {}".format(node_id, status), "ERROR")
+        if entry is not None:
+            log_message("Node {}: using cached entry, server not reached".format(node_id), "WARNING")
+            return _node(node_id, entry)
+        return None
+
+    def _list_parser(self):
+        return NodeListParser(self)
+
+    def _prefetched(self, status, count):
+        self.flush()
+        if status != 200 or count is None:
+            log_message("Node prefetch failed: Status {}".format(status), "WARNING")
+            return 0
+        self.fetches += 1
+        log_message("Node cache: {} node(s) prefetched".format(count))
+        return count
+
+    def _remember(self, node_id, entry):
+        ram = self._ram
+        if node_id not in ram and len(ram) >= self.ram_entries:
+            oldest = None
+            for key in ram:
+                if oldest is None or ram[key][_USED] < ram[oldest][_USED]:
+                    oldest = key
+            del ram[oldest]
+        self._stamp += 1
+        entry[_USED] = self._stamp
+        ram[node_id] = entry
+
+    def _load(self, node_id):
+        # Flash lookup; a hit is copied into RAM
+        slot = self._find(node_id)
+        if slot is None or not self._record_id():
+            return None
+        _, latitude, longitude, fetched, node_type = struct.unpack(RECORD_FORMAT, self._record)
+        entry = [latitude, longitude, node_type, fetched, now_ms(), 0]
+        self._remember(node_id, entry)
+        return entry
+
+    def _find(self, node_id):
+        # Slot holding node_id, else the first empty slot on its probe
+        # path (None if the table is full); the record is left in _record
+        if self._file is None or node_id <= 0:
+            return None
+        for probe in range(self.slots):
+            slot = (node_id + probe) % self.slots
+            self._file.seek(HEADER_SIZE + slot * RECORD_SIZE)
+            if self._file.readinto(self._record) != RECORD_SIZE:
+                return None
+            record_id = self._record_id()
+            if record_id == node_id or record_id == 0:
+                return slot
+        return None
+
+    def _record_id(self):
+        return struct.unpack_from("<i", self._record, 0)[0]
+
+    def _store(self, node_id, latitude, longitude, node_type, fetched):
+        if node_id <= 0:
+            return
+        if self._file is None:
+            self._create()
+        slot = self._find(node_id)
+        if slot is None:
+            # Table full: replace the node in the home slot
+            slot = node_id % self.slots
+        elif not self._record_id():
+            self.used += 1
+        struct.pack_into(RECORD_FORMAT, self._record, 0, node_id, latitude, longitude,
+                         fetched & 0xFFFFFFFF, node_type)
+        self._file.seek(HEADER_SIZE + slot * RECORD_SIZE)
+        self._file.write(self._record)
+
+    def _open_existing(self):
+        try:
+            f = open(self.path, "r+b")
+        except OSError:
+            return
+        data = f.read(HEADER_SIZE)
+        if len(data) == HEADER_SIZE:
+            magic, slots, record_size, used = struct.unpack(HEADER_FORMAT, data)
+            if magic == MAGIC and slots == self.slots and record_size == RECORD_SIZE:
+                self._file = f
+                self.used = used
+                return
+        # Different layout (or damaged): start over on the next put
+        f.close()
+        log_message("Node cache: discarding incompatible file {}".format(self.path), "WARNING")
+
+    def _create(self):
+        f = open(self.path, "wb+")
+        f.write(bytes(HEADER_SIZE))
+        empty = bytes(RECORD_SIZE * 16)
+        for _ in range(0, self.slots, 16):
+            f.write(empty)
+        f.flush()
+        self._file = f
+        self.used = 0
+        self._write_header()
+
+    def _write_header(self):
+        self._file.seek(0)
+        self._file.write(struct.pack(HEADER_FORMAT, MAGIC, self.slots, RECORD_SIZE, self.used))
+        self._file.flush()
+
+
+def _node(node_id, entry):
+    # RAM entry -> NodeResponseDTO-like dict
+    node_type = entry[_TYPE]
+    return {
+        "id": node_id,
+        "latitude": entry[_LAT] / 1000000,
+        "longitude": entry[_LON] / 1000000,
+        "type": node_type,
+        "typeName": NODE_TYPE_NAMES[node_type] if node_type < len(NODE_TYPE_NAMES) else ""
+    }
@@ -1,132 +1,173 @@
-import urequests
-import ujson
 import sys
 
 sys.path.append('/config')
 sys.path.append('/utils')
+sys.path.append('/hal')
+
+from config import API_CONFIG, RUNTIME_CONFIG, DEBUG
+from helpers import log_message, format_timestamp
+from api_client import is_transient
+from order_stream import OrderListParser, Route
+
+MY_ORDERS_ENDPOINT = "/api/Robot/my-orders"
+
+# Pause between long polls (the server's hold does the waiting)
+LONG_POLL_GAP_MS = 1000
 
-from config import API_CONFIG, DEBUG
-from helpers import log_message
 
 class OrderManager:
     """
     Manages robot orders and delivery missions
     """
 
-    def __init__(self, robot, auth_manager):
+    def __init__(self, robot, auth_manager, outbox=None):
+        """
+        Args:
+            robot: Robot carrying the orders
+            auth_manager: AuthManager (its ApiClient is used for requests)
+            outbox: Optional Outbox for phase updates the server did not get
+        """
         self.robot = robot
+        self.outbox = outbox
         self.auth_manager = auth_manager
-        self.base_url = API_CONFIG["BASE_URL"]
+        self.api = auth_manager.api
         self.current_order = None
         self.pickup_coordinates = None
         self.dropoff_coordinates = None
         self.route_waypoints = None
 
-    def fetch_assigned_orders(self):
+        # Order polling: the interval doubles while nothing comes in, up
+        # to ORDER_CHECK_MAX_MS, and is reset by new orders and after a
+        # delivery. With ORDER_WAIT_S the server holds each poll instead
+        self.poll_base_ms = RUNTIME_CONFIG["ORDER_CHECK_MS"]
+        self.poll_max_ms = RUNTIME_CONFIG.get("ORDER_CHECK_MAX_MS", self.poll_base_ms)
+        self.poll_interval_ms = self.poll_base_ms
+        self.wait_s = API_CONFIG.get("ORDER_WAIT_S", 0)
+
+    def request_assigned_orders(self):
         """
-        Fetch orders assigned to this robot from server
+        Start fetching the orders assigned to this robot
+        (the answer is read with assigned_orders once the call is done)
+        The request is conditional: an unchanged list costs a 304. In
+        non-blocking mode with ORDER_WAIT_S the server may hold it until
+        the list changes. The answer is parsed as it is read, keeping only
+        the fields start_order uses (see order_stream)
 
         Returns:
-            list: List of assigned orders or empty list
+            ApiCall: Pending request, or None if not authenticated
         """
         if not self.auth_manager.is_authenticated():
             log_message("Cannot fetch orders: Not authenticated", "WARNING")
-            return []
+            return None
+        if self.long_polling():
+            # Own task, so held polls do not delay telemetry and phases
+            return self.api.submit(
+                "GET", "{}?wait={}".format(MY_ORDERS_ENDPOINT, self.wait_s),
+                conditional=True, ordered=False, stream=OrderListParser,
+                timeout_ms=(self.wait_s + API_CONFIG.get("REQUEST_TIMEOUT", 10)) * 1000)
+        return self.api.submit("GET", MY_ORDERS_ENDPOINT, conditional=True, stream=OrderListParser)
+
+    def long_polling(self):
+        """
+        Check if order polls are held by the server (needs the async client)
+        """
+        return self.wait_s > 0 and self.api.is_nonblocking()
 
-        try:
-            # Build request URL
-            url = "{}/api/Robot/my-orders".format(self.base_url)
+    def poll_delay_ms(self):
+        """
+        Get the delay before the next order poll
 
-            headers = {
-                "Authorization": "Bearer {}".format(self.auth_manager.get_token()),
-                "Content-Type": "application/json"
-            }
+        Returns:
+            int: Milliseconds
+        """
+        if self.long_polling():
+            return LONG_POLL_GAP_MS
+        return self.poll_interval_ms
+
+    def reset_poll_interval(self):
+        """
+        Poll at the base interval again (e.g. right after a delivery)
+        """
+        self.poll_interval_ms = self.poll_base_ms
+
+    def assigned_orders(self, call):
+        """
+        Get the orders from a finished request_assigned_orders call
 
-            if DEBUG:
-                log_message("Fetching orders from: {}".format(url), "DEBUG")
+        Args:
+            call: Finished ApiCall (or None)
 
-            # Make GET request
-            response = urequests.get(url, headers=headers)
+        Returns:
+            list: List of assigned orders or empty list
+        """
+        if call is None:
+            return []
+        status, orders = call.status, call.data
 
-            if response.status_code == 200:
-                orders = ujson.loads(response.text)
+        if status in (200, 304) and isinstance(orders, list):
+            if status == 200:
                 log_message("Fetched {} order(s) from server".format(len(orders)))
-                return orders
+            if orders:
+                self.reset_poll_interval()
             else:
-                log_message(
-                    "Failed to fetch orders: {} - {}".format(response.status_code, response.text),
-                    "ERROR"
-                )
-                return []
-
-        except Exception as e:
-            log_message("Error fetching orders: {}".format(str(e)), "ERROR")
-            return []
-        finally:
-            if 'response' in locals():
-                response.close()
+                # Nothing to do: poll less often while idle
+                self.poll_interval_ms = min(self.poll_interval_ms * 2, self.poll_max_ms)
+            return orders
 
-    def accept_order(self, order_id):
+        log_message("Failed to fetch orders: {} - {}".format(status, orders), "ERROR")
+        return []
+
+    def request_accept(self, order_id):
         """
-        Accept an assigned order from server
+        Start accepting an assigned order on the server
+        (the answer is read with order_accepted once the call is done)
 
         Args:
             order_id: Order ID to accept
 
         Returns:
-            bool: True if accepted successfully
+            ApiCall: Pending request, or None if not authenticated
         """
         if not self.auth_manager.is_authenticated():
             log_message("Cannot accept order: Not authenticated", "WARNING")
-            return False
+            return None
 
-        try:
-            # Build request URL
-            url = "{}/api/Robot/order/{}/accept".format(self.base_url, order_id)
+        log_message("Accepting order {}...".format(order_id))
+        return self.api.submit("POST", "/api/Robot/order/{}/accept".format(order_id))
 
-            # Build headers with JWT token
-            headers = {
-                "Authorization": "Bearer {}".format(self.auth_manager.get_token()),
-                "Content-Type": "application/json"
-            }
+    def order_accepted(self, order_id, call):
+        """
+        Check the answer of a finished request_accept call
 
-            log_message("Accepting order {}...".format(order_id))
+        Args:
+            order_id: Order ID that was accepted
+            call: Finished ApiCall (or None)
 
-            if DEBUG:
-                log_message("POST URL: {}".format(url), "DEBUG")
-                log_message("Token (first 20 chars): {}...".format(self.auth_manager.get_token()[:20]), "DEBUG")
+        Returns:
+            bool: True if accepted successfully
+        """
+        if call is None:
+            return False
+        status, result = call.status, call.data
 
-            # Make POST request
-            response = urequests.post(url, headers=headers, data="{}") 
+        if DEBUG:
+            log_message("Response: {} - {}".format(status, result), "DEBUG")
 
-            if DEBUG:
-                log_message("Response status: {}".format(response.status_code), "DEBUG")
-                log_message("Response body: {}".format(response.text), "DEBUG")
+        if status == 200:
+            message = result.get("message", "") if isinstance(result, dict) else ""
+            log_message("Order {} accepted: {}".format(order_id, message))
+            return True
 
-            if response.status_code == 200:
-                result = ujson.loads(response.text)
-                log_message("Order {} accepted: {}".format(order_id, result.get("message", "")))
-                return True
-            else:
-                log_message(
-                    "Failed to accept order: {} - {}".format(response.status_code, response.text),
-                    "ERROR"
-                )
-                return False
-
-        except Exception as e:
-            log_message("Error accepting order: {}".format(str(e)), "ERROR")
-            return False
-        finally:
-            if 'response' in locals():
-                response.close()
+        log_message("Failed to accept order: {} - {}".format(status, result), "ERROR")
+        return False
 
     def start_order(self, order_data):
         """
         Start a delivery order from server data
 
         Args:
-            order_data: Order data from server (OrderAssignmentDTO)
+            order_data: Order data from server (OrderAssignmentDTO fields,
+                        route as a Route or a list of waypoint dicts)
 
         Returns:
             bool: True if order started, False otherwise
@@ -146,7 +187,9 @@ class OrderManager:
         pickup_lon = order_data.get("pickupLongitude")
         dropoff_lat = order_data.get("dropoffLatitude")
         dropoff_lon = order_data.get("dropoffLongitude")
-        route = order_data.get("route", [])
+        route = order_data.get("route")
+        if not isinstance(route, Route):
+            route = Route.from_waypoints(route)
 
         self.current_order = {
             "id": order_id,
@@ -176,6 +219,8 @@ class OrderManager:
     def update_order_phase(self, phase_name, latitude=None, longitude=None):
         """
         Update order delivery phase on server
+        With an outbox the update is queued on flash and delivered in the
+        background, in order and with retries, so the caller never waits
 
         Args:
             phase_name: Phase name (FLIGHT_TO_PICKUP, AT_PICKUP, etc.)
@@ -183,7 +228,7 @@ class OrderManager:
             longitude: Current longitude (optional)
 
         Returns:
-            bool: True if updated successfully
+            bool: True if the update was queued or sent (the answer comes later)
         """
         if not self.current_order:
             log_message("Cannot update phase: No active order", "WARNING")
@@ -193,62 +238,64 @@ class OrderManager:
             log_message("Cannot update phase: Not authenticated", "WARNING")
             return False
 
-        try:
-            order_id = self.current_order["id"]
-
-            # Build request URL
-            url = "{}/api/Robot/order/{}/phase".format(self.base_url, order_id)
-
-            # Build headers with JWT token
-            headers = {
-                "Authorization": "Bearer {}".format(self.auth_manager.get_token()),
-                "Content-Type": "application/json"
-            }
-
-            # Build request body
-            body = {
-                "phase": phase_name,
-                "latitude": latitude if latitude else self.robot.current_latitude,
-                "longitude": longitude if longitude else self.robot.current_longitude,
-                "timestamp": "{}Z".format(self._get_utc_timestamp())
-            }
+        order_id = self.current_order["id"]
+        latitude = latitude if latitude else self.robot.current_latitude
+        longitude = longitude if longitude else self.robot.current_longitude
 
-            log_message("Updating order phase to: {}".format(phase_name))
+        if self.outbox is not None:
+            if len(self.outbox):
+                log_message("Phase {} queued behind {} message(s)".format(phase_name, len(self.outbox)))
+            else:
+                log_message("Queuing order phase: {}".format(phase_name))
+            self.outbox.push_phase(order_id, phase_name, latitude, longitude)
+            return True
 
-            # Make POST request
-            response = urequests.post(url, headers=headers, data=ujson.dumps(body))
+        log_message("Updating order phase to: {}".format(phase_name))
 
-            if response.status_code == 200:
+        def on_done(status, result):
+            if status == 200:
                 log_message("Order phase updated successfully")
-                return True
-            else:
-                log_message(
-                    "Failed to update phase: {} - {}".format(response.status_code, response.text),
-                    "ERROR"
-                )
-                return False
-
-        except Exception as e:
-            log_message("Error updating order phase: {}".format(str(e)), "ERROR")
-            return False
-        finally:
-            if 'response' in locals():
-                response.close()
+                return
+            log_message("Failed to update phase: {} - {}".format(status, result), "ERROR")
 
-    def _get_utc_timestamp(self):
+        self._post_phase(order_id, phase_name, latitude, longitude, on_done=on_done)
+        return True
+
+    def replay_phase(self, message, on_done=None):
         """
-        Get current UTC timestamp in ISO format
+        Send a phase update stored in the outbox (with its original time
+        and its idempotency key, so a resend is applied only once)
+
+        Args:
+            message: Outbox phase message
+            on_done: Optional callable(status, result) run with the answer
 
         Returns:
-            str: ISO formatted timestamp
+            ApiCall: Request; status is None if the server could not be reached
         """
-        import time
-        # Get current time tuple
-        t = time.localtime()
-        # Format as ISO 8601 (simple version without timezone offset calculation)
-        return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}".format(
-            t[0], t[1], t[2], t[3], t[4], t[5]
-        )
+        def finish(status, result):
+            if status == 200:
+                log_message("Order phase {} delivered".format(message["phase"]))
+            elif not is_transient(status):
+                log_message("Stored phase {} for order {} rejected: {} - {}".format(
+                    message["phase"], message["orderId"], status, result), "WARNING")
+            if on_done is not None:
+                on_done(status, result)
+
+        return self._post_phase(message["orderId"], message["phase"], message["latitude"],
+                                message["longitude"], message["time"], retry=False, on_done=finish,
+                                key=self.outbox.key(message) if self.outbox is not None else None)
+
+    def _post_phase(self, order_id, phase_name, latitude, longitude, seconds=None, retry=True, on_done=None,
+                    key=None):
+        body = {
+            "phase": phase_name,
+            "latitude": latitude,
+            "longitude": longitude,
+            "timestamp": format_timestamp(seconds)
+        }
+        return self.api.submit("POST", "/api/Robot/order/{}/phase".format(order_id), body,
+                               on_done=on_done, retry=retry, idempotency_key=key)
 
     def get_pickup_coordinates(self):
         """
@@ -273,7 +320,8 @@ class OrderManager:
         Get route waypoints from server
 
         Returns:
-            list: List of waypoint dicts or None
+            Route: Waypoints (len, iteration and point(i) give
+                   (latitude, longitude) in degrees) or None
         """
         return self.route_waypoints
 
@@ -313,6 +361,9 @@ class OrderManager:
 
             self.robot.complete_delivery()
 
+            # New orders are likely soon after a delivery
+            self.reset_poll_interval()
+
     def cancel_order(self, reason="Unknown"):
         """
         Cancel current order
@@ -0,0 +1,167 @@
+"""
+Order Stream
+Streaming parser for the my-orders answer (a JSON array of
+OrderAssignmentDTO objects), see json_stream.
+
+Only the fields start_order uses are kept; the route waypoints go into
+a Route (two array('l') of microdegrees, 8 bytes per point, at most
+API_CONFIG MAX_ROUTE_POINTS). Everything else is skipped byte by byte,
+so peak memory does not depend on the length of the answer
+"""
+
+import sys
+from array import array
+
+sys.path.append('/config')
+sys.path.append('/utils')
+sys.path.append('/modules')
+
+from config import API_CONFIG
+from helpers import log_message
+from json_stream import ListParser, OBJECT, ARRAY, micro_degrees, scalar_value
+
+# Order fields kept by the parser (everything start_order reads)
+ORDER_FIELDS = ("orderId", "orderName", "weight",
+                "pickupNodeId", "pickupLatitude", "pickupLongitude",
+                "dropoffNodeId", "dropoffLatitude", "dropoffLongitude",
+                "totalDistanceMeters", "estimatedBatteryUsagePercent", "orderStatus")
+
+
+class Route:
+    """
+    Route waypoints as microdegree arrays
+    """
+
+    def __init__(self):
+        self.latitude = array("l")
+        self.longitude = array("l")
+
+    def __len__(self):
+        return len(self.latitude)
+
+    def __iter__(self):
+        for index in range(len(self.latitude)):
+            yield self.point(index)
+
+    def append(self, latitude, longitude):
+        """
+        Add a waypoint
+
+        Args:
+            latitude: Latitude in microdegrees
+            longitude: Longitude in microdegrees
+        """
+        self.latitude.append(latitude)
+        self.longitude.append(longitude)
+
+    def point(self, index):
+        """
+        Get a waypoint
+
+        Returns:
+            tuple: (latitude, longitude) in degrees
+        """
+        return self.latitude[index] / 1000000, self.longitude[index] / 1000000
+
+    @staticmethod
+    def from_waypoints(waypoints):
+        """
+        Build a route from decoded RouteWaypointDTO dicts
+
+        Args:
+            waypoints: List of dicts with latitude and longitude
+
+        Returns:
+            Route: Route with the same points
+        """
+        route = Route()
+        for waypoint in waypoints or ():
+            route.append(int(round(waypoint.get("latitude", 0) * 1000000)),
+                         int(round(waypoint.get("longitude", 0) * 1000000)))
+        return route
+
+
+class OrderListParser(ListParser):
+    """
+    Streaming parser for a list of order assignments
+    Create one per response; ApiClient does this for every attempt
+    """
+
+    NAME = "Order list"
+
+    def __init__(self, max_route_points=None):
+        """
+        Args:
+            max_route_points: Waypoints kept per order (default:
+                              API_CONFIG MAX_ROUTE_POINTS)
+        """
+        super().__init__()
+        self.max_route_points = max_route_points or API_CONFIG.get("MAX_ROUTE_POINTS", 256)
+        self.orders = []
+        # Waypoints beyond max_route_points (summed over all orders)
+        self.dropped = 0
+
+        self._order = None
+        self._route = None
+        self._latitude = None
+        self._longitude = None
+
+    def finish(self):
+        """
+        Returns:
+            list: Order dicts (ORDER_FIELDS, plus "route" as a Route)
+        """
+        if self.dropped:
+            log_message("Route cut to {} waypoints ({} dropped)".format(
+                self.max_route_points, self.dropped), "WARNING")
+        return self.orders
+
+    def keep_string(self):
+        # Only order fields are copied; other strings are skipped
+        return self.depth == 2 and self._order is not None and self.key in ORDER_FIELDS
+
+    def on_string(self, text):
+        self._order[self.key] = text
+
+    def on_scalar(self, text):
+        depth = self.depth
+        if depth == 4 and self._route is not None:
+            # Waypoint coordinate: straight to microdegrees
+            try:
+                if self.key == "latitude":
+                    self._latitude = micro_degrees(text)
+                elif self.key == "longitude":
+                    self._longitude = micro_degrees(text)
+            except ValueError:
+                self.fail("Bad coordinate {}".format(text))
+            return
+        if depth != 2 or self._order is None or self.key not in ORDER_FIELDS:
+            return
+        try:
+            self._order[self.key] = scalar_value(text)
+        except ValueError:
+            self.fail("Bad number {}".format(text))
+
+    def on_open(self, kind):
+        depth = self.depth
+        if depth == 2 and kind == OBJECT:
+            self._order = {}
+        elif depth == 3 and kind == ARRAY and self._order is not None and self.key == "route":
+            self._route = Route()
+        elif depth == 4 and kind == OBJECT and self._route is not None:
+            self._latitude = self._longitude = None
+
+    def on_close(self, kind):
+        depth = self.depth
+        if depth == 3 and self._route is not None:
+            if self._latitude is not None and self._longitude is not None:
+                if len(self._route) < self.max_route_points:
+                    self._route.append(self._latitude, self._longitude)
+                else:
+                    self.dropped += 1
+        elif depth == 2 and self._route is not None:
+            self._order["route"] = self._route
+            self._route = None
+        elif depth == 1 and self._order is not None:
+            self.orders.append(self._order)
+            self._order = None
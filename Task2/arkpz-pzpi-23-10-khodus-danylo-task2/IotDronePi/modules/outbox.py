@@ -0,0 +1,412 @@
+"""
+Outbox
+Store-and-forward queue on flash: every order phase update, and the
+telemetry samples recorded while offline (or while the server failed),
+are kept in a ring of fixed-size binary records and delivered oldest
+first in the background.
+
+Every record has a sequence number; with the file's random epoch it
+forms an idempotency key (see Outbox.key), so a phase update that is
+sent again after a lost answer or a reset is applied only once. A
+live status update only says where the robot is now, so one that was
+not sent yet is replaced by the next instead of queued behind it;
+samples of the offline flight track are all kept.
+
+File layout: a 20-byte header (magic, capacity, record size, head and
+tail counters, epoch) followed by capacity records of RECORD_SIZE bytes.
+Head and tail only grow; a record lives at slot counter % capacity.
+A record is written before the header that makes it visible, so a
+power cut loses at most the message being written. When the ring is
+full the oldest record is overwritten
+"""
+
+import sys
+import time
+import struct
+
+try:
+    import urandom as random
+except ImportError:
+    import random
+
+sys.path.append('/config')
+sys.path.append('/core')
+sys.path.append('/utils')
+sys.path.append('/hal')
+
+from hal import flash_path
+
+from config import OUTBOX_CONFIG
+from helpers import log_message
+from robot import RobotState
+from state_machine import PHASE_NAMES
+
+MAGIC = b"OBX2"
+HEADER_FORMAT = "<4sHHIII"  # magic, capacity, record size, head, tail, epoch
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# kind, status/phase code, battery (0.01 %), time (s), current node,
+# target node, latitude and longitude (1e-7 degrees), order ID, sequence
+RECORD_FORMAT = "<BBHIiiiiiI"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# Node and order IDs that were None
+NO_ID = -1
+
+
+class MessageKind:
+    """
+    Enum-like class for outbox record kinds
+    """
+    STATUS = 1
+    PHASE = 2
+
+
+# Code tables for the one-byte status and phase fields
+STATUS_CODES = (RobotState.IDLE, RobotState.DELIVERING, RobotState.RETURNING,
+                RobotState.CHARGING, RobotState.MAINTENANCE)
+PHASE_CODES = tuple(sorted(set(PHASE_NAMES)))
+
+
+def _fixed(value):
+    # Degrees -> 1e-7 degree integer (about 1 cm)
+    return int(round((value or 0.0) * 10000000))
+
+
+def _id(value):
+    return NO_ID if value is None else value
+
+
+def _from_id(value):
+    return None if value == NO_ID else value
+
+
+class Outbox:
+    """
+    Ring of binary records in a flash file
+    The file is created by open() or on the first append
+    """
+
+    def __init__(self, path=None, capacity=None, coalesce=None):
+        """
+        Args:
+            path: Device file path (default: OUTBOX_CONFIG PATH)
+            capacity: Records kept before the oldest is overwritten
+                      (default: OUTBOX_CONFIG CAPACITY)
+            coalesce: Replace an unsent status sample with the next one
+                      (default: OUTBOX_CONFIG COALESCE_STATUS)
+        """
+        self.path = flash_path(path or OUTBOX_CONFIG["PATH"])
+        self.capacity = capacity or OUTBOX_CONFIG["CAPACITY"]
+        self.coalesce = OUTBOX_CONFIG.get("COALESCE_STATUS", True) if coalesce is None else coalesce
+        self.head = 0
+        self.tail = 0
+        self.epoch = 0
+        self.overwritten = 0
+        self.coalesced = 0
+        # Set while the oldest record is being sent (see take); _taken
+        # is its position, which it loses if the ring overwrites it
+        self.sending = False
+        self._taken = None
+        # Records before this position were sent at least once (the
+        # server may have them), so they are never coalesced
+        self._tried = 0
+        # Called after every new record (e.g. to wake the sender)
+        self.on_push = None
+        self._file = None
+        self._header = bytearray(HEADER_SIZE)
+        self._open_existing()
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def open(self):
+        """
+        Create the file now if it does not exist, so the first message
+        does not pay for it (e.g. at boot, before a mission)
+        """
+        if self._file is None:
+            self._create()
+
+    # Writing
+
+    def push_status(self, robot, coalesce=False):
+        """
+        Queue a telemetry sample of the robot's current state
+
+        Args:
+            robot: Robot to sample
+            coalesce: See push_status_sample
+        """
+        self.push_status_sample(robot.status, robot.battery_level, robot.current_node_id,
+                                robot.target_node_id, robot.current_latitude, robot.current_longitude,
+                                coalesce=coalesce)
+
+    def push_status_sample(self, status, battery_level, node_id, target_node_id,
+                           latitude, longitude, seconds=None, coalesce=False):
+        """
+        Queue a telemetry sample taken earlier
+
+        Args:
+            status: Robot status name
+            battery_level: Battery percent
+            node_id: Current node ID (or None)
+            target_node_id: Target node ID (or None)
+            latitude: Latitude
+            longitude: Longitude
+            seconds: time.time() of the sample (default: now)
+            coalesce: True for a "latest position" update, which may
+                      replace an unsent status sample (if COALESCE_STATUS
+                      is on); samples of a flight track are always kept
+        """
+        code = STATUS_CODES.index(status) if status in STATUS_CODES else 0
+        if coalesce and self.coalesce and self._last_kind() == MessageKind.STATUS:
+            # Superseded: overwrite the unsent sample in place
+            self.coalesced += 1
+            self._write_record(self.tail - 1, MessageKind.STATUS, code, battery_level, node_id,
+                               target_node_id, latitude, longitude, None, seconds)
+            self._file.flush()
+            return
+        self._append(MessageKind.STATUS, code, battery_level, node_id, target_node_id,
+                     latitude, longitude, None, seconds)
+
+    def push_phase(self, order_id, phase_name, latitude, longitude):
+        """
+        Queue an order phase update
+
+        Args:
+            order_id: Order the phase belongs to
+            phase_name: Server phase name (FLIGHT_TO_PICKUP, AT_PICKUP, ...)
+            latitude: Latitude at the phase change
+            longitude: Longitude at the phase change
+        """
+        if phase_name not in PHASE_CODES:
+            log_message("Outbox: unknown phase {} not stored".format(phase_name), "WARNING")
+            return
+        self._append(MessageKind.PHASE, PHASE_CODES.index(phase_name), 0, None, None,
+                     latitude, longitude, order_id)
+
+    # Reading
+
+    def key(self, message):
+        """
+        Get the idempotency key of a message: unique for this file, so
+        the server can ignore a message it already applied
+
+        Args:
+            message: Message dict from peek or take
+
+        Returns:
+            str: Key, e.g. "3f9a01c2-17"
+        """
+        return "{:08x}-{}".format(self.epoch, message["sequence"])
+
+    def take(self):
+        """
+        Get the oldest message for sending; it stays in the outbox (and
+        is not coalesced) until release
+
+        Returns:
+            dict: Message (see decode), or None if the outbox is empty
+        """
+        if not len(self):
+            return None
+        self.sending = True
+        self._taken = self.head
+        self._tried = max(self._tried, self.head + 1)
+        return self.peek(1)[0]
+
+    def release(self, delivered):
+        """
+        Finish sending the message returned by take
+
+        Args:
+            delivered: True to remove it, False to keep it for a retry
+        """
+        # If the ring overwrote it meanwhile, the head is a record that
+        # was never sent
+        if self.sending and delivered and self._taken == self.head and len(self):
+            self.drop(1)
+        self.sending = False
+        self._taken = None
+
+    def peek(self, count):
+        """
+        Read the oldest records without removing them
+        Records that are contiguous in the file are read in one go
+
+        Args:
+            count: Maximum number of records
+
+        Returns:
+            list: Message dicts, oldest first (see decode)
+        """
+        count = min(count, len(self))
+        messages = []
+        position = self.head
+        while count > 0:
+            slot = position % self.capacity
+            run = min(count, self.capacity - slot)
+            self._file.seek(HEADER_SIZE + slot * RECORD_SIZE)
+            data = self._file.read(run * RECORD_SIZE)
+            for offset in range(0, run * RECORD_SIZE, RECORD_SIZE):
+                messages.append(decode(struct.unpack_from(RECORD_FORMAT, data, offset)))
+            position += run
+            count -= run
+        return messages
+
+    def drop(self, count):
+        """
+        Remove the oldest records (after they were delivered)
+
+        Args:
+            count: Number of records to remove
+        """
+        count = min(count, len(self))
+        if count:
+            self.head += count
+            self._write_header()
+
+    def replay(self, send, max_records):
+        """
+        Send the oldest records, stopping at the first one that fails
+        Delivered records are removed in one header write per pass, so a
+        reset during a pass may send some of them again
+
+        Args:
+            send: Callable(message) returning False to keep the message
+                  and stop (e.g. the server is still unreachable)
+            max_records: Maximum number of records sent in this pass
+
+        Returns:
+            int: Number of records removed
+        """
+        sent = 0
+        for message in self.peek(max_records):
+            self._tried = max(self._tried, self.head + sent + 1)
+            if not send(message):
+                break
+            sent += 1
+        self.drop(sent)
+        return sent
+
+    def close(self):
+        """
+        Close the file (records stay on flash)
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # Internals
+
+    def _open_existing(self):
+        try:
+            f = open(self.path, "r+b")
+        except OSError:
+            return
+        magic, capacity, record_size, head, tail, epoch = self._read_header(f)
+        if magic != MAGIC or capacity != self.capacity or record_size != RECORD_SIZE or tail < head:
+            # Different layout (or damaged): start over
+            f.close()
+            log_message("Outbox: discarding incompatible file {}".format(self.path), "WARNING")
+            return
+        self._file = f
+        self.head = max(head, tail - capacity)
+        self.tail = tail
+        self.epoch = epoch
+        # Records from before the restart may have been sent
+        self._tried = tail
+        if len(self):
+            log_message("Outbox: {} message(s) waiting from before restart".format(len(self)))
+
+    def _read_header(self, f):
+        data = f.read(HEADER_SIZE)
+        if len(data) < HEADER_SIZE:
+            return None, 0, 0, 0, 0, 0
+        return struct.unpack(HEADER_FORMAT, data)
+
+    def _create(self):
+        # New epoch: sequence numbers start over with the file
+        self.epoch = random.getrandbits(32)
+        f = open(self.path, "wb+")
+        f.write(bytes(HEADER_SIZE))
+        empty = bytes(RECORD_SIZE * 16)
+        for _ in range(0, self.capacity, 16):
+            f.write(empty)
+        f.flush()
+        self._file = f
+        self._write_header()
+
+    def _append(self, kind, code, battery, node_id, target_id, latitude, longitude, order_id, seconds=None):
+        if self._file is None:
+            self._create()
+        self._write_record(self.tail, kind, code, battery, node_id, target_id,
+                           latitude, longitude, order_id, seconds)
+        self.tail += 1
+        if self.tail - self.head > self.capacity:
+            self.head = self.tail - self.capacity
+            self.overwritten += 1
+        self._write_header()
+        if self.on_push is not None:
+            self.on_push()
+
+    def _write_record(self, position, kind, code, battery, node_id, target_id,
+                      latitude, longitude, order_id, seconds=None):
+        record = struct.pack(
+            RECORD_FORMAT, kind, code, int(round((battery or 0) * 100)),
+            int(time.time() if seconds is None else seconds),
+            _id(node_id), _id(target_id), _fixed(latitude), _fixed(longitude),
+            _id(order_id), position & 0xFFFFFFFF
+        )
+        self._file.seek(HEADER_SIZE + (position % self.capacity) * RECORD_SIZE)
+        self._file.write(record)
+
+    def _last_kind(self):
+        # Kind of the newest record, if it may still be changed (never
+        # sent: a replaced record keeps its sequence number, so one the
+        # server may have seen would be taken for a duplicate)
+        if not len(self) or self.tail - 1 < self._tried:
+            return None
+        self._file.seek(HEADER_SIZE + ((self.tail - 1) % self.capacity) * RECORD_SIZE)
+        return self._file.read(1)[0]
+
+    def _write_header(self):
+        if self._file is None:
+            return
+        struct.pack_into(HEADER_FORMAT, self._header, 0, MAGIC, self.capacity,
+                         RECORD_SIZE, self.head, self.tail, self.epoch)
+        self._file.seek(0)
+        self._file.write(self._header)
+        self._file.flush()
+
+
+def decode(fields):
+    """
+    Turn an unpacked record into a message dict
+
+    Args:
+        fields: Tuple unpacked with RECORD_FORMAT
+
+    Returns:
+        dict: kind, time, sequence and the kind's fields
+              (status: status, batteryLevel, currentNodeId, targetNodeId,
+              latitude, longitude; phase: orderId, phase, latitude, longitude)
+    """
+    kind, code, battery, seconds, node_id, target_id, lat, lon, order_id, sequence = fields
+    message = {
+        "kind": kind,
+        "time": seconds,
+        "sequence": sequence,
+        "latitude": lat / 10000000,
+        "longitude": lon / 10000000
+    }
+    if kind == MessageKind.PHASE:
+        message["orderId"] = _from_id(order_id)
+        message["phase"] = PHASE_CODES[code] if code < len(PHASE_CODES) else "UNKNOWN"
+    else:
+        message["status"] = STATUS_CODES[code] if code < len(STATUS_CODES) else RobotState.IDLE
+        message["batteryLevel"] = battery / 100
+        message["currentNodeId"] = _from_id(node_id)
+        message["targetNodeId"] = _from_id(target_id)
+    return message
@@ -1,32 +1,164 @@
-import urequests
-import ujson
-import time
 import sys
-from machine import Pin
-import tm1637
-from time import sleep
+import time
+from array import array
 
 sys.path.append('/config')
 sys.path.append('/utils')
+sys.path.append('/hal')
+
+from hal import Pin, TM1637
 
 from config import API_CONFIG, TELEMETRY_CONFIG, DEBUG
-from helpers import log_message
+from helpers import log_message, format_timestamp, calculate_distance
+from clock import now_ms
+from api_client import is_transient
+from outbox import STATUS_CODES, NO_ID
+from telemetry_codec import TelemetryEncoder, CONTENT_TYPE
+
+class TelemetryBatch:
+    """
+    Preallocated buffer of status samples that are uploaded together
+    Samples are stored field by field in fixed arrays, so buffering
+    does not allocate; the JSON array is only built when flushing
+    """
+
+    def __init__(self, size, max_latency_ms):
+        """
+        Args:
+            size: Samples per upload
+            max_latency_ms: Time the oldest sample may wait for its upload
+        """
+        self.size = size
+        self.max_latency_ms = max_latency_ms
+        self.status = bytearray(size)
+        self.battery = array('f', [0.0] * size)
+        self.node = array('i', [0] * size)
+        self.target = array('i', [0] * size)
+        self.latitude = array('d', [0.0] * size)
+        self.longitude = array('d', [0.0] * size)
+        self.seconds = array('L', [0] * size)
+        self.count = 0
+        self.first_ms = 0
+
+    def add(self, robot):
+        """
+        Append a sample of the robot's current state
+
+        Args:
+            robot: Robot to sample
+
+        Returns:
+            bool: True if the buffer is full now
+        """
+        i = self.count
+        if i >= self.size:
+            return True
+        if i == 0:
+            self.first_ms = now_ms()
+        status = robot.status
+        self.status[i] = STATUS_CODES.index(status) if status in STATUS_CODES else 0
+        self.battery[i] = robot.battery_level
+        self.node[i] = NO_ID if robot.current_node_id is None else robot.current_node_id
+        self.target[i] = NO_ID if robot.target_node_id is None else robot.target_node_id
+        self.latitude[i] = robot.current_latitude or 0.0
+        self.longitude[i] = robot.current_longitude or 0.0
+        self.seconds[i] = int(time.time())
+        self.count = i + 1
+        return self.count >= self.size
+
+    def ms_until_due(self):
+        """
+        Get time until the oldest sample must be uploaded
+
+        Returns:
+            int: Milliseconds (0 if due now), or None if the buffer is empty
+        """
+        if not self.count:
+            return None
+        return max(0, self.max_latency_ms - (now_ms() - self.first_ms))
+
+    def samples(self):
+        """
+        Iterate over the buffered samples, oldest first
+
+        Yields:
+            tuple: (status, battery, node ID, target node ID, latitude,
+                   longitude, seconds) with None for missing node IDs
+        """
+        for i in range(self.count):
+            node = self.node[i]
+            target = self.target[i]
+            yield (STATUS_CODES[self.status[i]], self.battery[i],
+                   None if node == NO_ID else node, None if target == NO_ID else target,
+                   self.latitude[i], self.longitude[i], self.seconds[i])
+
+    def payload(self):
+        """
+        Build the batch upload body
+
+        Returns:
+            list: One status dict per sample, with its timestamp
+        """
+        return [{
+            "status": status,
+            "batteryLevel": round(battery, 2),
+            "currentNodeId": node,
+            "currentLatitude": latitude,
+            "currentLongitude": longitude,
+            "targetNodeId": target,
+            "timestamp": format_timestamp(seconds)
+        } for status, battery, node, target, latitude, longitude, seconds in self.samples()]
+
+    def clear(self):
+        self.count = 0
+
 
 class TelemetryManager:
     """
     Manages telemetry data transmission to server
     """
 
-    def __init__(self, robot, auth_manager):
+    def __init__(self, robot, auth_manager, outbox=None):
+        """
+        Args:
+            robot: Robot whose state is reported
+            auth_manager: AuthManager (its ApiClient is used for requests)
+            outbox: Optional Outbox for samples the server did not get
+        """
         self.robot = robot
+        self.outbox = outbox
         self.auth_manager = auth_manager
-        self.base_url = API_CONFIG["BASE_URL"]
+        self.api = auth_manager.api
         self.status_endpoint = API_CONFIG["ROBOT_STATUS_ENDPOINT"]
         self.me_endpoint = API_CONFIG["ROBOT_ME_ENDPOINT"]
         self.update_interval = TELEMETRY_CONFIG["UPDATE_INTERVAL"]
-        self.last_update_time = 0
+        self.batch = None
+        self.encoder = None
+        if TELEMETRY_CONFIG.get("BATCH_ENABLED"):
+            # Sample more often, upload less often
+            self.batch_endpoint = API_CONFIG["ROBOT_STATUS_BATCH_ENDPOINT"]
+            self.update_interval = TELEMETRY_CONFIG.get("BATCH_SAMPLE_INTERVAL", 2)
+            self.batch = TelemetryBatch(TELEMETRY_CONFIG.get("BATCH_SIZE", 10),
+                                        TELEMETRY_CONFIG.get("BATCH_MAX_LATENCY", 20) * 1000)
+            if TELEMETRY_CONFIG.get("BATCH_CODEC") == "binary":
+                self.binary_endpoint = API_CONFIG["ROBOT_STATUS_BINARY_ENDPOINT"]
+                self.encoder = TelemetryEncoder(self.batch.size, TELEMETRY_CONFIG.get("BATCH_DEFLATE", False))
+        self.update_interval_ms = self.update_interval * 1000
+
+        # Last state handed over for delivery (sent, batched or stored)
+        # and when; periodic updates inside the dead-bands are skipped
+        self.reported = None
+        self.reported_at = 0
+        self.deadband_position_m = TELEMETRY_CONFIG.get("DEADBAND_POSITION_M", 0)
+        self.deadband_battery = TELEMETRY_CONFIG.get("DEADBAND_BATTERY", 0)
+        self.heartbeat_ms = TELEMETRY_CONFIG.get("HEARTBEAT_INTERVAL", 60) * 1000
+        self.skipped = 0
+        # Status update still waiting for its answer (non-blocking mode)
+        self.pending = None
+        # First update is due immediately
+        self.last_update_time = -self.update_interval_ms
         try:
-            self.tm = tm1637.TM1637(clk=Pin(18), dio=Pin(19))
+            self.tm = TM1637(clk=Pin(18), dio=Pin(19))
             self.tm.brightness(7)
         except Exception as e:
             log_message("Display init failed: " + str(e), "ERROR")
@@ -35,17 +167,22 @@ class TelemetryManager:
     def send_status_update(self, force=False):
         """
         Send robot status update to server
+        Periodic updates are skipped while the state stays inside the
+        dead-bands (see has_changed). In batch mode the sample is
+        buffered and the batch is uploaded when it is full, when its
+        oldest sample is due, or when forced
 
         Args:
             force: Force sending update even if interval hasn't passed
+                   or nothing changed (and upload the batch right away)
 
         Returns:
-            bool: True if update sent successfully, False otherwise
+            bool: True if update sent, on its way or skipped, False otherwise
         """
-        current_time = time.time()
+        current_time = now_ms()
 
         # Check if it's time to send update
-        if not force and (current_time - self.last_update_time < self.update_interval):
+        if not force and (current_time - self.last_update_time < self.update_interval_ms):
             return True
 
         self.last_update_time = current_time
@@ -54,62 +191,208 @@ class TelemetryManager:
             log_message("Cannot send telemetry: Not authenticated", "WARNING")
             return False
 
-        try:
-            url = self.base_url + self.status_endpoint
-
-            # Prepare telemetry payload
-            payload = {
-                "status": self.robot.status,
-                "batteryLevel": round(self.robot.battery_level, 2),
-                "currentNodeId": self.robot.current_node_id,
-                "currentLatitude": self.robot.current_latitude,
-                "currentLongitude": self.robot.current_longitude,
-                "targetNodeId": self.robot.target_node_id
-            }
-
-            headers = {
-                'Content-Type': 'application/json'
-            }
-            headers.update(self.auth_manager.get_auth_header())
+        if not force and not self.has_changed():
+            self.skipped += 1
+            return True
 
+        if not force and self.pending is not None and not self.pending.done:
+            # The previous update is still on its way (slow server): skip
+            # this one instead of queuing requests behind it
+            self.skipped += 1
+            return True
+
+        if self.outbox is not None and len(self.outbox):
+            # Older samples are still waiting: queue behind them so the
+            # server gets them in order
+            self.store_status_update(force=True)
+            return False
+
+        if self.batch is not None:
+            if self.tm:
+                self.tm.number(int(self.robot.battery_level))
+            self._mark_reported()
+            full = self.batch.add(self.robot)
+            if force or full or self.batch.ms_until_due() == 0:
+                return self.flush_batch()
+            return True
+
+        if DEBUG:
+            log_message(
+                "Sending telemetry: Status={}, Battery={:.1f}%, "
+                "Pos=({:.6f}, {:.6f})".format(
+                    self.robot.status,
+                    self.robot.battery_level,
+                    self.robot.current_latitude or 0.0,
+                    self.robot.current_longitude or 0.0
+                ),
+                "DEBUG"
+            )
+
+        if self.tm:
+            self.tm.number(int(self.robot.battery_level))
+
+        robot = self.robot
+        payload = self._status_payload(
+            robot.status, robot.battery_level, robot.current_node_id,
+            robot.current_latitude, robot.current_longitude, robot.target_node_id
+        )
+        self._mark_reported()
+        # The latest state replaces the previous one: safe to retry
+        self.pending = self.api.submit("POST", self.status_endpoint, payload, retry=True,
+                                       on_done=lambda status, data: self._status_sent(payload, status, data))
+        return not self.pending.done or self.pending.status == 200
+
+    def _status_sent(self, payload, status, data):
+        # Answer to a status update (right away, or later in non-blocking mode)
+        if status == 200:
             if DEBUG:
-                log_message(
-                    "Sending telemetry: Status={}, Battery={:.1f}%, "
-                    "Pos=({:.6f}, {:.6f})".format(
-                        self.robot.status,
-                        self.robot.battery_level,
-                        self.robot.current_latitude or 0.0,
-                        self.robot.current_longitude or 0.0
-                    ),
-                    "DEBUG"
-                )
+                log_message("Telemetry sent successfully", "DEBUG")
+            return
+
+        log_message("Telemetry failed: Status {}".format(status), "ERROR")
+        if DEBUG:
+            log_message("Response: {}".format(data), "DEBUG")
+        if is_transient(status) and self.outbox is not None:
+            # Delivered later by the outbox
+            self.outbox.push_status_sample(
+                payload["status"], payload["batteryLevel"], payload["currentNodeId"],
+                payload["targetNodeId"], payload["currentLatitude"], payload["currentLongitude"],
+                coalesce=True)
+        else:
+            # Not stored: report again on the next update
+            self.reported = None
+
+    def store_status_update(self, force=False):
+        """
+        Record a status sample in the outbox instead of sending it
+        (while offline); it is sent later by replay_status
 
+        Args:
+            force: Store it even if nothing changed (see has_changed)
+        """
+        self.last_update_time = now_ms()
+        if self.tm:
             self.tm.number(int(self.robot.battery_level))
+        if not force and not self.has_changed():
+            self.skipped += 1
+            return
+        self._mark_reported()
+        if self.outbox is not None:
+            # Buffered samples are older: they go first
+            self._spill_batch()
+            self.outbox.push_status(self.robot)
+
+    def has_changed(self):
+        """
+        Check if the robot state left the dead-bands around the last
+        reported state, or the heartbeat interval has passed
 
-            response = urequests.post(
-                url,
-                data=ujson.dumps(payload),
-                headers=headers
-            )
+        Returns:
+            bool: True if an update should be sent
+        """
+        reported = self.reported
+        if reported is None or now_ms() - self.reported_at >= self.heartbeat_ms:
+            return True
+        robot = self.robot
+        status, battery, node_id, target_id, latitude, longitude = reported
+        if (robot.status != status or robot.current_node_id != node_id
+                or robot.target_node_id != target_id):
+            return True
+        if abs(robot.battery_level - battery) >= self.deadband_battery:
+            return True
+        if latitude is None or robot.current_latitude is None:
+            return latitude != robot.current_latitude or longitude != robot.current_longitude
+        return calculate_distance(latitude, longitude, robot.current_latitude,
+                                  robot.current_longitude) >= self.deadband_position_m
+
+    def _mark_reported(self):
+        robot = self.robot
+        self.reported = (robot.status, robot.battery_level, robot.current_node_id,
+                         robot.target_node_id, robot.current_latitude, robot.current_longitude)
+        self.reported_at = now_ms()
+
+    def flush_batch(self):
+        """
+        Upload the buffered samples as one request
 
-            if response.status_code == 200:
-                if DEBUG:
-                    log_message("Telemetry sent successfully", "DEBUG")
-                response.close()
-                return True
-            else:
-                log_message(
-                    "Telemetry failed: Status {}".format(response.status_code),
-                    "ERROR"
-                )
-                if DEBUG:
-                    log_message("Response: {}".format(response.text), "DEBUG")
-                response.close()
-                return False
+        Returns:
+            bool: True if the batch was accepted, is on its way, or was empty
+        """
+        batch = self.batch
+        if batch is None or not batch.count:
+            return True
 
-        except Exception as e:
-            log_message("Telemetry error: {}".format(str(e)), "ERROR")
-            return False
+        # The arrays are reused right away: keep the samples for the outbox
+        # in case the upload fails
+        samples = list(batch.samples()) if self.outbox is not None else None
+        count = batch.count
+        if self.encoder is not None:
+            call = self.api.submit("POST", self.binary_endpoint, body=self.encoder.encode(batch),
+                                   content_type=CONTENT_TYPE,
+                                   on_done=lambda status, data: self._batch_sent(count, samples, status, data))
+        else:
+            call = self.api.submit("POST", self.batch_endpoint, batch.payload(),
+                                   on_done=lambda status, data: self._batch_sent(count, samples, status, data))
+        batch.clear()
+        return not call.done or call.status == 200
+
+    def _batch_sent(self, count, samples, status, data):
+        if status == 200:
+            if DEBUG:
+                log_message("Telemetry batch sent: {} sample(s)".format(count), "DEBUG")
+            return
+
+        log_message("Telemetry batch failed: Status {}".format(status), "ERROR")
+        if DEBUG:
+            log_message("Response: {}".format(data), "DEBUG")
+        if is_transient(status) and samples:
+            for sample in samples:
+                self.outbox.push_status_sample(*sample)
+
+    def batch_due(self):
+        """
+        Check if buffered samples have waited as long as allowed
+
+        Returns:
+            bool: True if the batch should be uploaded now
+        """
+        return self.batch is not None and self.batch.ms_until_due() == 0
+
+    def _spill_batch(self):
+        # Move buffered samples to the outbox (or drop them without one)
+        batch = self.batch
+        if batch is None or not batch.count:
+            return
+        if self.outbox is not None:
+            for sample in batch.samples():
+                self.outbox.push_status_sample(*sample)
+        batch.clear()
+
+    def replay_status(self, message, on_done=None):
+        """
+        Send a status sample stored in the outbox
+
+        Args:
+            message: Outbox status message
+            on_done: Optional callable(status, data) run with the answer
+
+        Returns:
+            ApiCall: Request; status is None if the server could not be reached
+        """
+        return self.api.submit("POST", self.status_endpoint, self._status_payload(
+            message["status"], message["batteryLevel"], message["currentNodeId"],
+            message["latitude"], message["longitude"], message["targetNodeId"]
+        ), on_done=on_done, retry=False)
+
+    def _status_payload(self, status, battery_level, node_id, latitude, longitude, target_node_id):
+        return {
+            "status": status,
+            "batteryLevel": round(battery_level, 2),
+            "currentNodeId": node_id,
+            "currentLatitude": latitude,
+            "currentLongitude": longitude,
+            "targetNodeId": target_node_id
+        }
 
     def fetch_robot_info(self):
         """
@@ -121,34 +404,28 @@ class TelemetryManager:
         if not self.auth_manager.is_authenticated():
             log_message("Cannot fetch robot info: Not authenticated", "WARNING")
             return None
+        return self._robot_info(*self.api.get(self.me_endpoint))
 
-        try:
-            url = self.base_url + self.me_endpoint
-
-            headers = self.auth_manager.get_auth_header()
-
-            response = urequests.get(url, headers=headers)
-
-            if response.status_code == 200:
-                data = ujson.loads(response.text)
-                log_message("Robot info fetched successfully")
+    async def fetch_robot_info_async(self):
+        """
+        Coroutine version of fetch_robot_info on the async client
+        """
+        if not self.auth_manager.is_authenticated():
+            log_message("Cannot fetch robot info: Not authenticated", "WARNING")
+            return None
+        return self._robot_info(*(await self.api.request_async("GET", self.me_endpoint)))
 
-                # Update robot with server data
-                self.robot.set_robot_info(data)
+    def _robot_info(self, status, data):
+        # Apply a GET /api/Robot/me answer to the robot
+        if status == 200 and isinstance(data, dict):
+            log_message("Robot info fetched successfully")
 
-                response.close()
-                return data
-            else:
-                log_message(
-                    "Failed to fetch robot info: Status {}".format(response.status_code),
-                    "ERROR"
-                )
-                response.close()
-                return None
+            # Update robot with server data
+            self.robot.set_robot_info(data)
+            return data
 
-        except Exception as e:
-            log_message("Error fetching robot info: {}".format(str(e)), "ERROR")
-            return None
+        log_message("Failed to fetch robot info: Status {}".format(status), "ERROR")
+        return None
 
     def should_send_update(self):
         """
@@ -157,57 +434,27 @@ class TelemetryManager:
         Returns:
             bool: True if should send update, False otherwise
         """
-        current_time = time.time()
-        return (current_time - self.last_update_time) >= self.update_interval
+        return (now_ms() - self.last_update_time) >= self.update_interval_ms
 
-    def get_last_update_time(self):
+    def ms_until_next_update(self):
         """
-        Get timestamp of last telemetry update
+        Get time remaining until the next periodic update is due
 
         Returns:
-            float: Timestamp of last update
+            int: Milliseconds until next update (0 if already due)
         """
-        return self.last_update_time
+        delay = max(0, self.update_interval_ms - (now_ms() - self.last_update_time))
+        if self.batch is not None:
+            due = self.batch.ms_until_due()
+            if due is not None and due < delay:
+                return due
+        return delay
 
-    def fetch_node_info(self, node_id):
+    def get_last_update_time(self):
         """
-        Fetch node information from server
-
-        Args:
-            node_id: Node ID to fetch
+        Get time of last telemetry update
 
         Returns:
-            dict: Node information with coordinates or None if failed
+            int: clock.now_ms() value of last update
         """
-        if not self.auth_manager.is_authenticated():
-            log_message("Cannot fetch node info: Not authenticated", "WARNING")
-            return None
-
-        try:
-            url = "{}/api/Node/{}".format(self.base_url, node_id)
-
-            headers = self.auth_manager.get_auth_header()
-
-            response = urequests.get(url, headers=headers)
-
-            if response.status_code == 200:
-                data = ujson.loads(response.text)
-                log_message("Node {} info fetched: ({:.6f}, {:.6f})".format(
-                    node_id,
-                    data.get('latitude', 0.0),
-                    data.get('longitude', 0.0)
-                ))
-
-                response.close()
-                return data
-            else:
-                log_message(
-                    "Failed to fetch node info: Status {}".format(response.status_code),
-                    "ERROR"
-                )
-                response.close()
-                return None
-
-        except Exception as e:
-            log_message("Error fetching node info: {}".format(str(e)), "ERROR")
-            return None
+        return self.last_update_time
@@ -0,0 +1,237 @@
+"""
+Telemetry Codec
+Compact binary format for telemetry and track batches, as an
+alternative to a JSON array.
+
+Layout (little-endian):
+    header  magic "TB", version, flags, sample count (uint16),
+            first timestamp (uint32 s), first latitude and longitude
+            (int32 microdegrees)
+    samples status code (uint8), battery (uint16 centi-percent), then
+            zigzag varints: timestamp delta-of-delta, latitude delta,
+            longitude delta, current node ID, target node ID (-1: none)
+
+With FLAG_DEFLATE everything after the header is zlib-compressed.
+Samples at a fixed cadence cost one byte for their timestamp, and
+short moves one or two bytes per coordinate, so a sample is usually
+10-14 bytes instead of about 150 bytes of JSON.
+
+Packing writes into one preallocated bytearray per encoder.
+decode() is the matching decoder (used by the fake API and tests)
+"""
+
+import sys
+import struct
+
+sys.path.append('/config')
+sys.path.append('/modules')
+
+try:
+    import deflate
+except ImportError:
+    deflate = None
+
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+from outbox import STATUS_CODES, NO_ID
+
+MAGIC = b"TB"
+VERSION = 1
+FLAG_DEFLATE = 0x01
+
+HEADER_FORMAT = "<2sBBHIii"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Status byte + battery + five varints of at most 5 bytes each
+MAX_SAMPLE_SIZE = 3 + 5 * 5
+
+CONTENT_TYPE = "application/octet-stream"
+
+# MicroPython's struct raises ValueError
+_STRUCT_ERROR = getattr(struct, "error", ValueError)
+
+
+def _zigzag(value):
+    # Signed -> unsigned so small negative numbers stay small
+    return value << 1 if value >= 0 else ((-value) << 1) - 1
+
+
+def _unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def _micro(degrees):
+    return int(round((degrees or 0.0) * 1000000))
+
+
+def can_deflate():
+    """
+    Check if compression is available (deflate on MicroPython 1.21+,
+    zlib on CPython)
+    """
+    return (deflate is not None and hasattr(deflate, "DeflateIO")) or \
+        (zlib is not None and hasattr(zlib, "compress"))
+
+
+def _compress(data):
+    if zlib is not None and hasattr(zlib, "compress"):
+        return zlib.compress(data)
+    import io
+    stream = io.BytesIO()
+    with deflate.DeflateIO(stream, deflate.ZLIB) as writer:
+        writer.write(data)
+    return stream.getvalue()
+
+
+def _decompress(data):
+    if zlib is not None and hasattr(zlib, "decompress"):
+        return zlib.decompress(data)
+    import io
+    return deflate.DeflateIO(io.BytesIO(data), deflate.ZLIB).read()
+
+
+class TelemetryEncoder:
+    """
+    Encodes a TelemetryBatch into the binary format
+    """
+
+    def __init__(self, max_samples, compress=False):
+        """
+        Args:
+            max_samples: Largest batch that will be encoded
+            compress: Deflate the samples (ignored if not available)
+        """
+        self.compress = compress and can_deflate()
+        self.buffer = bytearray(HEADER_SIZE + max_samples * MAX_SAMPLE_SIZE)
+
+    def encode(self, batch):
+        """
+        Encode the samples of a batch
+
+        Args:
+            batch: TelemetryBatch (fixed arrays, see telemetry.py)
+
+        Returns:
+            bytes: Encoded batch
+        """
+        count = batch.count
+        buf = self.buffer
+        if HEADER_SIZE + count * MAX_SAMPLE_SIZE > len(buf):
+            raise ValueError("Batch larger than the encoder buffer")
+
+        first_lat = _micro(batch.latitude[0]) if count else 0
+        first_lon = _micro(batch.longitude[0]) if count else 0
+        first_time = batch.seconds[0] if count else 0
+        struct.pack_into(HEADER_FORMAT, buf, 0, MAGIC, VERSION,
+                         FLAG_DEFLATE if self.compress else 0, count,
+                         first_time, first_lat, first_lon)
+
+        pos = HEADER_SIZE
+        prev_time = first_time
+        prev_delta = 0
+        prev_lat = first_lat
+        prev_lon = first_lon
+        for i in range(count):
+            battery = int(round(batch.battery[i] * 100))
+            struct.pack_into("<BH", buf, pos, batch.status[i], min(max(battery, 0), 0xFFFF))
+            pos += 3
+
+            delta = batch.seconds[i] - prev_time
+            pos = self._varint(buf, pos, _zigzag(delta - prev_delta))
+            prev_time = batch.seconds[i]
+            prev_delta = delta
+
+            lat = _micro(batch.latitude[i])
+            lon = _micro(batch.longitude[i])
+            pos = self._varint(buf, pos, _zigzag(lat - prev_lat))
+            pos = self._varint(buf, pos, _zigzag(lon - prev_lon))
+            prev_lat = lat
+            prev_lon = lon
+
+            pos = self._varint(buf, pos, _zigzag(batch.node[i]))
+            pos = self._varint(buf, pos, _zigzag(batch.target[i]))
+
+        view = memoryview(buf)
+        if self.compress:
+            return bytes(view[:HEADER_SIZE]) + _compress(view[HEADER_SIZE:pos])
+        return bytes(view[:pos])
+
+    def _varint(self, buf, pos, value):
+        while value >= 0x80:
+            buf[pos] = (value & 0x7F) | 0x80
+            value >>= 7
+            pos += 1
+        buf[pos] = value
+        return pos + 1
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def decode(data):
+    """
+    Decode a binary batch
+
+    Args:
+        data: Encoded batch (bytes)
+
+    Returns:
+        list: Sample dicts with status, batteryLevel, currentNodeId,
+              currentLatitude, currentLongitude, targetNodeId and time
+
+    Raises:
+        ValueError: Not a valid batch
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Batch too short")
+    magic, version, flags, count, prev_time, prev_lat, prev_lon = \
+        struct.unpack_from(HEADER_FORMAT, data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a telemetry batch")
+
+    body = data[HEADER_SIZE:]
+    if flags & FLAG_DEFLATE:
+        body = _decompress(body)
+
+    samples = []
+    pos = 0
+    prev_delta = 0
+    try:
+        for _ in range(count):
+            code, battery = struct.unpack_from("<BH", body, pos)
+            pos += 3
+            value, pos = _read_varint(body, pos)
+            prev_delta += _unzigzag(value)
+            prev_time += prev_delta
+            value, pos = _read_varint(body, pos)
+            prev_lat += _unzigzag(value)
+            value, pos = _read_varint(body, pos)
+            prev_lon += _unzigzag(value)
+            node, pos = _read_varint(body, pos)
+            target, pos = _read_varint(body, pos)
+            node = _unzigzag(node)
+            target = _unzigzag(target)
+            samples.append({
+                "status": STATUS_CODES[code] if code < len(STATUS_CODES) else STATUS_CODES[0],
+                "batteryLevel": battery / 100,
+                "currentNodeId": None if node == NO_ID else node,
+                "currentLatitude": prev_lat / 1000000,
+                "currentLongitude": prev_lon / 1000000,
+                "targetNodeId": None if target == NO_ID else target,
+                "time": prev_time
+            })
+    except (IndexError, _STRUCT_ERROR):
+        raise ValueError("Truncated telemetry batch")
+    return samples
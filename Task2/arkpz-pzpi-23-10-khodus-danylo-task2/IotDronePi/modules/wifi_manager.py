@@ -1,18 +1,51 @@
-import network
-import time
+import os
 import sys
 import gc
-import machine
+
+try:
+    import ubinascii as binascii
+except ImportError:
+    import binascii
 
 sys.path.append('/config')
+sys.path.append('/core')
 sys.path.append('/utils')
+sys.path.append('/hal')
+
+from hal import network, ujson, flash_path
+
+from config import WIFI_CONFIG
+from helpers import log_message, backoff_ms
+from clock import now_ms, sleep_ms
+from runtime import sleep_ms as async_sleep_ms
+
+# Driver states that end a connect attempt
+_FAILED_STATUS = tuple(
+    getattr(network, name) for name in ("STAT_NO_AP_FOUND", "STAT_WRONG_PASSWORD", "STAT_CONNECT_FAIL")
+    if hasattr(network, name)
+)
+
+
+class WiFiState:
+    """
+    Enum-like class for connection states
+    """
+    DOWN = "down"              # not connected; next attempt at retry_at_ms
+    CONNECTING = "connecting"  # attempt running in the driver
+    CONNECTED = "connected"
 
-from config import WIFI_CONFIG, DEBUG
-from helpers import log_message
 
 class WiFiManager:
     """
     Manages WiFi connection for ESP32 with robust error handling
+
+    Connecting is a state machine stepped by poll() from the main loop,
+    so an attempt never blocks it:
+    - the access point of the last connection (BSSID and channel, kept
+      on flash) is joined directly, without a scan of every channel
+    - an optional static IP (WIFI_CONFIG STATIC_IP) skips DHCP
+    - failed attempts are retried with exponential backoff
+    - an interface that is up is never reset
     """
 
     def __init__(self):
@@ -20,17 +53,33 @@ class WiFiManager:
         gc.collect()
 
         self.wlan = None
-        self.ssid = "Wokwi-GUEST"
-        self.password = ""
+        self.ssid = WIFI_CONFIG["SSID"]
+        self.password = WIFI_CONFIG.get("PASSWORD", "")
+        self.static_ip = WIFI_CONFIG.get("STATIC_IP")
+        self.cache_path = flash_path(WIFI_CONFIG.get("CACHE_PATH", "/wifi.json"))
         self.connected = False
         self.initialized = False
 
+        self.state = WiFiState.DOWN
+        self.failures = 0            # failed attempts in a row
+        self.retry_at_ms = 0
+        self.reconnects = 0
+        self.last_connect_ms = None  # duration of the last successful attempt
+        self.access_point = None     # (bssid, channel) of the last connection
+        self.scan_needed = False     # access point unknown; see scan_access_point
+
+        self._fast = False           # attempt uses access_point
+        self._attempt_start = 0
+        self._attempt_deadline = 0
+
+        self._load_cache()
+
         # DO NOT initialize WLAN here - wait until connect() is called
         # This prevents premature WiFi initialization before system is ready
         log_message("WiFiManager created (WLAN initialization deferred)", "INFO")
 
     def _init_wlan(self):
-        """Internal method to initialize WLAN interface with safe reset logic"""
+        """Internal method to initialize WLAN interface (kept as is if already up)"""
         log_message("Initializing WiFi Interface...", "INFO")
 
         try:
@@ -38,25 +87,18 @@ class WiFiManager:
             # DO NOT create multiple instances, it causes "duplicate key" error
             self.wlan = network.WLAN(network.STA_IF)
 
-            # If it was already active, deactivate it first
-            if self.wlan.active():
-                log_message("Deactivating existing WiFi interface...", "INFO")
-                try:
-                    self.wlan.disconnect()
-                except:
-                    pass
-                self.wlan.active(False)
-                time.sleep(1)
-
-            # Activate the interface
-            self.wlan.active(True)
-            time.sleep(1.0)
-
-            # Verify it activated successfully
+            # An active interface (e.g. still connected after a soft
+            # reset) is used as it is
             if not self.wlan.active():
-                log_message("WLAN failed to activate, retrying...", "WARNING")
                 self.wlan.active(True)
-                time.sleep(1.0)
+                if not self.wlan.active():
+                    log_message("WLAN failed to activate, retrying...", "WARNING")
+                    sleep_ms(100)
+                    self.wlan.active(True)
+
+            if self.static_ip and not self.wlan.isconnected():
+                # Fixed address: no DHCP round trip after joining
+                self.wlan.ifconfig(tuple(self.static_ip))
 
             log_message("WiFi interface initialized successfully", "INFO")
             return True
@@ -75,73 +117,78 @@ class WiFiManager:
     def wifi_ssid(self):
         return self.ssid
 
-    def connect(self, max_retries=20, retry_delay=1):
+    def connect(self, timeout_ms=None):
         """
-        Connect to WiFi network
-        """
-        # Initialize WLAN on first connect attempt
-        if not self.initialized:
-            log_message("First WiFi connection - initializing WLAN...", "INFO")
-            gc.collect()  # Free memory before WiFi init
-            if not self._init_wlan():
-                log_message("Failed to initialize WLAN interface", "ERROR")
-                return False
-            self.initialized = True
+        Connect to WiFi network, waiting for the result (used at boot)
 
-        # Ensure wlan is initialized
-        if self.wlan is None:
-            log_message("WLAN interface missing after init - critical error", "ERROR")
-            return False
+        Args:
+            timeout_ms: Time to keep trying (default: WIFI_CONFIG BOOT_TIMEOUT_MS)
 
-        if self.is_connected():
-            log_message("Already connected to WiFi")
-            return True
-
-        log_message("Connecting to WiFi: {}".format(self.ssid))
+        Returns:
+            bool: True if connected
+        """
+        result = self._begin_connect()
+        if result is not None:
+            return result
+        deadline = now_ms() + (timeout_ms or WIFI_CONFIG.get("BOOT_TIMEOUT_MS", 30000))
+        while now_ms() < deadline:
+            delay = self.poll()
+            if self.state == WiFiState.CONNECTED:
+                return True
+            sleep_ms(min(delay, max(1, deadline - now_ms())))
+        return self._connect_failed()
 
-        try:
-            # Ensure interface is active before connecting
-            if not self.wlan.active():
-                log_message("Activating WLAN interface...", "INFO")
-                self.wlan.active(True)
-                time.sleep(0.5)
+    async def connect_async(self, timeout_ms=None):
+        """
+        Coroutine version of connect: other tasks run while it waits
+        """
+        result = self._begin_connect()
+        if result is not None:
+            return result
+        deadline = now_ms() + (timeout_ms or WIFI_CONFIG.get("BOOT_TIMEOUT_MS", 30000))
+        while now_ms() < deadline:
+            delay = self.poll()
+            if self.state == WiFiState.CONNECTED:
+                return True
+            await async_sleep_ms(min(delay, max(1, deadline - now_ms())))
+        return self._connect_failed()
 
-            # Disconnect if already in connecting state
-            try:
-                if self.wlan.status() != network.STAT_IDLE:
-                    self.wlan.disconnect()
-                    time.sleep(0.5)
-            except:
-                pass
+    def poll(self):
+        """
+        Step the connection state machine (never blocks)
 
-            self.wlan.connect(self.ssid, self.password)
-            log_message("WiFi connection initiated...", "INFO")
-        except Exception as e:
-            log_message("WiFi connect trigger error: {}".format(str(e)), "ERROR")
-            return False
+        Returns:
+            int: Milliseconds until it should be stepped again, or None
+                 while connected (the caller's own period)
+        """
+        if not self._ensure_wlan():
+            return WIFI_CONFIG.get("RETRY_MAX_MS", 30000)
 
-        retry_count = 0
-        while not self.wlan.isconnected() and retry_count < max_retries:
-            if DEBUG:
-                print(".", end="")
-            time.sleep(retry_delay)
-            retry_count += 1
-
-        if DEBUG:
-            print("")
-
-        if self.wlan.isconnected():
-            self.connected = True
-            try:
-                ip_address = self.wlan.ifconfig()[0]
-                log_message("WiFi connected! IP: {}".format(ip_address))
-            except:
-                log_message("WiFi connected but failed to get IP")
-            return True
-        else:
+        now = now_ms()
+        if self.state == WiFiState.CONNECTED:
+            if self.is_connected():
+                return None
+            log_message("WiFi connection lost", "WARNING")
             self.connected = False
-            log_message("Failed to connect to WiFi after {} retries".format(retry_count), "ERROR")
-            return False
+            self.state = WiFiState.DOWN
+            self.failures = 0
+            self.retry_at_ms = now  # brief dropout: rejoin right away
+
+        if self.state == WiFiState.DOWN:
+            if now < self.retry_at_ms:
+                return self.retry_at_ms - now
+            if not self._start_attempt():
+                return self._retry_later()
+
+        # CONNECTING
+        if self.is_connected():
+            if self.last_connect_ms is not None:
+                self.reconnects += 1
+            self._set_connected()
+            return None
+        if self._status() in _FAILED_STATUS or now >= self._attempt_deadline:
+            return self._retry_later()
+        return WIFI_CONFIG.get("POLL_MS", 100)
 
     def disconnect(self):
         try:
@@ -150,6 +197,7 @@ class WiFiManager:
                     self.wlan.disconnect()
                 self.wlan.active(False)
                 self.connected = False
+                self.state = WiFiState.DOWN
                 log_message("Disconnected from WiFi")
         except Exception as e:
             log_message(f"Error disconnecting: {e}", "ERROR")
@@ -161,8 +209,208 @@ class WiFiManager:
             return False
         except:
             return False
-            
+
+    def scan_access_point(self):
+        """
+        Find the access point of the current connection with a scan, so
+        later reconnects skip theirs. Blocks for the scan (seconds on the
+        ESP32): run it from a low-priority job while the robot is idle
+
+        Returns:
+            bool: True if the access point is known now
+        """
+        if self.scan_needed and self.is_connected():
+            self._scan()
+            self.scan_needed = False
+        return self.access_point is not None
+
     def reconnect_if_needed(self):
-        if not self.is_connected():
-            return self.connect()
-        return True
\ No newline at end of file
+        """
+        Step the state machine (see poll)
+
+        Returns:
+            bool: True if connected
+        """
+        self.poll()
+        return self.state == WiFiState.CONNECTED
+
+    # Internals
+
+    def _begin_connect(self):
+        # Result of connect if it is known before waiting, else None
+        if not self._ensure_wlan():
+            return False
+
+        if self.is_connected():
+            log_message("Already connected to WiFi")
+            self._attempt_start = now_ms()
+            self._set_connected()
+            return True
+
+        if self.access_point is None:
+            # Blocking anyway: find the access point now, so this attempt
+            # and every later one can skip the scan
+            self._scan()
+        return None
+
+    def _connect_failed(self):
+        log_message("Failed to connect to WiFi after {} attempt(s)".format(self.failures), "ERROR")
+        return False
+
+    def _ensure_wlan(self):
+        # Initialize WLAN on first use
+        if not self.initialized:
+            log_message("First WiFi connection - initializing WLAN...", "INFO")
+            gc.collect()  # Free memory before WiFi init
+            if not self._init_wlan():
+                log_message("Failed to initialize WLAN interface", "ERROR")
+                return False
+            self.initialized = True
+        if self.wlan is None:
+            log_message("WLAN interface missing after init - critical error", "ERROR")
+            return False
+        return True
+
+    def _status(self):
+        try:
+            return self.wlan.status()
+        except Exception:
+            return None
+
+    def _start_attempt(self):
+        now = now_ms()
+        status = self._status()
+        if status == getattr(network, "STAT_CONNECTING", None) and not self.failures:
+            # The driver is already rejoining on its own: let it finish
+            self._fast = False
+            self._attempt_start = now
+            self._attempt_deadline = now + WIFI_CONFIG.get("CONNECT_TIMEOUT_MS", 10000)
+            self.state = WiFiState.CONNECTING
+            return True
+
+        # The first attempt after a connection goes straight to the
+        # known access point; if that fails, the next one scans
+        self._fast = self.access_point is not None and not self.failures
+        try:
+            if status not in (None, getattr(network, "STAT_IDLE", None)):
+                self.wlan.disconnect()
+            if self._fast:
+                bssid, channel = self.access_point
+                try:
+                    self.wlan.config(channel=channel)
+                except (OSError, ValueError, TypeError):
+                    pass  # the driver finds the channel itself
+                log_message("Connecting to WiFi: {} (cached access point)".format(self.ssid))
+                self.wlan.connect(self.ssid, self.password, bssid=bssid)
+                timeout = WIFI_CONFIG.get("FAST_CONNECT_TIMEOUT_MS", 3000)
+            else:
+                log_message("Connecting to WiFi: {}".format(self.ssid))
+                self.wlan.connect(self.ssid, self.password)
+                timeout = WIFI_CONFIG.get("CONNECT_TIMEOUT_MS", 10000)
+        except Exception as e:
+            log_message("WiFi connect trigger error: {}".format(str(e)), "ERROR")
+            return False
+
+        self._attempt_start = now
+        self._attempt_deadline = now + timeout
+        self.state = WiFiState.CONNECTING
+        return True
+
+    def _retry_later(self):
+        if self._fast:
+            # Access point gone or moved: forget it and let the driver
+            # find one (the next connection saves the new one)
+            log_message("Cached access point not reached, connecting without it", "WARNING")
+            self.access_point = None
+            self._clear_cache()
+            delay = 0
+        else:
+            delay = backoff_ms(self.failures, WIFI_CONFIG.get("RETRY_BASE_MS", 500),
+                               WIFI_CONFIG.get("RETRY_MAX_MS", 30000))
+            log_message("WiFi attempt failed, retrying in {} ms".format(delay), "WARNING")
+        self.failures += 1
+        try:
+            # Stop the driver retrying on its own during the backoff
+            self.wlan.disconnect()
+        except Exception:
+            pass
+        self.state = WiFiState.DOWN
+        self.retry_at_ms = now_ms() + delay
+        return max(1, delay)
+
+    def _set_connected(self):
+        self.state = WiFiState.CONNECTED
+        self.connected = True
+        self.failures = 0
+        self.last_connect_ms = now_ms() - self._attempt_start
+        try:
+            ip_address = self.wlan.ifconfig()[0]
+            log_message("WiFi connected in {} ms! IP: {}".format(self.last_connect_ms, ip_address))
+        except:
+            log_message("WiFi connected but failed to get IP")
+        if self.access_point is None:
+            # Joined without a known access point (the cached one was
+            # lost): ask the driver; if it cannot tell, a scan is left to
+            # scan_access_point, since a scan blocks for seconds
+            self.scan_needed = not self._read_access_point()
+
+    def _read_access_point(self):
+        # BSSID and channel from the driver (ports that report them)
+        try:
+            bssid = self.wlan.config("bssid")
+            channel = self.wlan.config("channel")
+        except (OSError, ValueError, TypeError, AttributeError):
+            return False
+        if not bssid or not channel:
+            return False
+        self.access_point = (bytes(bssid), channel)
+        self._save_cache()
+        return True
+
+    def _scan(self):
+        # Strongest access point with our SSID
+        try:
+            found = self.wlan.scan()
+        except Exception as e:
+            log_message("WiFi scan failed: {}".format(e), "WARNING")
+            return
+        best = None
+        ssid = self.ssid.encode()
+        for entry in found:
+            if entry[0] == ssid and (best is None or entry[3] > best[3]):
+                best = entry
+        if best is None:
+            log_message("WiFi scan: {} not found".format(self.ssid), "WARNING")
+            return
+        self.access_point = (bytes(best[1]), best[2])
+        self._save_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = ujson.loads(f.read())
+            if cache.get("ssid") == self.ssid:
+                self.access_point = (binascii.unhexlify(cache["bssid"]), cache["channel"])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self.access_point = None
+
+    def _save_cache(self):
+        # Written to a temporary file first, so a reset mid-write keeps
+        # the previous cache
+        temp_path = self.cache_path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                f.write(ujson.dumps({
+                    "ssid": self.ssid,
+                    "bssid": binascii.hexlify(self.access_point[0]).decode(),
+                    "channel": self.access_point[1]
+                }))
+            os.rename(temp_path, self.cache_path)
+        except OSError as e:
+            log_message("WiFi cache not written: {}".format(e), "WARNING")
+
+    def _clear_cache(self):
+        try:
+            os.remove(self.cache_path)
+        except OSError:
+            pass
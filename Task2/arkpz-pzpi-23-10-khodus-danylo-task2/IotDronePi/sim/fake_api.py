@@ -0,0 +1,493 @@
+"""
+Fake RobDelivery API
+In-process stand-in for the robot endpoints of RobDeliveryAPI, plugged
+into the host urequests backend as its transport (no sockets involved),
+or served over HTTP (see serve) for load tests of the network path
+"""
+
+import sys
+import json
+import zlib
+import threading
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.append('/utils')
+sys.path.append('/modules')
+
+from helpers import calculate_distance
+from clock import now_ms
+import telemetry_codec
+
+
+class NodeType:
+    """
+    Enum-like class for node types (matches the server's NodeType)
+    """
+    USER_NODE = 0
+    CHARGING_STATION = 1
+    DEPOT = 2
+
+    NAMES = ("UserNode", "ChargingStation", "Depot")
+
+
+class OrderStatus:
+    """
+    Enum-like class for order statuses (matches the server's OrderStatus)
+    """
+    PENDING = "Pending"
+    PROCESSING = "Processing"
+    EN_ROUTE = "EnRoute"
+    DELIVERED = "Delivered"
+    CANCELLED = "Cancelled"
+
+
+class FakeApi:
+    """
+    Minimal RobDeliveryAPI for simulations
+    Implements robot register/login, status, me, my-orders, order accept,
+    order phase and node lookup with the same JSON shapes as the server,
+    plus batch status endpoints (POST /api/Robot/status/batch with a
+    JSON array, /api/Robot/status/binary with a telemetry_codec batch)
+    that stand in for the server's until it has them.
+    my-orders answers with an ETag and honours If-None-Match (304); when
+    served, "?wait=N" holds an unchanged poll until the orders change
+
+    Use as a transport: host_urequests.transport = FakeApi()
+    """
+
+    def __init__(self, energy_per_meter=36, battery_capacity=360000):
+        """
+        Args:
+            energy_per_meter: Joules per meter used for order estimates
+            battery_capacity: Battery capacity in joules used for order estimates
+        """
+        self.energy_per_meter = energy_per_meter
+        self.battery_capacity = battery_capacity
+
+        self.nodes = {}
+        self.robots = {}
+        self.robot_ids = {}  # serial number -> robot ID
+        self.tokens = {}     # token -> robot ID
+        self.orders = {}
+        self.pending = []       # unassigned order IDs, oldest first
+        self.robot_orders = {}  # robot ID -> list of assigned order IDs
+
+        self._next_robot_id = 1
+        self._next_order_id = 1
+
+        # (now_ms, robot ID, order ID, phase) for every accepted phase update
+        self.phase_log = []
+        # (robot ID, Idempotency-Key) -> answer of an applied phase update
+        self.applied_keys = {}
+        # Phase updates sent again and answered without applying them
+        self.duplicate_phases = 0
+        # Status samples received (single updates and batch entries)
+        self.status_samples = 0
+        self.request_count = 0
+        self._lock = threading.Lock()
+
+        # Bumped on every order change; long polls wait on it (see serve)
+        self.order_version = 0
+        self._order_changed = threading.Condition()
+
+        self._routes = (
+            ("POST", ("api", "Auth", "robot", "register"), self._register),
+            ("POST", ("api", "Auth", "robot", "login"), self._login),
+            ("POST", ("api", "Robot", "status"), self._status),
+            ("POST", ("api", "Robot", "status", "batch"), self._status_batch),
+            ("POST", ("api", "Robot", "status", "binary"), self._status_binary),
+            ("GET", ("api", "Robot", "me"), self._me),
+            ("GET", ("api", "Robot", "my-orders"), self._my_orders),
+            ("POST", ("api", "Robot", "order", None, "accept"), self._accept),
+            ("POST", ("api", "Robot", "order", None, "phase"), self._phase),
+            ("GET", ("api", "Node", None), self._node),
+            ("GET", ("api", "Node"), self._node_list),
+        )
+
+    # World setup
+
+    def add_node(self, node_id, name, latitude, longitude, node_type=NodeType.USER_NODE):
+        """
+        Add a map node
+
+        Returns:
+            dict: Node record
+        """
+        node = {
+            "id": node_id,
+            "name": name,
+            "latitude": latitude,
+            "longitude": longitude,
+            # The server serializes enums as names (JsonStringEnumConverter)
+            "type": NodeType.NAMES[node_type],
+            "typeName": NodeType.NAMES[node_type]
+        }
+        self.nodes[node_id] = node
+        return node
+
+    def add_order(self, pickup_node_id, dropoff_node_id, robot_id=None, name="Parcel", weight=1.0):
+        """
+        Create a pending order
+        Orders without a robot go to the next robot without work that
+        polls my-orders (stand-in for the server's dispatcher)
+
+        Returns:
+            int: Order ID
+        """
+        order_id = self._next_order_id
+        self._next_order_id += 1
+        self.orders[order_id] = {
+            "id": order_id,
+            "name": name,
+            "weight": weight,
+            "pickupNodeId": pickup_node_id,
+            "dropoffNodeId": dropoff_node_id,
+            "robotId": robot_id,
+            "status": OrderStatus.PENDING,
+            "createdAt": now_ms()
+        }
+        if robot_id is None:
+            self.pending.append(order_id)
+        else:
+            self.robot_orders.setdefault(robot_id, []).append(order_id)
+        self._orders_changed()
+        return order_id
+
+    def wait_for_order_change(self, version, timeout_s):
+        """
+        Block until the orders change after version, or timeout_s passes
+
+        Returns:
+            bool: True if they changed
+        """
+        if timeout_s <= 0:
+            return False
+        with self._order_changed:
+            return self._order_changed.wait_for(lambda: self.order_version != version, timeout_s)
+
+    def _orders_changed(self):
+        with self._order_changed:
+            self.order_version += 1
+            self._order_changed.notify_all()
+
+    # Transport entry point
+
+    def __call__(self, method, url, body, headers):
+        """
+        Handle one request (host_urequests transport signature)
+
+        Returns:
+            tuple: (status_code, body_bytes, response_headers)
+        """
+        parts = [p for p in urlsplit(url).path.split("/") if p]
+
+        for route_method, pattern, handler in self._routes:
+            if route_method != method or len(pattern) != len(parts):
+                continue
+            args = []
+            for expected, actual in zip(pattern, parts):
+                if expected is None:
+                    args.append(actual)
+                elif expected != actual:
+                    break
+            else:
+                if (headers or {}).get("Content-Type") == telemetry_codec.CONTENT_TYPE:
+                    payload = bytes(body or b"")
+                else:
+                    payload = json.loads(body) if body else {}
+                # Robots of a fleet simulation may call in from several threads
+                with self._lock:
+                    self.request_count += 1
+                    answer = handler(headers or {}, payload, *args)
+                status, result = answer[0], answer[1]
+                content = b"" if result is None else json.dumps(result).encode("utf-8")
+                return status, content, answer[2] if len(answer) > 2 else {}
+
+        with self._lock:
+            self.request_count += 1
+        return 404, json.dumps({"error": "Not found"}).encode("utf-8"), {}
+
+    # Helpers
+
+    def _robot_for(self, headers):
+        auth = headers.get("Authorization", "")
+        if not auth.startswith("Bearer "):
+            return None
+        robot_id = self.tokens.get(auth[7:])
+        return self.robots.get(robot_id)
+
+    def _issue_token(self, robot):
+        token = "sim-token-{}".format(robot["id"])
+        self.tokens[token] = robot["id"]
+        return {"token": token, "robotId": robot["id"]}
+
+    def _order_assignment(self, order):
+        pickup = self.nodes[order["pickupNodeId"]]
+        dropoff = self.nodes[order["dropoffNodeId"]]
+        distance = calculate_distance(
+            pickup["latitude"], pickup["longitude"],
+            dropoff["latitude"], dropoff["longitude"]
+        )
+        return {
+            "orderId": order["id"],
+            "orderName": order["name"],
+            "description": "",
+            "weight": order["weight"],
+            "pickupNodeId": pickup["id"],
+            "pickupNodeName": pickup["name"],
+            "pickupLatitude": pickup["latitude"],
+            "pickupLongitude": pickup["longitude"],
+            "dropoffNodeId": dropoff["id"],
+            "dropoffNodeName": dropoff["name"],
+            "dropoffLatitude": dropoff["latitude"],
+            "dropoffLongitude": dropoff["longitude"],
+            "route": [
+                {"sequenceNumber": 1, "latitude": pickup["latitude"], "longitude": pickup["longitude"],
+                 "action": "pickup", "distanceMeters": 0},
+                {"sequenceNumber": 2, "latitude": dropoff["latitude"], "longitude": dropoff["longitude"],
+                 "action": "deliver", "distanceMeters": distance}
+            ],
+            "totalDistanceMeters": distance,
+            "estimatedBatteryUsagePercent": distance * self.energy_per_meter / self.battery_capacity * 100,
+            "orderStatus": order["status"],
+            "assignedAt": ""
+        }
+
+    # Endpoints
+
+    def _register(self, headers, payload):
+        serial = payload.get("serialNumber")
+        if not serial or not payload.get("accessKey"):
+            return 400, {"error": "Serial number and access key are required"}
+        if serial in self.robot_ids:
+            return 400, {"error": "Robot with this serial number already exists"}
+
+        robot_id = self._next_robot_id
+        self._next_robot_id += 1
+        robot = {
+            "id": robot_id,
+            "name": payload.get("name"),
+            "model": payload.get("model"),
+            "serialNumber": serial,
+            "accessKey": payload.get("accessKey"),
+            "statusName": "Idle",
+            "batteryLevel": 100.0,
+            "currentNodeId": payload.get("currentNodeId")
+        }
+        self.robots[robot_id] = robot
+        self.robot_ids[serial] = robot_id
+        return 200, self._issue_token(robot)
+
+    def _login(self, headers, payload):
+        robot = self.robots.get(self.robot_ids.get(payload.get("serialNumber")))
+        if robot is None or robot["accessKey"] != payload.get("accessKey"):
+            return 401, {"error": "Invalid serial number or access key"}
+        return 200, self._issue_token(robot)
+
+    def _status(self, headers, payload):
+        robot = self._robot_for(headers)
+        if robot is None:
+            return 401, {"error": "Invalid robot token"}
+
+        self.status_samples += 1
+        robot["statusName"] = payload.get("status", robot["statusName"])
+        robot["batteryLevel"] = payload.get("batteryLevel", robot["batteryLevel"])
+        if payload.get("currentNodeId") is not None:
+            robot["currentNodeId"] = payload["currentNodeId"]
+        return 200, {
+            "message": "Robot status updated successfully",
+            "robotId": robot["id"],
+            "status": robot["statusName"],
+            "batteryLevel": robot["batteryLevel"],
+            "currentNodeId": robot["currentNodeId"],
+            "targetNodeId": payload.get("targetNodeId")
+        }
+
+    def _status_batch(self, headers, payload):
+        # Local stand-in for a batch telemetry endpoint: a JSON array of
+        # status samples, oldest first; the newest one becomes the state
+        robot = self._robot_for(headers)
+        if robot is None:
+            return 401, {"error": "Invalid robot token"}
+        if not isinstance(payload, list) or not payload:
+            return 400, {"error": "Expected a non-empty array of samples"}
+
+        for sample in payload:
+            if not isinstance(sample, dict):
+                return 400, {"error": "Every sample must be an object"}
+        self.status_samples += len(payload) - 1
+        status, result = self._status(headers, payload[-1])
+        result["samples"] = len(payload)
+        return status, result
+
+    def _status_binary(self, headers, payload):
+        if not isinstance(payload, bytes):
+            return 415, {"error": "Expected " + telemetry_codec.CONTENT_TYPE}
+        try:
+            samples = telemetry_codec.decode(payload)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        return self._status_batch(headers, samples)
+
+    def _me(self, headers, payload):
+        robot = self._robot_for(headers)
+        if robot is None:
+            return 401, {"error": "Invalid robot token"}
+        info = dict(robot)
+        del info["accessKey"]
+        return 200, info
+
+    def _my_orders(self, headers, payload):
+        robot = self._robot_for(headers)
+        if robot is None:
+            return 401, {"error": "Invalid robot token"}
+
+        assigned = self.robot_orders.setdefault(robot["id"], [])
+        # Finished orders drop out of the robot's list
+        assigned[:] = [
+            order_id for order_id in assigned
+            if self.orders[order_id]["status"] not in (OrderStatus.DELIVERED, OrderStatus.CANCELLED)
+        ]
+        if not assigned and self.pending:
+            order_id = self.pending.pop(0)
+            self.orders[order_id]["robotId"] = robot["id"]
+            assigned.append(order_id)
+
+        # Strong validator over what the robot would receive
+        etag = '"{:08x}"'.format(zlib.crc32(json.dumps(
+            [(order_id, self.orders[order_id]["status"]) for order_id in assigned]).encode("utf-8")))
+        if headers.get("If-None-Match") == etag:
+            return 304, None, {"etag": etag}
+        return 200, [self._order_assignment(self.orders[order_id]) for order_id in assigned], {"etag": etag}
+
+    def _accept(self, headers, payload, order_id):
+        robot = self._robot_for(headers)
+        if robot is None:
+            return 401, {"error": "Invalid robot token"}
+
+        order = self.orders.get(int(order_id))
+        if order is None:
+            return 404, {"error": "Order {} not found".format(order_id)}
+        if order["robotId"] != robot["id"]:
+            return 400, {"error": "Order is not assigned to this robot"}
+
+        if order["status"] == OrderStatus.PENDING:
+            order["status"] = OrderStatus.PROCESSING
+            self._orders_changed()
+        robot["statusName"] = "Delivering"
+        return 200, {
+            "orderId": order["id"],
+            "orderStatus": order["status"],
+            "message": "Order accepted"
+        }
+
+    def _phase(self, headers, payload, order_id):
+        robot = self._robot_for(headers)
+        if robot is None:
+            return 401, {"error": "Invalid robot token"}
+
+        order = self.orders.get(int(order_id))
+        if order is None or order["robotId"] != robot["id"]:
+            return 400, {"error": "Order {} not found for this robot".format(order_id)}
+
+        key = headers.get("Idempotency-Key")
+        if key is not None and (robot["id"], key) in self.applied_keys:
+            # Resent after a lost answer: same answer, applied once
+            self.duplicate_phases += 1
+            return 200, self.applied_keys[(robot["id"], key)]
+
+        phase = payload.get("phase", "").upper()
+        previous = order["status"]
+        if phase in ("FLIGHT_TO_PICKUP", "AT_PICKUP", "LOADING"):
+            order["status"] = OrderStatus.PROCESSING
+        elif phase in ("FLIGHT_TO_DROPOFF", "AT_DROPOFF", "UNLOADING"):
+            order["status"] = OrderStatus.EN_ROUTE
+        elif phase == "PACKAGE_DELIVERED":
+            order["status"] = OrderStatus.DELIVERED
+            order["deliveredAt"] = now_ms()
+            robot["statusName"] = "Idle"
+        elif phase == "FLIGHT_TO_CHARGING":
+            robot["statusName"] = "Charging"
+        else:
+            return 400, {"error": "Unknown phase: {}".format(payload.get("phase"))}
+
+        if order["status"] != previous:
+            self._orders_changed()
+        self.phase_log.append((now_ms(), robot["id"], order["id"], phase))
+        result = {
+            "message": "Order phase updated successfully",
+            "orderId": order["id"],
+            "phase": payload.get("phase"),
+            "timestamp": payload.get("timestamp")
+        }
+        if key is not None:
+            self.applied_keys[(robot["id"], key)] = result
+        return 200, result
+
+    def _node(self, headers, payload, node_id):
+        node = self.nodes.get(int(node_id))
+        if node is None:
+            return 404, {"error": "Node not found"}
+        return 200, node
+
+    def _node_list(self, headers, payload):
+        return 200, list(self.nodes.values())
+
+
+def serve(api, port=5102, host="127.0.0.1"):
+    """
+    Serve a FakeApi over HTTP/1.1 with keep-alive (blocking)
+
+    Args:
+        api: FakeApi to serve
+        port: TCP port
+        host: Address to bind
+    """
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out as separate writes: without this the
+        # body waits for the client's delayed ACK (about 40 ms per request)
+        disable_nagle_algorithm = True
+
+        def _handle(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else None
+            headers = dict(self.headers)
+            # Long poll: hold an unchanged (304) answer until the orders
+            # change or the requested wait is over
+            wait = parse_qs(urlsplit(self.path).query).get("wait")
+            deadline = time.monotonic() + min(float(wait[0]), 60) if wait else 0
+            while True:
+                version = api.order_version
+                status, content, extra = api(self.command, self.path, body, headers)
+                if status != 304 or not api.wait_for_order_change(version, deadline - time.monotonic()):
+                    break
+            self.send_response(status)
+            for name, value in extra.items():
+                self.send_header(name, value)
+            if status != 304:
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            if status != 304:
+                self.wfile.write(content)
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer.daemon_threads = True
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer((host, port), Handler)
+    print("Fake API on http://{}:{} ({} nodes)".format(host, port, len(api.nodes)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
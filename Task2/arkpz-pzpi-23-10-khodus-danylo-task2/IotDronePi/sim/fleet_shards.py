@@ -0,0 +1,206 @@
+"""
+Sharded Fleet Simulation
+Splits a fleet across worker processes (one per core by default), each
+running its own FleetSimulator and event loop, so the fleet size is not
+capped by one interpreter's GIL. Shards stream progress snapshots back
+over pipes; the coordinator prints live totals and merges the final
+histograms and counters into one summary.
+
+Used by fleet_sim.py --processes N
+"""
+
+import os
+import sys
+import time
+import traceback
+import multiprocessing
+from multiprocessing.connection import wait
+
+from metrics import RequestMetrics
+
+
+def _shard_main(conn, shard, first_index, robots, options, progress_ms, verbose):
+    # Worker process entry point: run one shard and report over conn
+    from helpers import set_logging
+    from fleet_sim import FleetSimulator
+
+    set_logging(verbose)
+    try:
+        simulator = FleetSimulator(
+            robots=robots, first_index=first_index,
+            progress=lambda snapshot: conn.send(("progress", shard, snapshot)),
+            progress_ms=progress_ms, **options
+        )
+        summary = simulator.run()
+        summary["bootMetrics"] = summary["bootMetrics"].to_dict()
+        summary["metrics"] = summary["metrics"].to_dict()
+        conn.send(("done", shard, summary))
+    except Exception:
+        conn.send(("error", shard, traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def split_fleet(robots, shards):
+    """
+    Split a fleet into contiguous robot index ranges
+
+    Args:
+        robots: Fleet size
+        shards: Number of shards
+
+    Returns:
+        list: (first_index, count) per shard, sizes differ by at most one
+    """
+    base, extra = divmod(robots, shards)
+    ranges = []
+    first = 0
+    for shard in range(shards):
+        count = base + (1 if shard < extra else 0)
+        ranges.append((first, count))
+        first += count
+    return ranges
+
+
+def merge_summaries(summaries):
+    """
+    Combine shard summaries into one fleet summary
+
+    Args:
+        summaries: List of shard summaries (metrics as plain data)
+
+    Returns:
+        dict: Summary in the FleetSimulator.run() format
+    """
+    merged = {
+        "robots": 0,
+        "booted": 0,
+        "bootSeconds": 0.0,
+        "states": {},
+        "presses": 0,
+        "simulatedMs": None,
+        "bootMetrics": RequestMetrics(),
+        "metrics": RequestMetrics(),
+        "ordersCreated": 0,
+        "ordersDelivered": None
+    }
+    connections = None
+
+    for summary in summaries:
+        for key in ("robots", "booted", "presses", "ordersCreated"):
+            merged[key] += summary[key]
+        # Shards boot in parallel: the fleet is up when the slowest one is
+        merged["bootSeconds"] = max(merged["bootSeconds"], summary["bootSeconds"])
+        for name, count in summary["states"].items():
+            merged["states"][name] = merged["states"].get(name, 0) + count
+        if summary["simulatedMs"] is not None:
+            merged["simulatedMs"] = max(merged["simulatedMs"] or 0, summary["simulatedMs"])
+        if summary["ordersDelivered"] is not None:
+            merged["ordersDelivered"] = (merged["ordersDelivered"] or 0) + summary["ordersDelivered"]
+        merged["bootMetrics"].merge(RequestMetrics.from_dict(summary["bootMetrics"]))
+        merged["metrics"].merge(RequestMetrics.from_dict(summary["metrics"]))
+        if "connections" in summary:
+            opened, reused = summary["connections"]
+            connections = connections or [0, 0]
+            connections[0] += opened
+            connections[1] += reused
+
+    if connections is not None:
+        merged["connections"] = tuple(connections)
+    merged["shards"] = len(summaries)
+    return merged
+
+
+def _print_progress(snapshots, robots, started):
+    metrics = RequestMetrics()
+    booted = 0
+    delivered = None
+    for snapshot in snapshots.values():
+        booted += snapshot["booted"]
+        if snapshot["ordersDelivered"] is not None:
+            delivered = (delivered or 0) + snapshot["ordersDelivered"]
+        metrics.merge(RequestMetrics.from_dict(snapshot["metrics"]))
+
+    total = metrics.total()
+    line = "[{:6.1f} s] shards {} robots {}/{} requests {} ({:.0f} req/s) p95 {} ms errors {}".format(
+        time.perf_counter() - started, len(snapshots), booted, robots, total.count,
+        total.count / max(metrics.wall_seconds(), 1e-9),
+        "-" if not total.count else "{:.2f}".format(total.percentile(95)), metrics.errors)
+    if delivered is not None:
+        line += " delivered {}".format(delivered)
+    print(line)
+    sys.stdout.flush()
+
+
+def run_sharded(robots, processes=None, progress_s=5, verbose=False, **options):
+    """
+    Run a fleet split across worker processes (blocking)
+
+    Args:
+        robots: Fleet size
+        processes: Number of shards (default: one per CPU core)
+        progress_s: Seconds between live progress lines (0 to disable)
+        verbose: Show controller logs from the shards
+        **options: FleetSimulator arguments shared by every shard;
+                   order_rate is the rate for the whole fleet
+
+    Returns:
+        dict: Merged summary in the FleetSimulator.run() format
+    """
+    processes = max(1, min(processes or os.cpu_count() or 1, robots))
+    if options.get("order_rate") is not None:
+        options["order_rate"] = options["order_rate"] / float(processes)
+
+    started = time.perf_counter()
+    progress_ms = int(progress_s * 1000) if progress_s else 24 * 3600 * 1000
+    workers = []
+    for shard, (first_index, count) in enumerate(split_fleet(robots, processes)):
+        parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=_shard_main,
+            args=(child_conn, shard, first_index, count, options, progress_ms, verbose),
+            name="fleet-shard-{}".format(shard),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        workers.append((process, parent_conn))
+
+    pending = {conn: process for process, conn in workers}
+    snapshots = {}
+    summaries = []
+    errors = []
+    last_print = 0
+
+    while pending:
+        for conn in wait(list(pending)):
+            try:
+                kind, shard, payload = conn.recv()
+            except EOFError:
+                errors.append("shard exited without a result (exit code {})".format(
+                    pending[conn].exitcode))
+                del pending[conn]
+                continue
+
+            if kind == "progress":
+                snapshots[shard] = payload
+            else:
+                if kind == "done":
+                    summaries.append(payload)
+                else:
+                    errors.append("shard {} failed:\n{}".format(shard, payload))
+                del pending[conn]
+
+        if progress_s and snapshots and time.perf_counter() - last_print >= progress_s:
+            last_print = time.perf_counter()
+            _print_progress(snapshots, robots, started)
+
+    for process, conn in workers:
+        process.join()
+        conn.close()
+
+    for error in errors:
+        print(error, file=sys.stderr)
+    if not summaries:
+        raise RuntimeError("Every fleet shard failed")
+    return merge_summaries(summaries)
@@ -0,0 +1,506 @@
+"""
+Fleet Simulator
+Runs many RobotControllerFSM instances in one process, all scheduled on
+one shared runtime, to load-test the backend with realistic robot traffic:
+register/login, order polling, order accept, phase updates and telemetry
+go through the same code paths as on the device.
+
+Against the fake API the robots run inline (optionally on a virtual
+clock). Against a real backend (--api) every robot job runs on a thread
+pool with keep-alive connections, one job at a time per robot, so slow
+requests do not hold up the event loop.
+
+Usage (on a PC):
+    python sim/fleet_sim.py --robots 1000 --duration 60
+    python sim/fleet_sim.py --robots 5000 --api http://localhost:5102 --workers 256
+    python sim/fleet_sim.py --robots 20000 --processes 0 --api http://localhost:5102
+    python sim/fleet_sim.py --serve 5102
+
+--processes splits the fleet across worker processes (0: one per core),
+see fleet_shards.py
+"""
+
+import os
+import sys
+import time
+import random
+
+_base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _folder in ("config", "core", "modules", "utils", "hal", "sim"):
+    sys.path.append(os.path.join(_base_dir, _folder))
+sys.path.append(_base_dir)
+
+from config import API_CONFIG, GPS_CONFIG, ROBOT_CONFIG, TELEMETRY_CONFIG
+from helpers import log_message, set_logging, move_coordinates
+from clock import VirtualClock, set_clock, now_ms
+from hal import urequests, HOST
+import host_machine
+from runtime import Runtime
+from wifi_manager import WiFiManager
+from state_machine import DroneState, STATE_NAMES
+from fake_api import FakeApi, NodeType, OrderStatus, serve
+from metrics import RequestMetrics, MeteredTransport
+from mission_sim import Recipient
+from main import RobotControllerFSM
+
+STATION_BASE_ID = 1000
+USER_NODE_BASE_ID = 2000
+
+
+def build_fleet_world(api, stations=10, user_nodes=100, radius_m=3000, seed=1):
+    """
+    Add charging stations on a ring and user nodes scattered inside it
+
+    Args:
+        api: FakeApi to populate
+        stations: Number of charging stations
+        user_nodes: Number of pickup/dropoff nodes
+        radius_m: Radius of the service area in meters
+        seed: Random seed for node placement
+
+    Returns:
+        tuple: (station node IDs, user node IDs)
+    """
+    rng = random.Random(seed)
+    lat = GPS_CONFIG["START_LATITUDE"]
+    lon = GPS_CONFIG["START_LONGITUDE"]
+
+    station_ids = []
+    for i in range(stations):
+        node_lat, node_lon = move_coordinates(lat, lon, 360.0 * i / stations, radius_m / 2)
+        node_id = STATION_BASE_ID + i
+        api.add_node(node_id, "Station {}".format(i + 1), node_lat, node_lon, NodeType.CHARGING_STATION)
+        station_ids.append(node_id)
+
+    user_ids = []
+    for i in range(user_nodes):
+        node_lat, node_lon = move_coordinates(lat, lon, rng.uniform(0, 360), radius_m * rng.random() ** 0.5)
+        node_id = USER_NODE_BASE_ID + i
+        api.add_node(node_id, "Point {}".format(i + 1), node_lat, node_lon)
+        user_ids.append(node_id)
+
+    return station_ids, user_ids
+
+
+class FleetMember:
+    """
+    One simulated robot: its controller, recipient and task wrapper
+    """
+
+    def __init__(self, index, serial_number, access_key, start_node, wifi_manager, executor=None):
+        """
+        Args:
+            index: Position in the fleet (also the simulated board ID)
+            serial_number: Robot serial number
+            access_key: Robot access key
+            start_node: Charging station node the robot starts at
+            wifi_manager: Connected WiFiManager shared by the fleet (the host
+                          has one network interface; reconnecting it per
+                          robot would drop everyone else's connection)
+            executor: Optional thread pool that runs the robot's jobs
+        """
+        self.index = index
+        self.executor = executor
+        self.controller = RobotControllerFSM(
+            robot_config={
+                "SERIAL_NUMBER": serial_number,
+                "ACCESS_KEY": access_key,
+                "START_NODE": start_node
+            },
+            headless=True,
+            wifi_manager=wifi_manager
+        )
+        self.recipient = None
+        self.booted = False
+        self._lock = None
+
+    def boot(self):
+        """
+        Run the controller's initialization on this robot's own board
+
+        Returns:
+            bool: True if the robot is online
+        """
+        host_machine.set_board(self.index)
+        try:
+            self.booted = self.controller.initialize()
+        except Exception as e:
+            log_message("Robot {} failed to boot: {}".format(self.index, e), "ERROR")
+            self.booted = False
+        return self.booted
+
+    def wrap(self, name, func):
+        """
+        Wrap a controller task for the shared runtime
+        Errors go to this robot's handler; with an executor the task runs
+        on the thread pool, never concurrently with this robot's other tasks
+        """
+        controller = self.controller
+
+        def task():
+            try:
+                return func()
+            except Exception as e:
+                controller.handle_task_error(name, e)
+
+        if self.executor is None:
+            return task
+
+        def spawn():
+            return self._run_serialized(task)
+        return spawn
+
+    async def _run_serialized(self, task):
+        import asyncio
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await asyncio.get_running_loop().run_in_executor(self.executor, task)
+
+
+class FleetSimulator:
+    """
+    N robots on one runtime, with request metrics for the whole fleet
+    """
+
+    def __init__(self, robots=100, duration_s=60, api_url=None, workers=64, virtual=False,
+                 stations=10, user_nodes=100, order_rate=None, start_nodes=None, serial_prefix="SIM-DRONE-",
+                 access_key="sim_robot_key", reaction_ms=3000, seed=1, first_index=0,
+                 progress=None, progress_ms=5000, batch_telemetry=False):
+        """
+        Args:
+            robots: Fleet size
+            duration_s: Run time in seconds (simulated seconds with virtual)
+            api_url: Backend base URL; None uses the in-process fake API
+            workers: Thread pool size for a real backend
+            virtual: Use a virtual clock (fake API only)
+            stations: Charging stations in the fake world (robots are spread over them)
+            user_nodes: Pickup/dropoff nodes in the fake world
+            order_rate: New orders per second on the fake API (default: one
+                        per robot every five minutes)
+            start_nodes: Node IDs the robots start at, round robin (default:
+                         the fake world's stations, or START_NODE with api_url)
+            serial_prefix: Robot serial numbers are serial_prefix + index
+            access_key: Access key shared by the simulated robots
+            reaction_ms: Button reaction time of the simulated people
+            seed: Random seed for the world and the orders
+            first_index: Index of the first robot (shards of one fleet use
+                         disjoint ranges, so serial numbers stay unique)
+            progress: Optional callable(snapshot) run every progress_ms with
+                      the counters and request metrics so far (plain data)
+            progress_ms: Period of progress snapshots
+            batch_telemetry: Upload telemetry in batches (TELEMETRY_CONFIG
+                             BATCH_ENABLED; the fake API has the endpoint):
+                             True or "json" for JSON arrays, "binary" for
+                             telemetry_codec batches
+        """
+        if virtual and api_url:
+            raise ValueError("A virtual clock only works with the fake API")
+
+        if batch_telemetry:
+            TELEMETRY_CONFIG["BATCH_ENABLED"] = True
+            TELEMETRY_CONFIG["BATCH_CODEC"] = "binary" if batch_telemetry == "binary" else "json"
+
+        self.robots = robots
+        self.duration_s = duration_s
+        self.api_url = api_url
+        self.workers = workers
+        self.virtual = virtual
+        self.stations = stations
+        self.user_nodes = user_nodes
+        self.order_rate = order_rate if order_rate is not None else robots / 300.0
+        self.start_nodes = start_nodes
+        self.serial_prefix = serial_prefix
+        self.access_key = access_key
+        self.reaction_ms = reaction_ms
+        self.rng = random.Random(seed + first_index)
+        self.first_index = first_index
+        self.progress = progress
+        self.progress_ms = progress_ms
+
+        self.metrics = RequestMetrics()
+        self.boot_metrics = None
+        self.api = None
+        self.pool = None
+        self.executor = None
+        self.members = []
+        self.station_ids = []
+        self.user_ids = []
+        self.orders_created = 0
+        self.boot_seconds = 0.0
+        self._order_credit = 0.0
+        self._last_dispatch_ms = 0
+
+    def _setup_transport(self):
+        if self.api_url:
+            from concurrent.futures import ThreadPoolExecutor
+
+            API_CONFIG["BASE_URL"] = self.api_url.rstrip("/")
+            self.pool = urequests.ConnectionPool(max_idle_per_host=self.workers)
+            self.executor = ThreadPoolExecutor(self.workers)
+            urequests.transport = MeteredTransport(self.pool, self.metrics)
+            self.station_ids = self.start_nodes or [API_CONFIG.get("START_NODE", 25)]
+        else:
+            API_CONFIG["BASE_URL"] = "http://fake-api"
+            self.api = FakeApi(ROBOT_CONFIG["ENERGY_CONSUMPTION_PER_METER"],
+                               ROBOT_CONFIG["BATTERY_CAPACITY_JOULES"])
+            self.station_ids, self.user_ids = build_fleet_world(self.api, self.stations, self.user_nodes)
+            if self.start_nodes:
+                self.station_ids = self.start_nodes
+            urequests.transport = MeteredTransport(self.api, self.metrics)
+
+    def _create_members(self):
+        wifi_manager = WiFiManager()
+        if not wifi_manager.connect():
+            raise RuntimeError("Simulated WiFi did not connect")
+
+        for i in range(self.first_index, self.first_index + self.robots):
+            member = FleetMember(
+                i,
+                "{}{:05d}".format(self.serial_prefix, i + 1),
+                self.access_key,
+                self.station_ids[i % len(self.station_ids)],
+                wifi_manager,
+                self.executor
+            )
+            self.members.append(member)
+
+    def _boot(self):
+        started = self.metrics.started = time.perf_counter()
+        if self.executor:
+            list(self.executor.map(FleetMember.boot, self.members))
+        else:
+            for member in self.members:
+                member.boot()
+        self.boot_seconds = time.perf_counter() - started
+
+    def _dispatch_orders(self):
+        # Runtime task: create orders between random user nodes at order_rate
+        now = now_ms()
+        self._order_credit += (now - self._last_dispatch_ms) * self.order_rate / 1000.0
+        self._last_dispatch_ms = now
+        while self._order_credit >= 1:
+            self._order_credit -= 1
+            pickup, dropoff = self.rng.sample(self.user_ids, 2)
+            self.orders_created += 1
+            self.api.add_order(pickup, dropoff, name="Fleet parcel {}".format(self.orders_created))
+
+    def run(self):
+        """
+        Boot the fleet and run it for duration_s (blocking)
+
+        Returns:
+            dict: Summary with boot, order, state and request statistics
+        """
+        clock = VirtualClock() if self.virtual else None
+        set_clock(clock)
+        self._setup_transport()
+
+        runtime = Runtime()
+        try:
+            self._create_members()
+            self._boot()
+
+            for member in self.members:
+                if not member.booted:
+                    continue
+                controller = member.controller
+                controller.setup_runtime(runtime, wrap_task=member.wrap,
+                                         name_prefix="{}:".format(member.index))
+                member.recipient = Recipient(controller, self.reaction_ms)
+                runtime.add_task("{}:recipient".format(member.index), member.recipient.tick, 500)
+
+            if self.api is not None:
+                self._last_dispatch_ms = now_ms()
+                runtime.add_task("fleet-orders", self._dispatch_orders, 1000)
+
+            if self.progress is not None:
+                runtime.add_task("fleet-progress", self._report_progress, self.progress_ms,
+                                 delay_ms=self.progress_ms)
+
+            duration_ms = int(self.duration_s * 1000)
+            runtime.add_task("fleet-stop", runtime.stop, duration_ms, delay_ms=duration_ms)
+
+            self.metrics = self._reset_metrics()
+            if self.virtual:
+                runtime.run_until(max_idle_ms=60000)
+            else:
+                runtime.run()
+            self.metrics.stop()
+        finally:
+            if self.executor:
+                self.executor.shutdown(wait=True)
+            if self.pool:
+                self.pool.close()
+            urequests.transport = None
+            set_clock(None)
+
+        return self._summary(clock)
+
+    def _report_progress(self):
+        # Runtime task: hand a snapshot to the progress callback
+        self.progress(self.snapshot())
+
+    def snapshot(self):
+        """
+        Counters and request metrics so far, as plain data (picklable)
+
+        Returns:
+            dict: Robots online, orders and steady-state metrics
+        """
+        return {
+            "booted": sum(1 for m in self.members if m.booted),
+            "ordersCreated": self.orders_created,
+            "ordersDelivered": self._delivered(),
+            "metrics": self.metrics.to_dict()
+        }
+
+    def _delivered(self):
+        if self.api is None:
+            return None
+        return sum(1 for order in self.api.orders.values() if order["status"] == OrderStatus.DELIVERED)
+
+    def _reset_metrics(self):
+        # Boot traffic is reported separately from steady-state traffic
+        self.boot_metrics = self.metrics
+        self.boot_metrics.stop()
+        metrics = RequestMetrics()
+        urequests.transport.metrics = metrics
+        return metrics
+
+    def _summary(self, clock):
+        states = {}
+        for member in self.members:
+            if member.booted:
+                name = STATE_NAMES[member.controller.fsm.current_state]
+                states[name] = states.get(name, 0) + 1
+
+        summary = {
+            "robots": self.robots,
+            "booted": sum(1 for m in self.members if m.booted),
+            "bootSeconds": self.boot_seconds,
+            "states": states,
+            "presses": sum(m.recipient.presses for m in self.members if m.recipient),
+            "simulatedMs": clock.now if clock else None,
+            "bootMetrics": self.boot_metrics,
+            "metrics": self.metrics,
+            "ordersCreated": self.orders_created,
+            "ordersDelivered": self._delivered()
+        }
+        if self.pool is not None:
+            summary["connections"] = (self.pool.opened, self.pool.reused)
+        return summary
+
+
+def serve_fake_api(port, stations=10, user_nodes=100, order_rate=1.0, seed=1):
+    """
+    Serve a fake API with a fleet world over HTTP (blocking)
+    A background thread keeps adding orders at order_rate per second
+
+    Args:
+        port: TCP port
+        stations: Charging stations
+        user_nodes: Pickup/dropoff nodes
+        order_rate: New orders per second
+        seed: Random seed for the world and the orders
+    """
+    import threading
+
+    api = FakeApi()
+    _, user_ids = build_fleet_world(api, stations, user_nodes, seed=seed)
+    rng = random.Random(seed)
+
+    def dispatch():
+        while True:
+            time.sleep(1.0 / order_rate)
+            pickup, dropoff = rng.sample(user_ids, 2)
+            api.add_order(pickup, dropoff)
+
+    if order_rate > 0:
+        threading.Thread(target=dispatch, daemon=True).start()
+    serve(api, port)
+
+
+def print_summary(summary):
+    """
+    Print a fleet summary
+    """
+    print("Robots online: {}/{} (boot {:.1f} s)".format(
+        summary["booted"], summary["robots"], summary["bootSeconds"]))
+    if "shards" in summary:
+        print("Shards: {}".format(summary["shards"]))
+    if summary["simulatedMs"] is not None:
+        print("Simulated time: {:.1f} min".format(summary["simulatedMs"] / 60000.0))
+    if summary["ordersDelivered"] is not None:
+        print("Orders created: {}, delivered: {}".format(
+            summary["ordersCreated"], summary["ordersDelivered"]))
+    print("Button presses: {}".format(summary["presses"]))
+    if "connections" in summary:
+        opened, reused = summary["connections"]
+        print("Connections opened: {}, reused: {}".format(opened, reused))
+    print("States: " + ", ".join(
+        "{} {}".format(name, count) for name, count in sorted(summary["states"].items())))
+    print("")
+    print("Boot traffic")
+    print(summary["bootMetrics"].report())
+    print("")
+    print("Steady-state traffic")
+    print(summary["metrics"].report())
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fleet of simulated robots")
+    parser.add_argument("--robots", type=int, default=100, help="fleet size")
+    parser.add_argument("--duration", type=float, default=60, help="run time in seconds")
+    parser.add_argument("--api", help="backend base URL (default: in-process fake API)")
+    parser.add_argument("--workers", type=int, default=64, help="request threads for --api")
+    parser.add_argument("--virtual", action="store_true", help="virtual clock (fake API only)")
+    parser.add_argument("--stations", type=int, default=10, help="charging stations in the fake world")
+    parser.add_argument("--user-nodes", type=int, default=100, help="pickup/dropoff nodes in the fake world")
+    parser.add_argument("--order-rate", type=float, help="new orders per second on the fake API")
+    parser.add_argument("--start-nodes", type=lambda text: [int(n) for n in text.split(",")],
+                        help="comma-separated node IDs the robots start at")
+    parser.add_argument("--serial-prefix", default="SIM-DRONE-", help="robot serial number prefix")
+    parser.add_argument("--batch-telemetry", nargs="?", const="json", choices=("json", "binary"),
+                        help="upload telemetry in batches (needs the batch endpoint)")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="worker processes to split the fleet across (0: one per core)")
+    parser.add_argument("--progress", type=float, default=5,
+                        help="seconds between progress lines with --processes (0: off)")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="serve the fake API over HTTP instead of running robots")
+    parser.add_argument("--verbose", action="store_true", help="show controller logs")
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_fake_api(args.serve, args.stations, args.user_nodes,
+                       1.0 if args.order_rate is None else args.order_rate)
+        return
+
+    if not HOST:
+        log_message("The fleet simulator needs the host HAL backend", "ERROR")
+        return
+
+    options = dict(
+        duration_s=args.duration, api_url=args.api, workers=args.workers,
+        virtual=args.virtual, stations=args.stations, user_nodes=args.user_nodes,
+        order_rate=args.order_rate, start_nodes=args.start_nodes, serial_prefix=args.serial_prefix,
+        batch_telemetry=args.batch_telemetry
+    )
+    if args.processes != 1:
+        from fleet_shards import run_sharded
+        summary = run_sharded(args.robots, args.processes or None, args.progress,
+                              args.verbose, **options)
+    else:
+        set_logging(args.verbose)
+        try:
+            summary = FleetSimulator(robots=args.robots, **options).run()
+        finally:
+            set_logging(True)
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
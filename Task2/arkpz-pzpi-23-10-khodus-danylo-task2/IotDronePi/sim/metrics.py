@@ -0,0 +1,258 @@
+"""
+Simulation Metrics
+Mergeable latency histograms and per-endpoint request statistics
+"""
+
+import math
+import time
+import threading
+from urllib.parse import urlsplit
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram (about 4.5% bucket width)
+    Fixed memory regardless of sample count; histograms from several
+    robots, threads or processes add up with merge()
+    """
+
+    # Buckets per doubling of latency
+    RESOLUTION = 16
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+
+    def record(self, latency_ms):
+        """
+        Add one sample
+
+        Args:
+            latency_ms: Latency in milliseconds
+        """
+        if latency_ms <= 0.001:
+            index = 0
+        else:
+            index = int(math.log2(latency_ms * 1000) * self.RESOLUTION)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total_ms += latency_ms
+        if self.min_ms is None or latency_ms < self.min_ms:
+            self.min_ms = latency_ms
+        if latency_ms > self.max_ms:
+            self.max_ms = latency_ms
+
+    def merge(self, other):
+        """
+        Add another histogram's samples to this one
+
+        Args:
+            other: LatencyHistogram
+        """
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total_ms += other.total_ms
+        if other.min_ms is not None and (self.min_ms is None or other.min_ms < self.min_ms):
+            self.min_ms = other.min_ms
+        if other.max_ms > self.max_ms:
+            self.max_ms = other.max_ms
+
+    def percentile(self, p):
+        """
+        Get a latency percentile (upper edge of the bucket it falls in)
+
+        Args:
+            p: Percentile, 0-100
+
+        Returns:
+            float: Latency in milliseconds, or None if empty
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * p / 100.0)))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                upper = 2 ** ((index + 1) / float(self.RESOLUTION)) / 1000.0
+                return min(upper, self.max_ms)
+        return self.max_ms
+
+    def mean(self):
+        return self.total_ms / self.count if self.count else None
+
+    def to_dict(self):
+        """
+        Plain-data form (picklable and JSON-friendly)
+        """
+        return {
+            "buckets": dict(self.buckets),
+            "count": self.count,
+            "total_ms": self.total_ms,
+            "min_ms": self.min_ms,
+            "max_ms": self.max_ms
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.buckets = {int(k): v for k, v in data["buckets"].items()}
+        histogram.count = data["count"]
+        histogram.total_ms = data["total_ms"]
+        histogram.min_ms = data["min_ms"]
+        histogram.max_ms = data["max_ms"]
+        return histogram
+
+
+def endpoint_key(method, url):
+    """
+    Group a request by endpoint: numeric path segments become {id}
+
+    Returns:
+        str: e.g. "POST /api/Robot/order/{id}/phase"
+    """
+    parts = urlsplit(url).path.split("/")
+    return "{} {}".format(method, "/".join("{id}" if p.isdigit() else p for p in parts))
+
+
+class RequestMetrics:
+    """
+    Request latency per endpoint plus status and error counts
+    Thread-safe; merge() combines results from several shards
+    """
+
+    def __init__(self):
+        self.endpoints = {}
+        self.statuses = {}
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.elapsed_s = None
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, latency_ms, status):
+        """
+        Add one request
+
+        Args:
+            endpoint: Endpoint key (see endpoint_key)
+            latency_ms: Round-trip time in milliseconds
+            status: HTTP status code, or None if the request failed
+        """
+        with self._lock:
+            histogram = self.endpoints.get(endpoint)
+            if histogram is None:
+                histogram = self.endpoints[endpoint] = LatencyHistogram()
+            histogram.record(latency_ms)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status is None or status >= 500:
+                self.errors += 1
+
+    def stop(self):
+        """Freeze the measured wall time"""
+        self.elapsed_s = time.perf_counter() - self.started
+
+    def wall_seconds(self):
+        if self.elapsed_s is not None:
+            return self.elapsed_s
+        return time.perf_counter() - self.started
+
+    def total(self):
+        """
+        Get a histogram of every request
+
+        Returns:
+            LatencyHistogram: All endpoints combined
+        """
+        histogram = LatencyHistogram()
+        for endpoint_histogram in self.endpoints.values():
+            histogram.merge(endpoint_histogram)
+        return histogram
+
+    def merge(self, other):
+        """
+        Add another RequestMetrics (wall time: the longest of the two)
+        """
+        for endpoint, histogram in other.endpoints.items():
+            mine = self.endpoints.get(endpoint)
+            if mine is None:
+                mine = self.endpoints[endpoint] = LatencyHistogram()
+            mine.merge(histogram)
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.errors += other.errors
+        self.elapsed_s = max(self.wall_seconds(), other.wall_seconds())
+
+    def to_dict(self):
+        """
+        Plain-data form (picklable and JSON-friendly); safe while requests
+        are still being recorded
+        """
+        with self._lock:
+            return {
+                "endpoints": {k: h.to_dict() for k, h in self.endpoints.items()},
+                "statuses": dict(self.statuses),
+                "errors": self.errors,
+                "elapsed_s": self.wall_seconds()
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        metrics = cls()
+        metrics.endpoints = {k: LatencyHistogram.from_dict(h) for k, h in data["endpoints"].items()}
+        metrics.statuses = dict(data["statuses"])
+        metrics.errors = data["errors"]
+        metrics.elapsed_s = data["elapsed_s"]
+        return metrics
+
+    def report(self):
+        """
+        Format a throughput and latency table
+
+        Returns:
+            str: Multi-line report
+        """
+        total = self.total()
+        seconds = self.wall_seconds()
+        lines = [
+            "Requests: {} in {:.1f} s ({:.0f} req/s), errors: {}".format(
+                total.count, seconds, total.count / max(seconds, 1e-9), self.errors),
+            "{:<44} {:>8} {:>9} {:>9} {:>9}".format("endpoint", "count", "p50 ms", "p95 ms", "p99 ms")
+        ]
+        rows = sorted(self.endpoints.items()) + [("ALL", total)]
+        for endpoint, histogram in rows:
+            if not histogram.count:
+                continue
+            lines.append("{:<44} {:>8} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                endpoint, histogram.count,
+                histogram.percentile(50), histogram.percentile(95), histogram.percentile(99)))
+        return "\n".join(lines)
+
+
+class MeteredTransport:
+    """
+    urequests transport wrapper that times every request
+    """
+
+    def __init__(self, inner, metrics):
+        """
+        Args:
+            inner: Transport callable(method, url, body, headers)
+            metrics: RequestMetrics to record into
+        """
+        self.inner = inner
+        self.metrics = metrics
+
+    def __call__(self, method, url, body, headers):
+        started = time.perf_counter()
+        status = None
+        try:
+            result = self.inner(method, url, body, headers)
+            status = result[0]
+            return result
+        finally:
+            self.metrics.record(endpoint_key(method, url),
+                                (time.perf_counter() - started) * 1000.0, status)
@@ -0,0 +1,232 @@
+"""
+Mission Simulator
+Runs the real RobotControllerFSM through complete deliveries (pickup,
+dropoff, return to charge) against the fake API on a virtual clock.
+The scheduler jumps from one deadline to the next, so a mission that
+takes minutes on the device finishes in milliseconds
+
+Usage (on a PC):
+    python sim/mission_sim.py [--missions N] [--leg METERS] [--verbose]
+"""
+
+import os
+import sys
+import time
+
+_base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _folder in ("config", "core", "modules", "utils", "hal", "sim"):
+    sys.path.append(os.path.join(_base_dir, _folder))
+sys.path.append(_base_dir)
+
+from config import API_CONFIG, GPS_CONFIG
+from helpers import log_message, set_logging, move_coordinates
+from clock import VirtualClock, set_clock, now_ms
+from hal import urequests, HOST
+from state_machine import DroneState
+from fake_api import FakeApi, NodeType, OrderStatus
+from main import RobotControllerFSM
+
+STATION_NODE_ID = 25
+PICKUP_NODE_ID = 26
+DROPOFF_NODE_ID = 27
+
+
+def build_world(api, leg_m):
+    """
+    Add a charging station, a pickup node leg_m north of it and a
+    dropoff node leg_m east of the pickup
+
+    Args:
+        api: FakeApi to populate
+        leg_m: Length of each flight leg in meters
+    """
+    lat = GPS_CONFIG["START_LATITUDE"]
+    lon = GPS_CONFIG["START_LONGITUDE"]
+    api.add_node(STATION_NODE_ID, "Home station", lat, lon, NodeType.CHARGING_STATION)
+
+    pickup_lat, pickup_lon = move_coordinates(lat, lon, 0, leg_m)
+    api.add_node(PICKUP_NODE_ID, "Pickup point", pickup_lat, pickup_lon)
+
+    dropoff_lat, dropoff_lon = move_coordinates(pickup_lat, pickup_lon, 90, leg_m)
+    api.add_node(DROPOFF_NODE_ID, "Dropoff point", dropoff_lat, dropoff_lon)
+
+
+class Recipient:
+    """
+    Simulated person at the drone: presses the compartment button
+    reaction_ms after the hatch opens, through the same Pin and IRQ
+    path as the real button
+    """
+
+    def __init__(self, controller, reaction_ms=3000, hold_ms=150):
+        """
+        Args:
+            controller: RobotControllerFSM being simulated
+            reaction_ms: Delay between the hatch opening and the press
+            hold_ms: How long the button is held down
+        """
+        self.controller = controller
+        self.reaction_ms = reaction_ms
+        self.hold_ms = hold_ms
+        self.pin = controller.hardware_controller.button.pin
+        self.presses = 0
+
+    def tick(self):
+        """
+        Runtime task: press or release the button when due
+
+        Returns:
+            int: Milliseconds until the next action, or None for the default period
+        """
+        if self.pin.value() == 0:
+            self.pin.value(1)
+            return None
+
+        fsm = self.controller.fsm
+        if fsm.current_state in (DroneState.LOADING, DroneState.WAIT_FOR_PICKUP):
+            wait = self.reaction_ms - fsm.ms_in_state()
+            if wait > 0:
+                return wait
+            self.pin.value(0)
+            self.presses += 1
+            return self.hold_ms
+        return None
+
+
+class MissionSimulator:
+    """
+    Runs back-to-back delivery missions for one controller
+    A mission starts when its order is created and ends when the drone
+    is charging at its home station again
+    """
+
+    def __init__(self, missions=1, leg_m=1000, reaction_ms=3000, time_limit_ms=None):
+        """
+        Args:
+            missions: Number of missions to run
+            leg_m: Length of each flight leg in meters
+            reaction_ms: Button reaction time of the simulated people
+            time_limit_ms: Simulated time limit (default: one hour per mission)
+        """
+        self.missions = missions
+        self.leg_m = leg_m
+        self.reaction_ms = reaction_ms
+        self.time_limit_ms = time_limit_ms or missions * 3600000
+
+        self.clock = None
+        self.api = None
+        self.controller = None
+        self.order_id = None
+        self.results = []
+        self._log_pos = 0
+
+    def _next_order(self):
+        self.order_id = self.api.add_order(PICKUP_NODE_ID, DROPOFF_NODE_ID,
+                                           name="Sim parcel {}".format(len(self.results) + 1))
+
+    def _check_missions(self):
+        # Runtime task: a mission is done once the drone charges again
+        order = self.api.orders[self.order_id]
+        if (order["status"] == OrderStatus.DELIVERED
+                and self.controller.fsm.current_state == DroneState.CHARGING):
+            phases = {}
+            log = self.api.phase_log
+            for at_ms, _, order_id, phase in log[self._log_pos:]:
+                if order_id == self.order_id:
+                    phases[phase] = at_ms - order["createdAt"]
+            self._log_pos = len(log)
+            self.results.append({
+                "orderId": self.order_id,
+                "deliveredMs": order["deliveredAt"] - order["createdAt"],
+                "missionMs": now_ms() - order["createdAt"],
+                "phases": phases
+            })
+            if len(self.results) < self.missions:
+                self._next_order()
+
+    def _keep_running(self):
+        return len(self.results) < self.missions and self.clock.now < self.time_limit_ms
+
+    def run(self):
+        """
+        Run all missions (blocking)
+
+        Returns:
+            dict: Summary with per-mission results, simulated and wall time
+        """
+        self.clock = VirtualClock()
+        set_clock(self.clock)
+        self.api = FakeApi()
+        build_world(self.api, self.leg_m)
+        urequests.transport = self.api
+        API_CONFIG["START_NODE"] = STATION_NODE_ID
+
+        wall_start = time.perf_counter()
+        try:
+            self.controller = RobotControllerFSM()
+            if not self.controller.initialize():
+                raise RuntimeError("Controller initialization failed")
+
+            runtime = self.controller.setup_runtime()
+            recipient = Recipient(self.controller, self.reaction_ms)
+            runtime.add_task("sim-recipient", recipient.tick, 500)
+            runtime.add_task("sim-missions", self._check_missions, 1000)
+
+            self._next_order()
+            runtime.run_until(self._keep_running, max_idle_ms=60000)
+            self.controller.shutdown()
+        finally:
+            urequests.transport = None
+            set_clock(None)
+
+        return {
+            "missions": self.results,
+            "completed": len(self.results),
+            "simulatedMs": self.clock.now,
+            "wallSeconds": time.perf_counter() - wall_start,
+            "requests": self.api.request_count
+        }
+
+
+def print_summary(summary):
+    """
+    Print a mission summary
+    """
+    completed = summary["completed"]
+    print("Missions completed: {}".format(completed))
+    print("Simulated time: {:.1f} min".format(summary["simulatedMs"] / 60000.0))
+    print("Wall time: {:.3f} s ({:.0f}x real time)".format(
+        summary["wallSeconds"],
+        summary["simulatedMs"] / 1000.0 / max(summary["wallSeconds"], 1e-9)
+    ))
+    print("API requests: {}".format(summary["requests"]))
+    if completed:
+        missions = summary["missions"]
+        print("Mean delivery time: {:.1f} s".format(
+            sum(m["deliveredMs"] for m in missions) / completed / 1000.0))
+        print("Mean mission time: {:.1f} s".format(
+            sum(m["missionMs"] for m in missions) / completed / 1000.0))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run delivery missions on a virtual clock")
+    parser.add_argument("--missions", type=int, default=1, help="number of missions")
+    parser.add_argument("--leg", type=float, default=1000, help="flight leg length in meters")
+    parser.add_argument("--reaction", type=int, default=3000, help="button reaction time in ms")
+    parser.add_argument("--verbose", action="store_true", help="show controller logs")
+    args = parser.parse_args()
+
+    if not HOST:
+        log_message("The mission simulator needs the host HAL backend", "ERROR")
+        return
+
+    set_logging(args.verbose)
+    summary = MissionSimulator(args.missions, args.leg, args.reaction).run()
+    set_logging(True)
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+Tick Benchmark
+Measures how long each runtime job takes per tick and how much heap it
+allocates, per FSM state and per task, and fails when a key goes over
+its budget.
+
+On a PC the controller is driven through every DroneState on a virtual
+clock against the fake API: a full delivery, plus one rejected order
+accept for the ERROR -> IDLE path. Latency and allocations are measured
+in two separate runs, because tracemalloc slows every allocation down.
+
+On the device it profiles the real controller against the configured
+server for a while and checks the states it went through.
+
+Usage:
+    python sim/tick_bench.py [--budgets FILE.json] [--json]
+    mpremote run sim/tick_bench.py          (device, 120 s live run)
+"""
+
+import os
+import sys
+import gc
+
+try:
+    _base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+except AttributeError:
+    # MicroPython: no os.path, the project folders sit at the root
+    _base_dir = ""
+for _folder in ("config", "core", "modules", "utils", "hal", "sim", "libs"):
+    sys.path.append(_base_dir + "/" + _folder)
+if _base_dir:
+    sys.path.append(_base_dir)
+
+from config import API_CONFIG
+from helpers import set_logging
+from clock import now_ms, sleep_ms
+from hal import HOST
+from state_machine import DroneState, STATE_NAMES
+from tick_profiler import TickProfiler
+from main import RobotControllerFSM
+
+# Budgets: key -> (p99 latency in microseconds, p99 bytes allocated per tick)
+# Keys are "state:<NAME>", "task:<name>" and "loop" (one scheduler pass);
+# "state:*" and "task:*" apply to keys without their own entry.
+# Host latency leaves 5-10x headroom over a desktop CPU at p99 (ticks that
+# rarely run have few samples, so their p99 is close to their worst case);
+# allocations are deterministic and get about 2x
+HOST_BUDGETS = {
+    "loop": (1000, 16384),
+    "state:*": (500, 4096),
+    "state:CHECK_ORDERS": (1000, 16384),
+    "state:ORDER_ASSIGNED": (1000, 8192),
+    "state:AT_CHARGING_STATION": (500, 8192),  # sends a forced status update
+    "task:*": (500, 4096),
+    "task:telemetry": (1000, 8192),
+    "task:outbox": (1000, 8192),  # sends the order phase updates
+    "task:wifi_scan": (1000, 16384),  # one scan and cache write after the access point changed
+}
+
+# Starting points for an ESP32 at 240 MHz; network-bound keys are
+# dominated by the round trip and only guard against runaway ticks
+DEVICE_BUDGETS = {
+    "loop": (1500000, 16384),
+    "state:*": (20000, 2048),
+    "state:CHECK_ORDERS": (1500000, 16384),
+    "state:ORDER_ASSIGNED": (1500000, 16384),
+    "state:FLIGHT_TO_PICKUP": (1000000, 8192),
+    "state:FLIGHT_TO_DROPOFF": (1000000, 8192),
+    "state:FLIGHT_TO_CHARGING": (1000000, 8192),
+    "state:PACKAGE_DELIVERED": (1000000, 8192),
+    "state:AT_CHARGING_STATION": (1000000, 8192),
+    "state:IDLE": (1000000, 8192),
+    "task:*": (20000, 2048),
+    "task:telemetry": (1000000, 8192),
+    "task:wifi_scan": (5000000, 8192),  # all-channel scan, only while not delivering
+}
+
+
+def budget_for(budgets, key):
+    """
+    Get the budget that applies to a key
+
+    Returns:
+        tuple: (p99 latency us, p99 bytes), or None if there is none
+    """
+    if key in budgets:
+        return budgets[key]
+    return budgets.get(key.split(":")[0] + ":*")
+
+
+def run_profiled(runtime, profiler, should_continue):
+    """
+    Run the runtime's jobs like Runtime.run_until, timing every pass
+
+    Args:
+        runtime: Runtime with the controller's tasks
+        profiler: TickProfiler to record into (the pass is keyed "loop")
+        should_continue: Callable; stops when it returns False
+    """
+    scheduler = runtime.scheduler
+    wakeups = runtime._wakeups
+    runtime.running = True
+    while runtime.running and should_continue():
+        while wakeups:
+            scheduler.reschedule(wakeups.pop(0))
+        delay = profiler.measure("loop", scheduler.run_due)
+        if delay is None:
+            break
+        if not wakeups:
+            sleep_ms(min(delay, runtime.max_idle_ms))
+    runtime.running = False
+
+
+class RejectFirst:
+    """
+    Transport wrapper that rejects the first request to a path (409, not
+    retried by the API client), so the controller goes through ERROR and
+    back to IDLE
+    """
+
+    def __init__(self, inner, path_suffix):
+        self.inner = inner
+        self.path_suffix = path_suffix
+        self.rejected = False
+
+    def __call__(self, method, url, body, headers):
+        if not self.rejected and url.endswith(self.path_suffix):
+            self.rejected = True
+            return 409, b'{"error": "Injected by tick benchmark"}'
+        return self.inner(method, url, body, headers)
+
+
+def profile_mission(track_alloc, board=0):
+    """
+    Drive one controller through every state on a virtual clock (host)
+
+    Args:
+        track_alloc: Measure allocations (run under tracemalloc)
+        board: Simulated board for this run's pins
+
+    Returns:
+        TickProfiler: Samples for the run
+    """
+    import host_machine
+    from clock import VirtualClock, set_clock
+    from hal import urequests
+    from fake_api import FakeApi, OrderStatus
+    from mission_sim import build_world, Recipient, STATION_NODE_ID, PICKUP_NODE_ID, DROPOFF_NODE_ID
+
+    profiler = TickProfiler(track_alloc=track_alloc)
+    clock = VirtualClock()
+    set_clock(clock)
+    api = FakeApi()
+    build_world(api, 300)
+    urequests.transport = RejectFirst(api, "/accept")
+    API_CONFIG["START_NODE"] = STATION_NODE_ID
+    host_machine.set_board(board)
+
+    try:
+        controller = RobotControllerFSM(headless=True)
+        if not controller.initialize():
+            raise RuntimeError("Controller initialization failed")
+
+        runtime = controller.setup_runtime(
+            wrap_task=profiler.wrap_task(controller, STATE_NAMES))
+        recipient = Recipient(controller)
+        runtime.add_task("sim-recipient", recipient.tick, 500)
+        order_id = api.add_order(PICKUP_NODE_ID, DROPOFF_NODE_ID, name="Bench parcel")
+
+        def keep_running():
+            # Done once the drone has charged for a few ticks after the delivery
+            order = api.orders[order_id]
+            charging = profiler.samples.get("state:CHARGING")
+            done = (order["status"] == OrderStatus.DELIVERED
+                    and controller.fsm.current_state == DroneState.CHARGING
+                    and charging is not None and charging.count >= 10)
+            return not done and clock.now < 3600000
+
+        gc.collect()
+        run_profiled(runtime, profiler, keep_running)
+    finally:
+        urequests.transport = None
+        set_clock(None)
+    return profiler
+
+
+def profile_live(duration_s=120):
+    """
+    Profile the real controller for a while (device)
+
+    Returns:
+        TickProfiler: Samples for the run
+    """
+    profiler = TickProfiler(max_samples=128, track_alloc=True)
+    controller = RobotControllerFSM()
+    if not controller.initialize():
+        raise RuntimeError("Controller initialization failed")
+    runtime = controller.setup_runtime(wrap_task=profiler.wrap_task(controller, STATE_NAMES))
+    end = now_ms() + duration_s * 1000
+    gc.collect()
+    try:
+        run_profiled(runtime, profiler, lambda: now_ms() < end)
+    finally:
+        controller.shutdown()
+    return profiler
+
+
+def combine(latency, alloc=None):
+    """
+    Merge latency stats with allocation stats from a separate run
+
+    Returns:
+        dict: key -> stats
+    """
+    stats = latency.stats()
+    if alloc is not None:
+        for key, alloc_stats in alloc.stats().items():
+            entry = stats.setdefault(key, dict(alloc_stats, p50_us=None, p99_us=None, max_us=None))
+            entry["alloc_p50"] = alloc_stats["alloc_p50"]
+            entry["alloc_p99"] = alloc_stats["alloc_p99"]
+    return stats
+
+
+def check(stats, budgets, required_states=None):
+    """
+    Compare stats with budgets
+
+    Args:
+        stats: key -> stats (see combine)
+        budgets: key -> (p99 us, p99 bytes)
+        required_states: Optional state names that must have been visited
+
+    Returns:
+        list: Failure messages (empty when everything is within budget)
+    """
+    failures = []
+    for key in sorted(stats):
+        entry = stats[key]
+        budget = budget_for(budgets, key)
+        if budget is None:
+            continue
+        max_us, max_bytes = budget
+        if entry["p99_us"] is not None and entry["p99_us"] > max_us:
+            failures.append("{}: p99 {} us > {} us".format(key, entry["p99_us"], max_us))
+        if entry["alloc_p99"] is not None and entry["alloc_p99"] > max_bytes:
+            failures.append("{}: p99 {} B allocated > {} B".format(key, entry["alloc_p99"], max_bytes))
+    for name in required_states or ():
+        if "state:" + name not in stats:
+            failures.append("state:{}: never visited".format(name))
+    return failures
+
+
+def print_report(stats, budgets):
+    """
+    Print a per-key table with budgets
+    """
+    def cell(value):
+        return "-" if value is None else str(value)
+
+    print("{:<34} {:>6} {:>8} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+        "key", "ticks", "p50 us", "p99 us", "budget", "p50 B", "p99 B", "budget", "max us"))
+    for key in sorted(stats):
+        entry = stats[key]
+        budget = budget_for(budgets, key) or (None, None)
+        print("{:<34} {:>6} {:>8} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+            key, entry["count"], cell(entry["p50_us"]), cell(entry["p99_us"]), cell(budget[0]),
+            cell(entry["alloc_p50"]), cell(entry["alloc_p99"]), cell(budget[1]),
+            cell(entry["max_us"])))
+
+
+def load_budgets(path):
+    """
+    Read budgets from a JSON file: {"key": [p99_us, p99_bytes], ...}
+    """
+    import json
+    with open(path) as f:
+        return {key: tuple(value) for key, value in json.load(f).items()}
+
+
+def main():
+    """
+    Run the benchmark; exits with status 1 when a budget is exceeded
+    """
+    if HOST:
+        import argparse
+        import json
+        import tracemalloc
+
+        parser = argparse.ArgumentParser(description="Per-tick latency and allocation benchmark")
+        parser.add_argument("--budgets", help="JSON file replacing the built-in host budgets")
+        parser.add_argument("--json", action="store_true", help="print stats as JSON")
+        parser.add_argument("--verbose", action="store_true", help="show controller logs")
+        args = parser.parse_args()
+        budgets = load_budgets(args.budgets) if args.budgets else HOST_BUDGETS
+
+        set_logging(args.verbose)
+        try:
+            latency = profile_mission(track_alloc=False, board=0)
+            tracemalloc.start()
+            try:
+                alloc = profile_mission(track_alloc=True, board=1)
+            finally:
+                tracemalloc.stop()
+        finally:
+            set_logging(True)
+
+        stats = combine(latency, alloc)
+        required = STATE_NAMES
+        if args.json:
+            print(json.dumps(stats, indent=2, sort_keys=True))
+    else:
+        budgets = DEVICE_BUDGETS
+        stats = combine(profile_live())
+        required = None
+
+    print_report(stats, budgets)
+    failures = check(stats, budgets, required)
+    if failures:
+        print("")
+        print("Over budget:")
+        for failure in failures:
+            print("  " + failure)
+        sys.exit(1)
+    print("")
+    print("All ticks within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Outbox Test - offline flight track and live status coalescing
+Runs on the PC (host backend) or on the board:
+
+    python test_outbox.py
+    mpremote run test_outbox.py
+"""
+
+import os
+import sys
+
+try:
+    _base_dir = os.path.dirname(os.path.abspath(__file__))
+except AttributeError:
+    # MicroPython: no os.path, the project folders sit at the root
+    _base_dir = ""
+for _folder in ("config", "core", "modules", "utils", "hal"):
+    sys.path.append(_base_dir + "/" + _folder)
+
+from helpers import set_logging
+from outbox import Outbox, MessageKind
+
+TEST_PATH = "/outbox_test.bin"
+SAMPLES = 10
+
+
+def new_outbox():
+    """Outbox on an empty test file, with coalescing on"""
+    outbox = Outbox(path=TEST_PATH, capacity=64, coalesce=True)
+    outbox.drop(len(outbox))
+    return outbox
+
+
+def push_samples(outbox, count, coalesce=False):
+    """Push count status samples along a line, one second apart"""
+    for i in range(count):
+        outbox.push_status_sample("Delivering", 90 - i, None, 7, 50.0 + i / 1000, 36.0,
+                                  seconds=1700000000 + i, coalesce=coalesce)
+
+
+def test_offline_track_kept():
+    """Every sample stored while offline comes back out, in order"""
+    outbox = new_outbox()
+    push_samples(outbox, SAMPLES)
+    messages = outbox.peek(SAMPLES + 1)
+    assert len(outbox) == SAMPLES, len(outbox)
+    assert outbox.coalesced == 0, outbox.coalesced
+    assert [m["time"] for m in messages] == [1700000000 + i for i in range(SAMPLES)]
+    sequences = [m["sequence"] for m in messages]
+    assert len(set(sequences)) == SAMPLES, sequences
+    assert all(m["kind"] == MessageKind.STATUS for m in messages)
+    outbox.close()
+    print("offline track: {} samples in, {} out".format(SAMPLES, len(messages)))
+
+
+def test_live_update_coalesced():
+    """An unsent live update is replaced by the next one"""
+    outbox = new_outbox()
+    push_samples(outbox, SAMPLES, coalesce=True)
+    assert len(outbox) == 1, len(outbox)
+    assert outbox.peek(1)[0]["time"] == 1700000000 + SAMPLES - 1
+    outbox.close()
+    print("live updates: {} in, 1 kept".format(SAMPLES))
+
+
+def test_sent_record_not_coalesced():
+    """A live update that was sent once (answer lost) is not replaced"""
+    outbox = new_outbox()
+    push_samples(outbox, 1, coalesce=True)
+    outbox.take()
+    outbox.release(False)
+    push_samples(outbox, 1, coalesce=True)
+    assert len(outbox) == 2, len(outbox)
+    outbox.close()
+    print("retried update kept")
+
+
+if __name__ == '__main__':
+    set_logging(False)
+    test_offline_track_kept()
+    test_live_update_coalesced()
+    test_sent_record_not_coalesced()
+    print("All outbox tests passed")
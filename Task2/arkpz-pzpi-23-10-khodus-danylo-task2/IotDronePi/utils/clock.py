@@ -0,0 +1,126 @@
+"""
+Monotonic Clock
+Millisecond time base shared by the scheduler, simulators and managers
+Uses time.ticks_ms on MicroPython and time.monotonic on CPython;
+a VirtualClock can be installed with set_clock() for simulation
+"""
+
+import time
+
+if hasattr(time, "ticks_ms"):
+    _ticks_ms = time.ticks_ms
+    _ticks_diff = time.ticks_diff
+else:
+    def _ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def _ticks_diff(end, start):
+        return end - start
+
+_last_ticks = _ticks_ms()
+_now = 0
+
+# Injected clock (see set_clock); None uses the system ticks
+_source = None
+
+
+class VirtualClock:
+    """
+    Simulated time that only moves when something sleeps
+    With this clock installed, sleep_ms() returns immediately after
+    jumping the time forward, so the scheduler goes straight from one
+    deadline to the next instead of waiting for it
+    """
+
+    def __init__(self, start_ms=0):
+        """
+        Args:
+            start_ms: Initial time in milliseconds
+        """
+        self.now = start_ms
+
+    def now_ms(self):
+        return self.now
+
+    def sleep_ms(self, ms):
+        if ms > 0:
+            self.now += ms
+
+    def advance_to(self, time_ms):
+        """
+        Jump forward to an absolute time (never backwards)
+
+        Args:
+            time_ms: Target now_ms() value
+        """
+        if time_ms > self.now:
+            self.now = time_ms
+
+
+def set_clock(clock):
+    """
+    Install a clock object (with now_ms() and sleep_ms(ms)) as time source
+
+    Args:
+        clock: Clock to use, or None to go back to the system ticks
+    """
+    global _source
+    _source = clock
+
+
+def get_clock():
+    """
+    Get the installed clock
+
+    Returns:
+        VirtualClock: Installed clock, or None when using the system ticks
+    """
+    return _source
+
+
+def now_ms():
+    """
+    Get milliseconds since boot as a non-wrapping integer
+    ticks_ms wraps on the device, so the elapsed ticks are accumulated here
+
+    Returns:
+        int: Milliseconds since the clock module was loaded
+    """
+    if _source is not None:
+        return _source.now_ms()
+
+    global _last_ticks, _now
+    ticks = _ticks_ms()
+    _now += _ticks_diff(ticks, _last_ticks)
+    _last_ticks = ticks
+    return _now
+
+
+def elapsed_ms(since_ms):
+    """
+    Get milliseconds elapsed since a previous now_ms() value
+
+    Args:
+        since_ms: Earlier now_ms() value
+
+    Returns:
+        int: Elapsed milliseconds
+    """
+    return now_ms() - since_ms
+
+
+def sleep_ms(ms):
+    """
+    Block for a number of milliseconds
+
+    Args:
+        ms: Milliseconds to sleep
+    """
+    if ms <= 0:
+        return
+    if _source is not None:
+        _source.sleep_ms(ms)
+    elif hasattr(time, "sleep_ms"):
+        time.sleep_ms(ms)
+    else:
+        time.sleep(ms / 1000)
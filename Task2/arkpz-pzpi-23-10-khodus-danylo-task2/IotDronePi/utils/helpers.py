@@ -1,6 +1,29 @@
 import math
 import time
 
+try:
+    import urandom as random
+except ImportError:
+    import random
+
+# Log output switch (see set_logging)
+_log_enabled = True
+
+# time.time() values below this are an unset clock (see clock_valid)
+CLOCK_VALID_AFTER = 1700000000
+
+
+def set_logging(enabled):
+    """
+    Turn log output on or off (simulations run thousands of log calls)
+
+    Args:
+        enabled: False to drop every log message
+    """
+    global _log_enabled
+    _log_enabled = enabled
+
+
 def log_message(message, level="INFO"):
     """
     Print formatted log message with timestamp
@@ -9,6 +32,8 @@ def log_message(message, level="INFO"):
         message: Message to log
         level: Log level (INFO, WARNING, ERROR, DEBUG)
     """
+    if not _log_enabled:
+        return
     timestamp = time.localtime()
     time_str = "{:02d}:{:02d}:{:02d}".format(
         timestamp[3], timestamp[4], timestamp[5]
@@ -118,6 +143,47 @@ def format_status(status):
     }
     return status_map.get(status.lower(), "Idle")
 
+def format_timestamp(seconds=None):
+    """
+    Format a time as an ISO 8601 UTC timestamp for the server
+
+    Args:
+        seconds: time.time() value (default: now)
+
+    Returns:
+        str: e.g. "2025-01-31T12:00:00Z"
+    """
+    # UTC, as the "Z" says (a host's localtime has its own offset)
+    t = time.gmtime(seconds) if seconds is not None else time.gmtime()
+    return "{:04d}-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}Z".format(
+        t[0], t[1], t[2], t[3], t[4], t[5]
+    )
+
+def clock_valid():
+    """
+    Check if the wall clock is set (no NTP or RTC yet means time.time()
+    counts from boot, so stored times cannot be compared with it)
+    """
+    return time.time() > CLOCK_VALID_AFTER
+
+def backoff_ms(attempt, base_ms, max_ms):
+    """
+    Get the delay before a retry: exponential, capped, with jitter
+    (a random value in the upper half, so robots that failed together
+    do not retry together)
+
+    Args:
+        attempt: Retry number, starting at 0
+        base_ms: Delay of the first retry
+        max_ms: Delay cap
+
+    Returns:
+        int: Delay in milliseconds
+    """
+    delay = min(max_ms, base_ms << attempt)
+    half = delay // 2
+    return half + random.getrandbits(16) % (half + 1)
+
 def clamp(value, min_value, max_value):
     """
     Clamp value between min and max
@@ -0,0 +1,189 @@
+"""
+Tick Profiler
+Per-tick latency and heap allocation samples for runtime jobs, keyed by
+FSM state or task name. Works on MicroPython (time.ticks_us,
+gc.mem_alloc) and on CPython (perf_counter_ns, tracemalloc)
+"""
+
+import gc
+import time
+from array import array
+
+if hasattr(time, "ticks_us"):
+    _ticks_us = time.ticks_us
+    _ticks_diff = time.ticks_diff
+else:
+    def _ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def _ticks_diff(end, start):
+        return end - start
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def _alloc_probe():
+    """
+    Pick a (start, stop) pair that measures bytes allocated in between
+
+    Returns:
+        tuple: (start, stop) callables, or None if nothing can measure it
+    """
+    if hasattr(gc, "mem_alloc"):
+        # MicroPython: heap in use grows by every allocation while the
+        # collector is held off
+        def start():
+            gc.disable()
+            return gc.mem_alloc()
+
+        def stop(before):
+            used = gc.mem_alloc() - before
+            gc.enable()
+            return used
+        return start, stop
+
+    if tracemalloc is not None and tracemalloc.is_tracing():
+        # CPython: peak traced memory above the level at the start
+        def start():
+            tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0]
+
+        def stop(before):
+            return tracemalloc.get_traced_memory()[1] - before
+        return start, stop
+
+    return None
+
+
+def percentile(samples, p):
+    """
+    Get a percentile of a list of samples (nearest rank)
+
+    Args:
+        samples: Sequence of numbers
+        p: Percentile, 0-100
+
+    Returns:
+        int: Sample value, or None if there are no samples
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = (len(ordered) * p + 99) // 100
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+class TickSamples:
+    """
+    Latency and allocation samples for one key
+    Keeps the last max_samples ticks in fixed arrays, plus totals
+    """
+
+    def __init__(self, max_samples):
+        self.max_samples = max_samples
+        self.latency_us = array('l')
+        self.alloc_bytes = array('l')
+        self.count = 0
+        self.max_us = 0
+
+    def add(self, latency_us, alloc):
+        index = self.count % self.max_samples
+        if len(self.latency_us) < self.max_samples:
+            self.latency_us.append(latency_us)
+            if alloc is not None:
+                self.alloc_bytes.append(alloc)
+        else:
+            self.latency_us[index] = latency_us
+            if alloc is not None:
+                self.alloc_bytes[index] = alloc
+        self.count += 1
+        if latency_us > self.max_us:
+            self.max_us = latency_us
+
+
+class TickProfiler:
+    """
+    Measures runtime jobs tick by tick
+    The controller's FSM job is keyed by the state it ran in
+    ("state:LOADING"), every other job by its task name ("task:telemetry")
+    """
+
+    def __init__(self, max_samples=1024, track_alloc=False):
+        """
+        Args:
+            max_samples: Samples kept per key (older ones are overwritten)
+            track_alloc: Also measure bytes allocated per tick (on CPython
+                         this needs tracemalloc.start() first)
+        """
+        self.max_samples = max_samples
+        self.samples = {}
+        self._probe = _alloc_probe() if track_alloc else None
+
+    def measure(self, key, func):
+        """
+        Run func once and record it under key
+
+        Returns:
+            Whatever func returns
+        """
+        probe = self._probe
+        before = probe[0]() if probe else 0
+        start = _ticks_us()
+        try:
+            return func()
+        finally:
+            elapsed = _ticks_diff(_ticks_us(), start)
+            alloc = probe[1](before) if probe else None
+            samples = self.samples.get(key)
+            if samples is None:
+                samples = self.samples[key] = TickSamples(self.max_samples)
+            samples.add(elapsed, alloc)
+
+    def wrap_task(self, controller, state_names):
+        """
+        Build a setup_runtime(wrap_task=...) hook for a controller
+
+        Args:
+            controller: RobotControllerFSM whose jobs are measured
+            state_names: State names indexed by state ID
+
+        Returns:
+            callable: wrap_task(name, func)
+        """
+        state_keys = tuple("state:" + name for name in state_names)
+        fsm = controller.fsm
+
+        def wrap(name, func):
+            if name == "fsm":
+                def tick():
+                    return self.measure(state_keys[fsm.current_state], func)
+            else:
+                key = "task:" + name
+
+                def tick():
+                    return self.measure(key, func)
+            return tick
+        return wrap
+
+    def stats(self):
+        """
+        Summarize every key
+
+        Returns:
+            dict: key -> dict with count, p50_us, p99_us, max_us,
+                  alloc_p50 and alloc_p99 (None when not measured)
+        """
+        result = {}
+        for key, samples in self.samples.items():
+            result[key] = {
+                "count": samples.count,
+                "p50_us": percentile(samples.latency_us, 50),
+                "p99_us": percentile(samples.latency_us, 99),
+                "max_us": samples.max_us,
+                "alloc_p50": percentile(samples.alloc_bytes, 50),
+                "alloc_p99": percentile(samples.alloc_bytes, 99)
+            }
+        return result